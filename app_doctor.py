@@ -3,6 +3,11 @@ from PyQt5.QtWidgets import QFileDialog
 from PyQt5.QtCore import QObject
 from gui_doctor import Ui_MainWindow
 import sys
+from pathlib import Path
+import check_tiles
+import doctor_report
+import func_doctor
+import log_view
 class Stream(QtCore.QObject):
     # * Stream object for console output text
     newText = QtCore.pyqtSignal(str)
@@ -16,26 +21,11 @@ class ApplicationWindow(QtWidgets.QMainWindow):
     def __init__(self):
         super(ApplicationWindow, self).__init__()
 
-        # * Process and Signals for Run
-        self.process_run = QtCore.QProcess(self)
-        self.process_run.readyRead.connect(self.dataReady_run)
-       
-        self.process_run.started.connect(lambda: self.ui.run_button.setEnabled(False))
-        self.process_run.started.connect(lambda: self.ui.download_button.setEnabled(False))
-
-        self.process_run.finished.connect(lambda: self.ui.run_button.setEnabled(True))
-        self.process_run.finished.connect(lambda: self.ui.download_button.setEnabled(True))
-
-        self.process_run.setProcessChannelMode(QtCore.QProcess.MergedChannels)
-
-        # * Process and Signals for Download
+        # * Process and Signals for Download, checks run in-process meanwhile (see check_tiles.py)
         self.process_download = QtCore.QProcess(self)
         self.process_download.readyRead.connect(self.dataReady_download)
        
-        self.process_download.started.connect(lambda: self.ui.run_button.setEnabled(False))
         self.process_download.started.connect(lambda: self.ui.download_button.setEnabled(False))
-
-        self.process_download.finished.connect(lambda: self.ui.run_button.setEnabled(True))
         self.process_download.finished.connect(lambda: self.ui.download_button.setEnabled(True))
 
         self.process_download.setProcessChannelMode(QtCore.QProcess.MergedChannels)
@@ -46,6 +36,11 @@ class ApplicationWindow(QtWidgets.QMainWindow):
 
         self.ui = Ui_MainWindow()
         self.ui.setupUi(self)
+        view = log_view.replace_console(self.ui, "doctor") # bounded, batched console, see log_view.py
+        log_view.add_search_dock(self, view) # Ctrl+F
+        self.checks_dock = check_tiles.ChecksDock(self)
+        self.addDockWidget(QtCore.Qt.RightDockWidgetArea, self.checks_dock)
+        self.checks_dock.finished.connect(self.on_checks_finished)
 
 
         # * Buttons
@@ -60,13 +55,7 @@ class ApplicationWindow(QtWidgets.QMainWindow):
         sys.stdout = Stream(newText=self.on_update_consoleOutput_textbrowser)
 
     def get_args(self, option):
-        if option == 'run':
-            args = [
-                "python3",
-                "bcbio_doctor.py",
-                self.genome_path if self.genome_path else ''
-            ]
-        elif option == 'download':
+        if option == 'download':
             args = [
                 "python3",
                 "bcbio_doctor.py",
@@ -89,36 +78,33 @@ class ApplicationWindow(QtWidgets.QMainWindow):
             print ("Please set an output path first!")
         else:
             args = self.get_args('download')
+            self.ui.consoleOutput_textbrowser.start_run_log(log_view.default_spill_path("doctor-download"))
             self.process_download.start(args[0],args[1:])
 
 
     def on_push_run(self):
-        args = self.get_args('run')
-        self.process_run.start(args[0],args[1:])
-
-    def dataReady_run(self):
-        cursor = self.ui.consoleOutput_textbrowser.textCursor()
-        cursor.movePosition(cursor.End)
-        Qbyte_stdout = (self.process_run.readAll())
-        cursor.insertText(Qbyte_stdout.data().decode())
-        self.ui.consoleOutput_textbrowser.setTextCursor(cursor)
-        self.ui.consoleOutput_textbrowser.ensureCursorVisible()
+        genomes_path = Path(self.genome_path) if self.genome_path else None
+        # * gtfs are scanned in one process, forking from the checks' thread isn't safe in a Qt app
+        checks = func_doctor.doctor_checks(genomes_path, workers=1)
+        if self.checks_dock.run(checks):
+            self.ui.run_button.setEnabled(False)
+            self.ui.consoleOutput_textbrowser.start_run_log(log_view.default_spill_path("doctor-run"))
+            print(f"Running {len(checks)} checks...\n")
+
+    def on_checks_finished(self, records):
+        doctor_report.print_report(records)
+        self.ui.run_button.setEnabled(True)
 
     def dataReady_download(self):
-        cursor = self.ui.consoleOutput_textbrowser.textCursor()
-        cursor.movePosition(cursor.End)
-        Qbyte_stdout = (self.process_download.readAll())
-        cursor.insertText(Qbyte_stdout.data().decode())
-        self.ui.consoleOutput_textbrowser.setTextCursor(cursor)
-        self.ui.consoleOutput_textbrowser.ensureCursorVisible()
+        self.ui.consoleOutput_textbrowser.feed_bytes(self.process_download.readAll().data(), source="download")
 
 
     def on_update_consoleOutput_textbrowser(self, text):
-        cursor = self.ui.consoleOutput_textbrowser.textCursor()
-        cursor.movePosition(QtGui.QTextCursor.End)
-        cursor.insertText(text)
-        self.ui.consoleOutput_textbrowser.setTextCursor(cursor)
-        self.ui.consoleOutput_textbrowser.ensureCursorVisible()
+        self.ui.consoleOutput_textbrowser.feed_text(text)
+
+    def closeEvent(self, event):
+        self.ui.consoleOutput_textbrowser.close_spill()
+        event.accept()
 
 
     def on_push_genomeBrowse(self):
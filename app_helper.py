@@ -2,7 +2,9 @@ from PyQt5 import QtWidgets, QtCore, QtGui
 from PyQt5.QtWidgets import QFileDialog
 from PyQt5.QtCore import QObject, QThreadPool, QRunnable, pyqtSlot, pyqtSignal
 from gui_helper import Ui_MainWindow
-import sys, subprocess, psutil
+import sys, subprocess, psutil, traceback
+from pathlib import Path
+import input_check, log_view, process_control, run_dashboard, run_queue
 
 
 class Stream(QtCore.QObject):
@@ -19,8 +21,122 @@ class WorkerSignals(QObject):
     
     finished = pyqtSignal()
     error = pyqtSignal(tuple)
-    # result = pyqtSignal()
+    result = pyqtSignal(object)
     progress = pyqtSignal(str)
+    rows = pyqtSignal(list)
+
+class Worker(QRunnable):
+    # * Runs fn(*args, **kwargs, progress_callback=, rows_callback=) on the thread pool
+    def __init__(self, fn, *args, **kwargs):
+        super(Worker, self).__init__()
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.signals = WorkerSignals()
+        self.kwargs["progress_callback"] = self.signals.progress
+        self.kwargs["rows_callback"] = self.signals.rows
+
+    @pyqtSlot()
+    def run(self):
+        try:
+            result = self.fn(*self.args, **self.kwargs)
+        except Exception as e:
+            self.signals.error.emit((type(e), e, traceback.format_exc()))
+        else:
+            self.signals.result.emit(result)
+        finally:
+            self.signals.finished.emit()
+
+def stop_run(pid, work_dir, progress_callback, rows_callback):
+    return process_control.shutdown_tree(pid, on_progress=progress_callback.emit, work_dir=work_dir)
+
+def discover_samples(data_path, progress_callback, rows_callback):
+    # * streams the rows of the sample table in batches
+    found = problems = 0
+    for batch in input_check.discover_fastqs(data_path):
+        rows_callback.emit(batch)
+        found += len(batch)
+        problems += sum(1 for row in batch if row["problem"])
+        progress_callback.emit(f"Found {found} samples...")
+    return found, problems
+
+def list_samples(data_path, progress_callback, rows_callback):
+    # * the sample names of the table, when the table wasn't filled for this folder
+    return sorted({row["sample"] for batch in input_check.discover_fastqs(data_path) for row in batch})
+
+def check_references(fasta_path, gtf_path, progress_callback, rows_callback):
+    findings = []
+    if fasta_path:
+        progress_callback.emit("Checking FASTA...")
+        findings += input_check.check_fasta(fasta_path)
+    if gtf_path:
+        progress_callback.emit("Checking GTF...")
+        findings += input_check.check_gtf(gtf_path)
+    if fasta_path and gtf_path and not any(level == "ERROR" for level, _ in findings):
+        progress_callback.emit("Matching FASTA and GTF transcripts...")
+        findings += input_check.check_pair(fasta_path, gtf_path)
+    return findings
+
+class SampleTableModel(QtCore.QAbstractTableModel):
+    # * Lazy table of input_check.discover_fastqs rows, the view asks for more rows as it scrolls
+    HEADERS = ["Sample", "Read 1", "Read 2", "Size", "Problem"]
+    FETCH = 1000
+
+    def __init__(self, parent=None):
+        super(SampleTableModel, self).__init__(parent)
+        self.rows = []
+        self.shown = 0
+
+    def clear(self):
+        self.beginResetModel()
+        self.rows = []
+        self.shown = 0
+        self.endResetModel()
+
+    def append_rows(self, rows):
+        self.rows.extend(rows)
+        if self.shown < self.FETCH: # fill the first screen right away, the rest on scroll
+            self.fetchMore(QtCore.QModelIndex())
+
+    def canFetchMore(self, parent):
+        return not parent.isValid() and self.shown < len(self.rows)
+
+    def fetchMore(self, parent):
+        count = min(self.FETCH, len(self.rows) - self.shown)
+        if count <= 0:
+            return
+        self.beginInsertRows(QtCore.QModelIndex(), self.shown, self.shown + count - 1)
+        self.shown += count
+        self.endInsertRows()
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else self.shown
+
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else len(self.HEADERS)
+
+    def headerData(self, section, orientation, role=QtCore.Qt.DisplayRole):
+        if role == QtCore.Qt.DisplayRole and orientation == QtCore.Qt.Horizontal:
+            return self.HEADERS[section]
+        return None
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        row = self.rows[index.row()]
+        if role == QtCore.Qt.ForegroundRole and row["problem"]:
+            return QtGui.QBrush(QtCore.Qt.red)
+        if role != QtCore.Qt.DisplayRole:
+            return None
+        column = index.column()
+        if column == 0:
+            return row["sample"]
+        if column in (1, 2):
+            path = row["read_1"] if column == 1 else row["read_2"]
+            return Path(path).name if path else ""
+        if column == 3:
+            return f"{row['size'] / 1e9:.2f} GB"
+        return row["problem"] or ""
 
 class ApplicationWindow(QtWidgets.QMainWindow):
     def __init__(self):
@@ -52,9 +168,52 @@ class ApplicationWindow(QtWidgets.QMainWindow):
         self.aligner = ""
         self.cores = ""
         self.run_name = ""
+        self.run_work_dir = None # of the run that was started last, the only folder a stop cleans up
 
         self.ui = Ui_MainWindow()
         self.ui.setupUi(self)
+        self.ui.cores_lineedit.setPlaceholderText("auto") # sized to this machine when left empty
+        view = log_view.replace_console(self.ui, "helper") # bounded, batched console, see log_view.py
+        log_view.add_search_dock(self, view) # Ctrl+F
+
+        # * Dashboard, follows the run from its output and its process tree
+        self.dashboard = run_dashboard.DashboardDock(self)
+        self.addDockWidget(QtCore.Qt.RightDockWidgetArea, self.dashboard)
+        self.dashboard.hide()
+        view.flushed.connect(self.dashboard.feed)
+        self.process.started.connect(self.on_run_started)
+        self.runs_started = 0 # sample names that arrive after a newer run started are dropped
+        self.process.finished.connect(self.dashboard.stop)
+
+        # * Input validation, runs on the thread pool as soon as a path is picked
+        self.threadpool = QThreadPool()
+        self.validation = {"samples": 0, "reference": 0} # latest job of each kind, older results are dropped
+        self.samples_path = None # data folder of the Samples table, once all of it was found
+        self.samples_model = SampleTableModel(self)
+        samples_view = QtWidgets.QTableView()
+        samples_view.setModel(self.samples_model)
+        samples_view.verticalHeader().setDefaultSectionSize(samples_view.fontMetrics().height() + 4)
+        samples_view.horizontalHeader().setStretchLastSection(True)
+        self.samples_status = QtWidgets.QLabel("Pick a data folder to list its samples")
+        samples_widget = QtWidgets.QWidget()
+        samples_layout = QtWidgets.QVBoxLayout(samples_widget)
+        samples_layout.addWidget(self.samples_status)
+        samples_layout.addWidget(samples_view)
+        self.samples_dock = QtWidgets.QDockWidget("Samples", self)
+        self.samples_dock.setObjectName("samples_dock")
+        self.samples_dock.setWidget(samples_widget)
+        self.addDockWidget(QtCore.Qt.BottomDockWidgetArea, self.samples_dock)
+        self.samples_dock.hide()
+
+        # * Queue, runs several configured runs at once within a core budget
+        self.queue_dock = run_queue.QueueDock(self.queue_arguments, self)
+        self.addDockWidget(QtCore.Qt.RightDockWidgetArea, self.queue_dock)
+        self.tabifyDockWidget(self.dashboard, self.queue_dock)
+        # * the main window's run uses the same cores as the queue's runs
+        self.process.finished.connect(lambda: self.queue_dock.queue.reserve(0))
+        self.process.errorOccurred.connect(
+            lambda error: error == QtCore.QProcess.FailedToStart and self.queue_dock.queue.reserve(0)
+        )
 
         # * Buttons
         # *     Paths
@@ -72,39 +231,53 @@ class ApplicationWindow(QtWidgets.QMainWindow):
         sys.stdout = Stream(newText=self.on_update_consoleOutput_textbrowser)
 
     def closeEvent(self, event):
-        self.on_push_kill()
+        self.shutdown_run(wait=True) # the thread pool doesn't outlive the window
+        self.queue_dock.queue.shutdown()
+        self.ui.consoleOutput_textbrowser.close_spill()
         event.accept()
 
     def dataReady(self):
-        cursor = self.ui.consoleOutput_textbrowser.textCursor()
-        cursor.movePosition(cursor.End)
-        Qbyte_stdout = (self.process.readAll())
-        cursor.insertText(Qbyte_stdout.data().decode())
-        self.ui.consoleOutput_textbrowser.setTextCursor(cursor)
-        self.ui.consoleOutput_textbrowser.ensureCursorVisible()
+        self.ui.consoleOutput_textbrowser.feed_bytes(self.process.readAll().data())
 
     @pyqtSlot()
     def on_push_kill(self):
         # self.process.kill()
-        p = psutil.Process(self.process.pid())
-        children = p.children(recursive=True)
-        p.terminate()
-        for child in children:
-            print("Killing Child " + str(child.pid))
-            try:
-                child.terminate()
-            except psutil.NoSuchProcess:
-                print("All Sub-processes KILLED!")
-                break
-        print('KILLED!')
+        self.shutdown_run(wait=False)
+
+    def shutdown_run(self, wait):
+        # * freezes the tree, SIGTERM, then SIGKILL for what is left, see process_control.shutdown_tree
+        pid = self.process.processId()
+        if not pid:
+            return
+        print("Stopping the run...\n")
+        if wait:
+            self.on_run_stopped(process_control.shutdown_tree(pid, timeout=5, work_dir=self.run_work_dir))
+            return
+        self.ui.kill_button.setEnabled(False)
+        worker = Worker(stop_run, pid, self.run_work_dir)
+        worker.signals.progress.connect(self.progress_fn)
+        worker.signals.result.connect(self.on_run_stopped)
+        worker.signals.error.connect(lambda error: print(f"ERROR: stopping the run failed: {error[1]}\n"))
+        self.threadpool.start(worker)
+
+    def on_run_stopped(self, report):
+        print(
+            f"KILLED! {report['processes']} processes, {report['killed']} of them needed SIGKILL. "
+            f"Freed {report['cores_freed']:.1f} cores and {report['memory_freed_gb']:.1f} GB of memory\n"
+        )
+        if report["tx_removed"] or report["partial"]:
+            print(
+                f"Removed {len(report['tx_removed'])} transaction folders and renamed {len(report['partial'])} "
+                f"partial outputs to *.partial, bcbio will redo those steps when the run is resumed\n"
+            )
+        if report["survivors"]:
+            print(f"WARNING: processes {report['survivors']} could not be stopped\n")
+        if report["reclaim_skipped"]:
+            print("WARNING: partial outputs were left in place since processes survived, stop them before resuming the run\n")
 
 
     def on_update_consoleOutput_textbrowser(self, text):
-        cursor = self.ui.consoleOutput_textbrowser.textCursor()
-        cursor.movePosition(QtGui.QTextCursor.End)
-        cursor.insertText(text)
-        self.ui.consoleOutput_textbrowser.setTextCursor(cursor)
-        self.ui.consoleOutput_textbrowser.ensureCursorVisible()
+        self.ui.consoleOutput_textbrowser.feed_text(text)
 
     def store_arguments(self):
         # arguments = { # this approach is for the function version
@@ -138,19 +311,79 @@ class ApplicationWindow(QtWidgets.QMainWindow):
             "--strandedness",
             self.strandedness if self.strandedness else "unstranded",
             "--cores",
-            self.cores if self.cores else "12",
+            self.cores if self.cores else "auto",
             self.run_name if self.run_name else "unnamed",
             self.outPath # ! make sure this is correct
         ]
 
         return arguments
     
+    def queue_arguments(self):
+        # * the run as configured now, for the queue
+        if not (self.dataPath and self.fastaPath and self.gtfPath and self.outPath):
+            print("Please set the data, FASTA, GTF and output paths first!\n")
+            return None
+        return (self.run_name if self.run_name else "unnamed"), self.store_arguments()
+
+    def on_run_started(self):
+        # * the dashboard follows the samples of the Samples table, or of a walk on the thread pool,
+        # * a deep data folder takes too long to walk here
+        self.runs_started += 1
+        run = self.runs_started
+        if self.dataPath and self.samples_path == self.dataPath:
+            self.dashboard.start(self.process.processId(), sorted({row["sample"] for row in self.samples_model.rows}))
+            return
+        self.dashboard.start(self.process.processId(), [])
+        if not self.dataPath:
+            return
+        worker = Worker(list_samples, self.dataPath)
+        worker.signals.result.connect(lambda samples: run == self.runs_started and self.dashboard.set_samples(samples))
+        worker.signals.error.connect(lambda error: print(f"ERROR: listing the samples of the run failed: {error[1]}\n"))
+        self.threadpool.start(worker)
+
     def progress_fn(self, progress):
         print(str(progress))
+
+    def start_validation(self, kind):
+        self.validation[kind] += 1
+        generation = self.validation[kind]
+        current = lambda: self.validation[kind] == generation
+
+        if kind == "samples":
+            self.samples_path = None
+            self.samples_model.clear()
+            self.samples_dock.show()
+            worker = Worker(discover_samples, self.dataPath)
+            worker.signals.rows.connect(lambda rows: current() and self.samples_model.append_rows(rows))
+            worker.signals.progress.connect(lambda text: current() and self.samples_status.setText(text))
+            data_path = self.dataPath
+            worker.signals.result.connect(lambda result: current() and self.on_samples_checked(data_path, *result))
+        else:
+            worker = Worker(check_references, self.fastaPath, self.gtfPath)
+            worker.signals.result.connect(lambda findings: current() and self.on_references_checked(findings))
+        worker.signals.error.connect(lambda error: current() and print(f"ERROR: checking {kind} failed: {error[1]}\n"))
+        self.threadpool.start(worker)
+
+    def on_samples_checked(self, data_path, found, problems):
+        self.samples_path = data_path # the table has every sample of the folder now
+        self.samples_status.setText(f"{found} samples" + (f", {problems} with problems" if problems else ""))
+        if problems:
+            print(f"WARNING: {problems} of {found} samples have problems, see the Samples table\n")
+
+    def on_references_checked(self, findings):
+        for level, message in findings:
+            print(f"{level}: {message}\n")
     
     @pyqtSlot()
     def on_push_run(self):
         arguments = self.store_arguments()
+        queue = self.queue_dock.queue
+        cores = run_queue.job_cores(list(arguments), queue.budget) # an auto run sizes itself to the machine
+        if queue.used() + cores > queue.budget:
+            print(f"WARNING: the queue is using {queue.used()} of its {queue.budget} cores, this run will oversubscribe them\n")
+        queue.reserve(cores) # queued runs wait for it
+        self.run_work_dir = process_control.run_work_dir(arguments[-1], arguments[-2]) # <outpath>, <run_name>
+        self.ui.consoleOutput_textbrowser.start_run_log(log_view.default_spill_path("helper-run"))
         self.process.start(arguments[0],arguments[1:])
         
 
@@ -173,6 +406,7 @@ class ApplicationWindow(QtWidgets.QMainWindow):
                 "Path to RNA Data Set!\n" + "Set to: ..." + self.dataPath + "\n"
             )
             self.ui.data_lineedit.insert(self.dataPath)
+            self.start_validation("samples")
 
     def on_push_gtfBrowse(self):
         options = QFileDialog.Options()
@@ -190,6 +424,7 @@ class ApplicationWindow(QtWidgets.QMainWindow):
                 "Path to GTF Set!\n" + "Set to: ..." + self.gtfPath + "\n"
             )
             self.ui.gtf_lineedit.insert(self.gtfPath)
+            self.start_validation("reference")
 
     def on_push_fastaBrowse(self):
         options = QFileDialog.Options()
@@ -207,6 +442,7 @@ class ApplicationWindow(QtWidgets.QMainWindow):
                 "Path to FASTA Set!\n" + "Set to: ..." + self.fastaPath + "\n"
             )
             self.ui.fasta_lineedit.insert(self.fastaPath)
+            self.start_validation("reference")
 
     def on_push_outBrowse(self):
         options = QFileDialog.Options()
@@ -2,14 +2,38 @@
 bcbio_doctor
 
 Usage:
-    bcbio_doctor.py [<genomes_path>]
-    bcbio_doctor.py (-d)  [--gtf] [--gtf_chr] [--cdna] <output_path>
+    bcbio_doctor.py [--json=<path>] [--profile] [<genomes_path>]
+    bcbio_doctor.py (-d)  [--gtf] [--gtf_chr] [--cdna] [--build=<str>] [--release=<str>] [--store=<path>] [--mirror=<url>] [--profile] <output_path>
+    bcbio_doctor.py (--catalog) [--build=<str>] [--refresh_catalog]
+    bcbio_doctor.py (--check_ids) <fasta_in> <gtf_in>
+    bcbio_doctor.py (--strip_versions) <file_in> <file_out>
+    bcbio_doctor.py (--add_versions) <gtf_in> <gtf_out>
+    bcbio_doctor.py (--bench_storage) [--input_size=<GB>] [--bench_size=<MB>] <directories>...
+    bcbio_doctor.py (--rename_chr) [--style=<str>] [--mapping=<path>] [--bench] <gtf_in> <gtf_out>
 
 Options:
     -d              runs the download script
+    --json=<path>   also writes a machine-readable report of the checks to <path> (- for stdout only)
+    --profile       profiles each check, or the download, with cProfile and prints its hottest functions
     --gtf           in download mode, downloads the gtf file with no CHR annotation
     --gtf_chr       in download mode, downloads the gtf file with CHR annotation
     --cdna          in download mode, downloads the cdna.fa file
+    --build=<str>   genome build of the reference files, e.g. hg38, mm10, mm39 (default: hg38)
+    --release=<str>     ensembl release of the reference files, or latest (default: 96)
+    --catalog       lists the reference files that can be downloaded, from the cached catalog
+    --refresh_catalog   refreshes the cached catalog from the ensembl ftp site
+    --check_ids     checks that the transcript ids of <fasta_in> and the transcript_ids of <gtf_in> match
+    --strip_versions    removes the version suffix (XXXXXXXX.XX -> XXXXXXXX) from the ids of a fasta or gtf <file_in>
+    --add_versions  adds transcript_version/gene_version to the transcript_id/gene_id of <gtf_in> (XXXXXXXX -> XXXXXXXX.XX)
+    --rename_chr    renames the seqnames of <gtf_in> (e.g. X -> chrX, MT -> chrM) into <gtf_out>
+    --style=<str>   in rename mode, ucsc to add chr or ensembl to remove it (default: ucsc)
+    --mapping=<path>    in rename mode, two column file of extra seqname renames, e.g. for scaffolds
+    --bench         in rename mode, also times the rename against the old awk one-liner
+    --bench_storage     benchmarks <directories> and recommends where the work/ and final/ directories of a run should go
+    --input_size=<GB>   in benchmark mode, total size of the input fastq files of the run (default: 10)
+    --bench_size=<MB>   in benchmark mode, size of the file written to each directory (default: 256)
+    --store=<path>  in download mode, shared reference store to link files from (default: $BCBIO_REFERENCE_STORE)
+    --mirror=<url>  in download mode, base url of a mirror to download from (default: $BCBIO_REFERENCE_MIRROR)
     <genomes_path>  if you would like bcbio_doctor to check genomes, provide a path. otherwise this step is skipped
     <output_path>   path where you want the genes to go
 """
@@ -22,17 +46,30 @@ import os
 from pathlib import Path, PurePath
 import requests
 import subprocess
+import time
 
 # pkg
 from docopt import docopt
 import yaml  # included with anaconda
 from tqdm import tqdm  # included with anaconda
 
+# lib
+import bcbio_inventory
+import doctor_report
+import fasta_tools
+import gtf_tools
+import profiling
+import reference_catalog
+import reference_store
+import storage_bench
+import tool_probe
+
 
 
 def check_PATH():
     """
-    Checks the PATH variable of the current environment, and lets you know if something is wrong
+    Checks the PATH variable of the current environment, and lets you know if something is wrong.
+    Also checks that the tools bcbio needs resolve and run, probing them all at the same time.
 
         Arguments:
 
@@ -40,7 +77,8 @@ def check_PATH():
 
         Returns:
             
-            bcbio_path (Path):  returns the path to the bcbio installation
+            report (dict):  bcbio_path (the path to the bcbio installation, or None),
+                            paths (which of the $PATH entries were found) and tools (see tool_probe.py)
     """
     
     env_paths = set(os.environ["PATH"].split(":")) # makes the paths into a set to remove duplicates
@@ -56,7 +94,7 @@ def check_PATH():
     ) # checks if there are any matches
     matching = [Path(x) for x in matching] # casts them to Paths
 
-    bcbio_bin_path = None
+    bcbio_path = None
     
     for path in matching:
         
@@ -85,15 +123,31 @@ def check_PATH():
 
         print(" FOUND") if req_paths[path][0] else print(" NOT FOUND")
 
+    print("\nHere are the tools bcbio uses, as they resolve on $PATH:\n")
+
+    tools = tool_probe.probe_tools()
+    for tool in tools:
+        status = tool["version"] if tool["version"] else tool["error"]
+        critical = "CRITICAL" if tool["critical"] and not tool["version"] else ""
+        print(f"{tool['name']:<20}{status:<24}{critical:<10}{tool['path'] or ''}")
+
+        if tool["name"] == "bcbio_nextgen.py" and tool["path"] and bcbio_path is None:
+            bcbio_path = Path(tool["path"]).parents[2] # <bcbio>/anaconda/bin/bcbio_nextgen.py
+
     print(
         "\nIf the above does not look correct, you may follow the steps for problem 1 in `bcbio_debugging.md`, but do so at your own discretion."
     )
-    return bcbio_path # returns our bcbio_path
+    return { # returns our bcbio_path, and what was found for the report
+        "bcbio_path": bcbio_path,
+        "paths": {path: found for path, (found, critical) in req_paths.items()},
+        "tools": tools,
+    }
 
 
 def check_genome_paths(bcbio_path):
     """
-    Checks to make sure the genomes are present in the bcbio installation
+    Checks to make sure the genomes and their indexes are present in the bcbio installation.
+    Index sizes are cached, so repeat runs only walk builds that have changed.
 
         Arguments:
             
@@ -101,59 +155,94 @@ def check_genome_paths(bcbio_path):
 
         Returns:
 
-            None
+            inventory (dict):   the builds, indexes and loc files found (see bcbio_inventory.py),
+                                or None if there is no bcbio installation
     """
-    run_directory = os.getcwd() # remembers the current working directory
-    os.chdir(bcbio_path) # navigates to bcbio installation
-    print("genomes FOUND in bcbio: ") if (glob.glob("genomes/*/*")) else print(
+    if bcbio_path is None:
+        print("bcbio installation NOT FOUND in $PATH, can't check genomes!")
+        return None
+
+    found = bcbio_inventory.inventory(bcbio_path)
+
+    print("genomes FOUND in bcbio: ") if found["builds"] else print(
         "genomes NOT FOUND!"
     )
-    for genome in glob.glob("genomes/*/*"):
-        print(Path(genome).name)
+    for build in found["builds"]:
+        indexes = ", ".join(
+            f"{index} ({info['size'] / 1024 ** 3:.1f} GB)" for index, info in build["indexes"].items()
+        )
+        print(f"{build['build']} ({build['species']})\t{indexes if indexes else 'no indexes'}")
+        if not build["has_seq"]:
+            print(f"\t{build['build']} has no seq/ folder, the reference FASTA is missing!")
 
-    if ("galaxy/tool-data/sam_fa_indices.loc") not in (
-        glob.glob("galaxy/**/**")
-    ):
+    if found["sam_fa_indices"] is None:
         print(
             "`sam_fa_indices.loc NOT FOUND! Check problem 2 in `bcbio_debugging.md`"
         )  # Do I need this to catch other things?
 
-    os.chdir(run_directory) # returns to the original working directory
+    return found
 
 
-def download_genes(download_path, to_download):  # Make this work on command-line
+def download_genes(download_path, to_download, store_path=None, mirror=None, build=None, release=None):  # Make this work on command-line
     """
-    Downloads any genes specified on the command line
+    Downloads any genes specified on the command line.
+    If a reference store is given, files are linked from it and only downloaded when missing.
 
         Arguments:
 
             download_path (Path):   where to download the files to
             to_download   (list):   a list of the files to download
+            store_path    (Path):   the shared reference store, or None to always download
+            mirror        (str):    base url of a mirror to download from, or None for upstream
+            build         (str):    genome build to download for (default: hg38)
+            release       (str):    ensembl release to download, or latest (default: 96)
 
         Returns:
 
             files (None):   downloads the files specified to download_path
 
     """
-    download_info = { # initilaizes info of the files, as seen in the debugging manual
-        "cdna": {
-            "url": "http://ftp.ensembl.org/pub/release-96/fasta/homo_sapiens/cdna/Homo_sapiens.GRCh38.cdna.all.fa.gz",
-            "name": "Homo_sapiens.GRCh38.cdna.all.fa.gz",
-        },
-        "gtf": {
-            "url": "http://ftp.ensembl.org/pub/release-96/gtf/homo_sapiens/Homo_sapiens.GRCh38.96.gtf.gz",
-            "name": "Homo_sapiens.GRCh38.96.gtf.gz",
-        },
-        "gtf_chr": {
-            "url": "https://hgdownload.cse.ucsc.edu/goldenpath/hg38/bigZips/genes/hg38.ncbiRefSeq.gtf.gz",
-            "name": "hg38.ncbiRefSeq.gtf.gz",
-        },
-    }
+    catalog = reference_catalog.load_catalog() # only hits the network if there is no cached snapshot
 
     for file in to_download: # downloads each file
-        file_name = download_info[file]["name"]
-        file_url = download_info[file]["url"]
-        download_url(file_url, download_path / file_name, file_name)
+        entry = catalog.resolve(
+            build or reference_catalog.DEFAULT_BUILD,
+            file,
+            release or reference_catalog.DEFAULT_RELEASE,
+        )
+        file_name = entry["name"]
+        file_url = entry["url"]
+
+        if store_path: # the store only hits the network if no one has fetched this url yet
+            object_path = reference_store.fetch(store_path, file_url, file_name, download_url, mirror)
+            reference_store.link_into(object_path, download_path / file_name)
+            print(f"{file_name} linked from reference store {store_path}")
+        else:
+            download_url(reference_store.mirror_url(file_url, mirror), download_path / file_name, file_name)
+
+
+def list_catalog(build=None, refresh=False):
+    """
+    Prints the reference files that can be downloaded
+
+        Arguments:
+
+            build   (str):  only list files for this genome build
+            refresh (bool): refresh the catalog from the ensembl ftp site first
+
+        Returns:
+
+            None
+    """
+    catalog = reference_catalog.load_catalog(refresh=refresh)
+
+    for entry in catalog.entries(build):
+        print(f"{entry['build']}\t{entry['release']}\t{entry['file_type']}\t{entry['name']}")
+
+    if catalog.fetched:
+        print("\nCatalog snapshot from " + time.strftime("%Y-%m-%d %H:%M", time.localtime(catalog.fetched)))
+    else:
+        print("\nNo catalog snapshot, showing builtin releases. Refresh with: bcbio_doctor.py --catalog --refresh_catalog")
 
 
 def download_url(url, output_path, fname):
@@ -174,8 +263,10 @@ def download_url(url, output_path, fname):
     r = requests.get(url, stream=True) # initiates the stream
     total = int(r.headers.get("content-length", 0)) # gets the size of the file
 
+    r.raise_for_status() # don't save an error page as a reference file
+
     if not os.path.isdir(output_path.parent): # creates directory if needed
-        os.mkdir(output_path.parent)
+        os.makedirs(output_path.parent)
 
     with open(output_path, "wb") as file, tqdm( # downloads with download bar
         desc=fname,
@@ -191,7 +282,9 @@ def download_url(url, output_path, fname):
 
 def check_gene_names(path_to_genomes):
     """
-    Checks the gene names in all fasta files in the specified folder
+    Checks the gene names in all fasta files in the specified folder.
+    Every header is checked, and a samtools compatible .fai index is written next to each fasta,
+    which later checks reuse instead of reading the fasta again.
 
         Arguments:
 
@@ -199,60 +292,350 @@ def check_gene_names(path_to_genomes):
 
         Returns:
 
-            None
+            results (dict): file name -> header and length stats (see fasta_tools.fasta_stats),
+                            and the sequences samtools can't index
     """
+    results = {}
     paths = path_to_genomes.glob("*.fa") # gets all fasta files
     for path in paths:
-        with open(path, "r") as f:
-            for line in f:
-                gene_name = line.split(" ")[0]
-                break
-            if "." in gene_name:
-                print(
-                    path.name + " is in the format: XXXXXXXX.XX\n"
-                    "If this does not match your fastQ file, please take a look at remove_versions.py"
-                )
-            else:
-                print(
-                    path.name + " is in the format: XXXXXXXX"
-                ) # currently no solution for adding version numbers, but this shouldn't (?) matter
+        entries, irregular = fasta_tools.index_fasta(path)
+        stats = fasta_tools.fasta_stats(entries)
+        results[path.name] = dict(stats, irregular=irregular)
+
+        if stats["versioned"] and stats["unversioned"]:
+            print(
+                path.name + " MIXES the formats XXXXXXXX.XX and XXXXXXXX "
+                f"({stats['versioned']} and {stats['unversioned']} records)\n"
+                "You can make them consistent with: "
+                f"bcbio_doctor.py --strip_versions {path.name} <output_name>.fa"
+            )
+        elif stats["versioned"]:
+            print(
+                path.name + " is in the format: XXXXXXXX.XX\n"
+                "If this does not match your gtf file, you can remove the versions with: "
+                f"bcbio_doctor.py --strip_versions {path.name} <output_name>.fa"
+            )
+        else:
+            print(
+                path.name + " is in the format: XXXXXXXX"
+            ) # currently no solution for adding version numbers, but this shouldn't (?) matter
+
+        print(
+            f"\t{stats['records']} sequences, {stats['total_length']} bases, "
+            f"length min {stats['min_length']} / mean {stats['mean_length']:.0f} / "
+            f"max {stats['max_length']} / N50 {stats['n50']}"
+        )
+        if stats["duplicates"]:
+            print(f"\t{stats['duplicates']} sequence names are duplicated!")
+        if irregular:
+            print(
+                f"\t{len(irregular)} sequences have lines of different lengths, samtools faidx will fail on them: "
+                + ", ".join(irregular[:5])
+            )
+
+    return results
 
 
-def check_gene_annotation(path_to_genomes):
+def check_gene_annotation(path_to_genomes, workers=None):
     """
-    Checks the gene annotation of all gtf files in the specified folder
+    Checks the gene annotation of all gtf files in the specified folder.
+    Every line is scanned, so a file that mixes chrX and X seqnames is caught.
 
         Arguments:
 
             path_to_genomes (Path):  where all the fasta files are stored
+            workers         (int):   number of processes to scan each file with (default: all cores)
 
         Returns:
 
-            None
+            results (dict): file name -> style (chrX, X, mixed or empty) and the whole-file scan
+                            (see gtf_tools.validate_gtf)
     """
+    results = {}
     paths = path_to_genomes.glob("*.gtf") # gets all gtf files
 
     for path in paths:
-        with open(path, "r") as f:
-            for line in f:
-                if line[0] == "#":
-                    continue
-                else:
-                    gene_annotation = line.split("\t")[0]
-                    break
-        if "chr" in gene_annotation:
-            print(path.name + " is annotated: chrX")
+        report = gtf_tools.validate_gtf(path, workers)
+        seqnames = report["seqnames"]
+        style = gtf_tools.annotation_style(seqnames)
+        results[path.name] = dict(report, style=style)
+
+        if style == "mixed":
+            prefixed = [name for name in seqnames if name.startswith("chr")]
+            unprefixed = [name for name in seqnames if not name.startswith("chr")]
+            print(
+                path.name + " is annotated with BOTH chrX and X seqnames, genes on one of them will be dropped!\n"
+                f"\twith chr ({len(prefixed)}): {', '.join(prefixed[:5])}\n"
+                f"\twithout chr ({len(unprefixed)}): {', '.join(unprefixed[:5])}"
+            )
+        elif style == "empty":
+            print(path.name + " has no annotation records!")
         else:
-            print(path.name + " is annotated: X")
+            print(path.name + " is annotated: " + style)
+
+        print(
+            f"\t{report['records']} records on {len(seqnames)} seqnames, "
+            + ", ".join(f"{count} {feature}" for feature, count in report["features"].most_common(4))
+        )
 
-    print("\nYou can download a non-chr format with: bcbio_doctor.py -d --gtf_chr\n")
+        if report["records"]: # gene records have no transcript_id, so only gene_id should be at 100%
+            print(
+                "\tattribute coverage: "
+                + ", ".join(
+                    f"{key} {100 * count / report['records']:.1f}%"
+                    for key, count in report["attribute_keys"].most_common(6)
+                )
+            )
+            if report["attribute_keys"].get("gene_id", 0) < report["records"]:
+                print(f"\t{report['records'] - report['attribute_keys'].get('gene_id', 0)} records have no gene_id!")
+
+        if report["malformed"]:
+            print(f"\t{report['malformed']} malformed lines, e.g.:")
+            for line_no, text in report["malformed_examples"]:
+                print(f"\t\tline {line_no}: {text}")
+
+    print("\nYou can download a non-chr format with: bcbio_doctor.py -d --gtf\n")
 
     print(
         "You can download a chr format with: bcbio_doctor.py -d --gtf_chr \n\n"
-        "You can also run the following command to edit the annotation, although this is less reliable: \n\t"
-        r"""awk 'OFS="\t" {if (NR > 5) $1="chr"$1; print}' input_name.gtf > output_name.gtf"""
+        "You can also rename the seqnames of your annotation with: \n\t"
+        "bcbio_doctor.py --rename_chr --style=ucsc input_name.gtf output_name.gtf  (X -> chrX)\n\t"
+        "bcbio_doctor.py --rename_chr --style=ensembl input_name.gtf output_name.gtf  (chrX -> X)"
+    )
+
+    return results
+
+
+def check_transcript_ids(fasta_path, gtf_path):
+    """
+    Checks that the transcripts in a transcriptome fasta are the transcripts in its gtf.
+    Mismatched ids are the most common cause of zero counts.
+
+        Arguments:
+
+            fasta_path (Path):  the transcriptome fasta
+            gtf_path   (Path):  the transcriptome gtf
+
+        Returns:
+
+            report (dict):  matched, mismatched and missing transcript counts (see fasta_tools.check_transcript_ids)
+    """
+    report = fasta_tools.check_transcript_ids(fasta_path, gtf_path)
+    print(
+        f"{fasta_path.name} ({report['fasta_transcripts']} transcripts) vs "
+        f"{gtf_path.name} ({report['gtf_transcripts']} transcripts):"
+    )
+
+    messages = {
+        "matched": "transcripts match exactly",
+        "version_mismatch": "transcripts only match without their version suffix (XXXXXXXX.XX vs XXXXXXXX)",
+        "missing_from_gtf": "fasta transcripts are not in the gtf",
+        "extra_in_gtf": "gtf transcripts are not in the fasta",
+    }
+    for kind, message in messages.items():
+        print(f"\t{report[kind]} {message}")
+        if report[kind] and kind != "matched":
+            print("\t\te.g. " + ", ".join(report["examples"][kind]))
+
+    if report["matched"] == 0:
+        print("\tNO transcripts match exactly, expect zero counts with this fasta and gtf!")
+    if report["version_mismatch"]:
+        print(
+            "\tYou can make the versions match with `bcbio_doctor.py --strip_versions` on both files, "
+            "or `bcbio_doctor.py --add_versions` on the gtf"
+        )
+
+    return report
+
+
+def fix_versions(file_in, file_out, add=False):
+    """
+    Strips (or, for a gtf, adds) the version suffix of the ids in a fasta or gtf file
+
+        Arguments:
+
+            file_in  (Path):  the fasta or gtf to read
+            file_out (Path):  where to write the rewritten file
+            add      (bool):  add versions to a gtf instead of stripping them
+
+        Returns:
+
+            None
+    """
+    is_gtf = file_in.suffix == ".gtf"
+    if add and not is_gtf:
+        print(f"{file_in.name} is not a gtf, versions can only be added from gtf attributes")
+        return
+
+    start = time.perf_counter()
+    if add:
+        records = fasta_tools.add_gtf_versions(file_in, file_out)
+    elif is_gtf:
+        records = fasta_tools.strip_gtf_versions(file_in, file_out)
+    else:
+        records = fasta_tools.strip_fasta_versions(file_in, file_out)
+    elapsed = time.perf_counter() - start
+
+    print(
+        f"{'Added' if add else 'Stripped'} versions of {records} ids, {file_in} -> {file_out} "
+        f"({os.path.getsize(file_in) / 1e6 / elapsed:.1f} MB/s)"
+    )
+
+
+def bench_storage(directories, input_size_gb=10, bench_size_mb=256):
+    """
+    Benchmarks candidate directories and recommends where work/ and final/ should live
+
+        Arguments:
+
+            directories   (list):  candidate directories
+            input_size_gb (float): total size of the input fastq files
+            bench_size_mb (int):   size of the file written to each directory
+
+        Returns:
+
+            recommendation (dict): see storage_bench.recommend
+    """
+    results = []
+    for directory in directories: # one at a time, so candidates on the same disk don't slow each other
+        print(f"Benchmarking {directory}...")
+        results.append(storage_bench.bench_directory(directory, bench_size_mb))
+
+    print(f"\n{'directory':<40}{'free GB':>9}{'write MB/s':>12}{'read MB/s':>11}{'files/s':>9}{'fsync ms':>10}")
+    for r in results:
+        if r["error"]:
+            print(f"{r['path']:<40}  NOT USABLE: {r['error']}")
+        else:
+            print(
+                f"{r['path']:<40}{r['free_GB']:>9.0f}{r['write_MBps']:>12.0f}{r['read_MBps']:>11.0f}"
+                f"{r['create_per_s']:>9.0f}{r['fsync_ms_median']:>10.2f}"
+            )
+
+    recommendation = storage_bench.recommend(results, input_size_gb)
+    print(f"\nFor {input_size_gb} GB of input:")
+    print(f"\twork/  -> {recommendation['work'] or 'NONE'} ({recommendation['work_reason']})")
+    print(f"\tfinal/ -> {recommendation['final'] or 'NONE'} ({recommendation['final_reason']})")
+    return recommendation
+
+
+def rename_chr(gtf_in, gtf_out, style="ucsc", mapping_path=None, bench=False):
+    """
+    Renames the seqnames of a gtf file between the ensembl (X) and ucsc (chrX) styles
+
+        Arguments:
+
+            gtf_in       (Path): the gtf to rename
+            gtf_out      (Path): where to write the renamed gtf
+            style        (str):  ucsc to add chr, ensembl to remove it
+            mapping_path (Path): optional two column file of extra renames, e.g. for scaffolds
+            bench        (bool): also time the rename against the awk one-liner
+
+        Returns:
+
+            None
+    """
+    mapping = gtf_tools.seqname_mapping(style, mapping_path)
+
+    start = time.perf_counter()
+    unmapped = gtf_tools.rename_seqnames(gtf_in, gtf_out, mapping)
+    elapsed = time.perf_counter() - start
+    print(
+        f"Renamed {gtf_in} to {style} seqnames in {gtf_out} "
+        f"({os.path.getsize(gtf_in) / 1e6 / elapsed:.1f} MB/s)"
     )
 
+    if unmapped:
+        print(
+            f"{len(unmapped)} seqnames had no mapping and were left as they were "
+            f"({sum(unmapped.values())} records): {', '.join(list(unmapped)[:10])}\n"
+            "Add them to a --mapping file if they should be renamed too."
+        )
+
+    if bench:
+        results = gtf_tools.benchmark_rename(gtf_in, mapping)
+        for name, result in results.items():
+            if result is None:
+                print(f"{name}\tnot available")
+            else:
+                print(f"{name}\t{result['seconds']:.2f}s\t{result['MB/s']:.1f} MB/s")
+
+
+def doctor_checks(genomes_path=None, workers=None):
+    """
+    Registers the checks the doctor runs, with what each one needs and how to judge its result
+
+        Arguments:
+
+            genomes_path (Path):  folder of fasta and gtf files to check, or None to skip those checks
+            workers      (int):   processes check_gene_annotation scans each gtf with (default: all cores)
+
+        Returns:
+
+            checks (list): doctor_report.Check objects, in the order they are reported
+    """
+    def path_status(data):
+        if any(tool["critical"] and not tool["version"] for tool in data["tools"]):
+            return "failed"
+        return "ok" if all(data["paths"].values()) else "warning"
+
+    def genome_status(data):
+        if not data or not data["builds"]:
+            return "failed"
+        missing_seq = any(not build["has_seq"] for build in data["builds"])
+        return "warning" if data["sam_fa_indices"] is None or missing_seq else "ok"
+
+    def names_status(data):
+        problems = any(
+            (stats["versioned"] and stats["unversioned"]) or stats["duplicates"] or stats["irregular"]
+            for stats in data.values()
+        )
+        return "warning" if problems else "ok"
+
+    def annotation_status(data):
+        problems = any(
+            report["style"] in ("mixed", "empty") or report["malformed"] for report in data.values()
+        )
+        return "warning" if problems else "ok"
+
+    def ids_status(data):
+        if any(report["matched"] == 0 for report in data.values()):
+            return "failed"
+        problems = any(
+            report["version_mismatch"] or report["missing_from_gtf"] or report["extra_in_gtf"]
+            for report in data.values()
+        )
+        return "warning" if problems else "ok"
+
+    def transcript_ids(results):
+        return { # usually a single fasta and gtf pair
+            f"{fasta_path.name} vs {gtf_path.name}": check_transcript_ids(fasta_path, gtf_path)
+            for fasta_path in genomes_path.glob("*.fa")
+            for gtf_path in genomes_path.glob("*.gtf")
+        }
+
+    checks = [
+        doctor_report.Check("check_PATH", lambda results: check_PATH(), status=path_status),
+        doctor_report.Check(
+            "check_genome_paths",
+            lambda results: check_genome_paths(results["check_PATH"]["bcbio_path"]),
+            requires=["check_PATH"],
+            status=genome_status,
+        ),
+    ]
+
+    if genomes_path:
+        checks += [
+            doctor_report.Check("check_gene_names", lambda results: check_gene_names(genomes_path), status=names_status),
+            doctor_report.Check(
+                "check_gene_annotation", lambda results: check_gene_annotation(genomes_path, workers), status=annotation_status
+            ),
+            doctor_report.Check( # reuses the .fai indexes that check_gene_names writes
+                "check_transcript_ids", transcript_ids, requires=["check_gene_names"], status=ids_status
+            ),
+        ]
+
+    return checks
+
 
 def main():
     arguments = docopt(__doc__)
@@ -268,23 +651,76 @@ def main():
         if not to_download:  # check if we have any inputs and return error if nothing
             print("No files specified for download")
         else:
+            store_path = (
+                Path(arguments["--store"])
+                if arguments["--store"]
+                else reference_store.default_store_path()
+            )
+            mirror = arguments["--mirror"] or reference_store.default_mirror()
+
             print("Running download script...")
-            download_genes(download_path, to_download)
+            if arguments["--profile"]:
+                profiling.start(profiling.default_directory("doctor-download"))
+            try:
+                with profiling.stage("download_genes"):
+                    download_genes(
+                        download_path,
+                        to_download,
+                        store_path,
+                        mirror,
+                        arguments["--build"],
+                        arguments["--release"],
+                    )
+            finally:
+                profiling.finish()
+
+    elif arguments["--catalog"]:
+        list_catalog(arguments["--build"], arguments["--refresh_catalog"])
+
+    elif arguments["--check_ids"]:
+        check_transcript_ids(Path(arguments["<fasta_in>"]), Path(arguments["<gtf_in>"]))
+
+    elif arguments["--strip_versions"]:
+        fix_versions(Path(arguments["<file_in>"]), Path(arguments["<file_out>"]))
+
+    elif arguments["--add_versions"]:
+        fix_versions(Path(arguments["<gtf_in>"]), Path(arguments["<gtf_out>"]), add=True)
+
+    elif arguments["--bench_storage"]:
+        bench_storage(
+            arguments["<directories>"],
+            float(arguments["--input_size"] or 10),
+            int(arguments["--bench_size"] or 256),
+        )
 
-    else:  # its either download or diagnose, never both
+    elif arguments["--rename_chr"]:
+        rename_chr(
+            Path(arguments["<gtf_in>"]),
+            Path(arguments["<gtf_out>"]),
+            arguments["--style"] or "ucsc",
+            arguments["--mapping"],
+            arguments["--bench"],
+        )
 
-        print("_" * 25 + "\n")
-        bcbio_path = check_PATH()
-        print("_" * 25 + "\n")
-        check_genome_paths(bcbio_path)
-        print("_" * 25 + "\n")
-
-        if arguments["<genomes_path>"]:
-            genomes_path = Path(arguments["<genomes_path>"])
-            check_gene_names(genomes_path)
-            print("_" * 25 + "\n")
-            check_gene_annotation(genomes_path)
-            print("_" * 25 + "\n")
+    else:  # its either download or diagnose, never both
+        genomes_path = Path(arguments["<genomes_path>"]) if arguments["<genomes_path>"] else None
+
+        checks = doctor_checks(genomes_path)
+        workers = 4 # independent checks run at the same time
+        if arguments["--profile"]: # one profile per check, one check at a time, see profiling.py
+            profiling.start(profiling.default_directory("doctor"))
+            for check in checks:
+                check.run = profiling.profiled(check.name, check.run)
+            workers = 1
+
+        started = time.time()
+        records = doctor_report.run_checks(checks, workers=workers)
+
+        if arguments["--json"] != "-":
+            doctor_report.print_report(records)
+        if arguments["--json"]:
+            doctor_report.write_json(records, arguments["--json"], started)
+        profiling.finish(verbose=arguments["--json"] != "-") # keeps stdout json only
 
 
 if __name__ == "__main__":
@@ -2,8 +2,10 @@
 bcbio_helper
 
 Usage:
-    bcbio_helper.py (-i)
-    bcbio_helper.py (<data_path>) (<fasta_path>) (<gtf_path>) [options] (<run_name>) (<outpath>)
+    bcbio_helper.py (-i) [--profile]
+    bcbio_helper.py (<data_path>) (<fasta_path>) (<gtf_path>) [options] [--profile] (<run_name>) (<outpath>)
+    bcbio_helper.py --counts_matrix=<final_path>
+    bcbio_helper.py --control=<pid> [--pause | --resume | --stop [--work_dir=<path>]] [--nice=<int>] [--ionice=<class>] [--affinity=<cpus>] [--watch=<seconds>]
 
 
 Options:
@@ -13,15 +15,33 @@ Options:
     --adapter=<str/list>      sets the adapters for bcbio (default: [nextera, polya])
     --strandedness=<str>      sets the strandedness for bcbio (default: unstranded)
     --aligner=<str>           sets the aligner for bcbio (default: hisat2)
-    --cores=<int>             allocates the number of cores that bcbio may use (default: 12)
+    --cores=<int/auto>        allocates the number of cores that bcbio may use, auto sizes cores
+                              and memory to this machine (default: auto)
+    --skip_verify             skips checking that every *.fq.gz decompresses completely
+    --trace=<path>            writes a trace of the run's stages to <path>, open it in chrome://tracing or ui.perfetto.dev
+    --profile                 profiles each stage of the run with cProfile and prints its hottest functions, also in -i mode
+    --counts_matrix=<final_path>  assembles the counts and TPM of a finished run into <final_path>/<date>_<run>/counts.bcmx
+    --control=<pid>           throttles a running bcbio_helper.py or bcbio_nextgen.py process and all of its children
+    --pause                   pauses the process tree (SIGSTOP)
+    --resume                  resumes a paused process tree (SIGCONT)
+    --stop                    stops the process tree for good: SIGTERM, then SIGKILL, and marks partial outputs
+    --work_dir=<path>         the run's <outpath>/<run>/work, where --stop reclaims partial outputs (default: found
+                              from the processes, only a folder bcbio has written its config or log for)
+    --nice=<int>              sets the niceness of the tree, 0 to 19 (lowering it needs root)
+    --ionice=<class>          sets the I/O priority of the tree: idle, best-effort[:<0-7>] or realtime[:<0-7>]
+    --affinity=<cpus>         restricts the tree to some cores, e.g. 0-3,8
+    --watch=<seconds>         keeps applying the settings to new children every <seconds> until the run ends
+
+<fasta_path> and <gtf_path> may also be given as catalog:<build>:<file_type>[:<release>] (e.g. catalog:hg38:cdna:latest)
+to use a file from the shared reference store ($BCBIO_REFERENCE_STORE), see `bcbio_doctor.py --catalog`.
 
 """
 
 # native
+from contextlib import contextmanager
 import csv
 import os
 from pathlib import Path
-import subprocess
 import yaml
 
 # pkg
@@ -29,6 +49,14 @@ from docopt import docopt
 
 #lib
 # from deseq_helper import deseq_helper
+import counts_matrix
+import fastq_check
+import process_control
+import profiling
+import reference_catalog
+import reference_store
+import resources
+import tracing
 
 
 def create_csv(outpath, path_to_data, run_name):
@@ -52,6 +80,7 @@ def create_csv(outpath, path_to_data, run_name):
     # ! BCBIO will find reverse reads on its own, as long as they are there.
     items = [x for x in path_to_data.glob("**/*1.fq.gz") if x.is_file()]  
     
+    tracing.annotate(samples=len(items))
     if not items:
         raise ValueError("Can't find zipped FASTQ data! (*.fq.gz)")
 
@@ -70,6 +99,35 @@ def create_csv(outpath, path_to_data, run_name):
     return outpath / run_name # returns the path to the csv
 
 
+def verify_data(path_to_data):
+    """
+    Checks that every zipped FASTQ decompresses completely, so a truncated file fails now rather than hours into bcbio
+
+        Arguments:
+
+            path_to_data (Path): path to the folder that contains the fastQ files
+
+        Returns:
+
+            report (dict): as returned by fastq_check.verify_fastqs
+    """
+    # both reads this time, bcbio reads the reverse reads too
+    items = sorted(str(x) for x in path_to_data.glob("**/*.fq.gz") if x.is_file())
+    report = fastq_check.verify_fastqs(items)
+
+    cached = sum(1 for result in report["files"] if result["cached"])
+    tracing.annotate(files=len(items), cached=cached, bytes_scanned=report["verified_bytes"], failed=len(report["failed"]))
+    print(f"Verified {len(items)} FASTQ files ({cached} unchanged since an earlier check)"
+          + (f", {report['MBps']:.0f} MB/s\n" if report["MBps"] else "\n"))
+
+    if report["failed"]:
+        raise ValueError(
+            "Corrupt FASTQ data, fix or remove these files first:\n"
+            + "\n".join(f"{result['path']}: {result['error']}" for result in report["failed"])
+        )
+    return report
+
+
 def get_args(args):
     """
     Gets the arguments from the command line and makes them YAML ready.
@@ -90,6 +148,7 @@ def get_args(args):
     aligner = args["--aligner"] if args["--aligner"] else "hisat2"
     adapter = args["--adapter"] if args["--adapter"] else ["nextera", "polya"]
     strandedness = args["--strandedness"] if args["--strandedness"] else "unstranded"
+    store_path = reference_store.default_store_path() # for catalog:<build>:<file_type> references
 
     args = { # this is nested very specfically to work with bcbio
         "details": [
@@ -97,8 +156,8 @@ def get_args(args):
                 "analysis": analysis,
                 "genome_build": genome_build,
                 "algorithm": {
-                    "transcriptome_fasta": args["<fasta_path>"],
-                    "transcriptome_gtf": args["<gtf_path>"],
+                    "transcriptome_fasta": reference_catalog.resolve_path(args["<fasta_path>"], store_path),
+                    "transcriptome_gtf": reference_catalog.resolve_path(args["<gtf_path>"], store_path),
                     "aligner": aligner,
                     "adapters": adapter,
                     "strandedness": strandedness,
@@ -110,6 +169,38 @@ def get_args(args):
     return args # returns a dictionary that is ready to be dumped
 
 
+def size_run(args, cores):
+    """
+    Picks the cores and memory of a run when cores is "auto", and adds them to the template arguments
+
+        Arguments:
+
+            args  (dict): a yaml.dump() ready dict, as created by get_args()
+            cores (str):  number of cores, or "auto" to size the run to this machine
+
+        Returns:
+
+            cores (str): number of cores allocated for bcbio
+    """
+    if cores != "auto":
+        return cores
+
+    detail = args["details"][0]
+    sizing = resources.auto_size(detail["genome_build"], detail["algorithm"]["aligner"])
+    resources.add_to_template(args, sizing)
+    tracing.annotate(cores=sizing["cores"], cpus=sizing["cpus"], memory_gb=sizing["memory_gb"])
+
+    print(
+        f"Sized the run to this machine: {sizing['cores']} of {sizing['cpus']} cores, "
+        f"{sizing['memory_gb']:.1f} GB of memory, {sizing['index_gb']:.1f} GB "
+        f"{detail['algorithm']['aligner']} index\n"
+    )
+    if sizing["warning"]:
+        print(f"Warning: {sizing['warning']}\n")
+
+    return str(sizing["cores"])
+
+
 def create_template(outpath, args):
     """
     Creates the template YAML BCBIO needs to create the run YAML.
@@ -154,20 +245,22 @@ def create_run_yaml(path_to_data, path_to_yaml, path_to_csv, outpath):
     
     os.chdir(outpath) # changes working directory to keep everything contained
     
-    create_run_yaml = subprocess.run( # uses the subprocess module to run bcbio YAML creation
-        [
-            "bcbio_nextgen.py",
-            "-w",
-            "template",
-            str(".." / path_to_yaml), # subproccess does not take Path objects
-            str(".." / path_to_csv),
-            str(".." / path_to_data),
-        ]
-    )
-    
+    try:
+        completed = tracing.run( # uses the subprocess module to run bcbio YAML creation, in a trace span
+            [
+                "bcbio_nextgen.py",
+                "-w",
+                "template",
+                str(".." / path_to_yaml), # subproccess does not take Path objects
+                str(".." / path_to_csv),
+                str(".." / path_to_data),
+            ]
+        )
+    finally:
+        os.chdir("..") # changes the directory back to avoid any issues
+    completed.check_returncode() # raises CalledProcessError, a run without its YAML can't start
+
     print("Created run YAML")
-    
-    os.chdir("..") # changes the directory back to avoid any issues
 
 
 def start_bcbio(outpath, run_name, cores):
@@ -181,7 +274,8 @@ def start_bcbio(outpath, run_name, cores):
         
         Returns:
             
-            None (None): this only runs bcbio, which has its associated returns
+            None (None): this only runs bcbio, which has its associated returns.
+                         Raises CalledProcessError if bcbio fails
     """
     
     
@@ -192,17 +286,96 @@ def start_bcbio(outpath, run_name, cores):
             "-n",
             cores]
 
-    start_bcbio = subprocess.run( # uses subproccess to run bcbio
-        [
-            "bcbio_nextgen.py",
-            f"../config/{str(run_name).split('.')[0]}.yaml",
-            "-n",
-            cores,
-        ]
+    try:
+        completed = tracing.run(arguments) # uses subproccess to run bcbio, in a trace span
+    finally:
+        os.chdir("../../../") # changes back to original directory
+    completed.check_returncode() # raises CalledProcessError, so a failed run doesn't go on to the counts matrix
+
+
+def build_counts_matrix(final_path):
+    """
+    Assembles the counts, TPM and sample metadata bcbio wrote to the upload dir into one
+    memory-mapped matrix, so reading a gene across every sample doesn't parse the text tables
+
+        Arguments:
+
+            final_path (Path): the upload dir of the run, <outpath>/final/
+
+        Returns:
+
+            summary (dict): as returned by counts_matrix.build_matrix, None if bcbio wrote no counts
+    """
+    project_path = counts_matrix.find_project(final_path)
+    if project_path is None:
+        print(f"No counts tables found in {final_path}, the counts matrix was not built\n")
+        return None
+
+    summary = counts_matrix.build_matrix(project_path)
+    tracing.annotate(genes=summary["genes"], samples=summary["samples"])
+    print(
+        f"Counts matrix of {summary['genes']} genes x {summary['samples']} samples "
+        f"({', '.join(f'{matrix} from {table}' for matrix, table in summary['matrices'].items())}) "
+        f"written to {summary['path']}, open it with counts_matrix.CountsMatrix\n"
     )
+    for matrix, missing in summary["missing"].items():
+        if missing:
+            print(f"Warning: {missing} {matrix} values are missing from their table or NA, they are stored as NaN\n")
+    return summary
+
+
+def control_run(pid, pause=False, resume=False, nice=None, ionice=None, affinity=None, watch=None, stop=False, work_dir=None):
+    """
+    Pauses, resumes or throttles a running bcbio process and all of its children
+
+        Arguments:
 
+            pid      (int):   the bcbio_helper.py or bcbio_nextgen.py process
+            pause    (bool):  stops the whole tree (SIGSTOP)
+            resume   (bool):  continues the whole tree (SIGCONT)
+            nice     (int):   niceness for the tree
+            ionice   (str):   idle, best-effort[:<0-7>] or realtime[:<0-7>]
+            affinity (str):   CPUs the tree may use, e.g. 0-3,8
+            watch    (float): seconds between applying the settings to new children, until the run ends
+            stop     (bool):  stops the tree for good, see process_control.shutdown_tree
+            work_dir (Path):  the run's work/ directory, where partial outputs are reclaimed after a stop,
+                              found from the processes when None
 
-    os.chdir("../../../") # changes back to original directory
+        Returns:
+
+            None (None): prints what was changed
+    """
+    if stop:
+        report = process_control.shutdown_tree(pid, on_progress=print, work_dir=work_dir)
+        print(
+            f"Stopped {report['processes']} processes of {pid} ({report['killed']} needed SIGKILL), "
+            f"freed {report['cores_freed']:.1f} cores and {report['memory_freed_gb']:.1f} GB of memory\n"
+        )
+        for path in report["partial"]:
+            print(f"Partial output renamed to {path}.partial")
+        if report["survivors"]:
+            print(f"Processes {report['survivors']} could not be stopped, their partial outputs were left in place")
+        return
+
+    control = process_control.TreeControl(pid)
+    result = control.set(
+        nice=nice,
+        ionice=process_control.parse_ionice(ionice) if ionice else None,
+        affinity=process_control.parse_cpus(affinity) if affinity else None,
+    )
+    if pause:
+        result = control.pause()
+    if resume:
+        result = control.resume()
+
+    action = "Paused" if pause else "Resumed" if resume else "Updated"
+    print(f"{action} {result['processes']} processes of {pid}\n")
+    for problem in result["problems"]:
+        print(f"Could not set {problem}")
+
+    if watch:
+        print(f"Applying the settings to new processes every {watch}s until {pid} exits, Control+C to stop\n")
+        control.watch(float(watch), lambda r: print(f"Applied the settings to {r['applied']} new processes"))
 
 
 def main(arguments):
@@ -218,8 +391,53 @@ def main(arguments):
             None (None): this runs bcbio, which has its associated returns
 
     """
+    if arguments.get("--trace"):
+        tracing.start(Path(arguments["--trace"]).resolve()) # the stages change directory
+    if arguments.get("--profile"):
+        profiling.start(profiling.default_directory("helper"))
+    try:
+        with tracing.span("bcbio_helper", run_name=arguments["<run_name>"]):
+            run_stages(arguments)
+    finally:
+        profiling.finish()
+        trace_path = tracing.finish()
+        if trace_path:
+            print(f"Trace of the run written to {trace_path}, open it in chrome://tracing or ui.perfetto.dev\n")
+
+
+@contextmanager
+def stage(name, **attributes):
+    """
+    Runs one stage of a run in a trace span (--trace) and under the profiler (--profile)
+
+        Arguments:
+
+            name       (str): the stage, e.g. create_csv
+            attributes (any): shown with the trace span
+
+        Returns:
+
+            None
+    """
+    with tracing.span(name, **attributes), profiling.stage(name):
+        yield
+
+
+def run_stages(arguments):
+    """
+    Runs each stage of main in its own trace span and profile
+
+        Arguments:
+
+            arguments (dict): dict as parsed by docopt
+
+        Returns:
+
+            None (None): this runs bcbio, which has its associated returns
+    """
     args = get_args(arguments)
-    cores = arguments["--cores"] if arguments["--cores"] else str(12)
+    with stage("size_run"):
+        cores = size_run(args, arguments["--cores"] if arguments["--cores"] else "auto")
     
     run_name = (
         Path(arguments["<run_name>"])
@@ -232,20 +450,29 @@ def main(arguments):
         os.mkdir(outpath)
     
     data_path = Path(arguments["<data_path>"])
-    csv_path = create_csv(outpath, data_path, run_name)
-    template_path = create_template(outpath, args)
-    create_run_yaml(data_path, template_path, csv_path, outpath)
+    if not arguments["--skip_verify"]:
+        with stage("verify_data", path=str(data_path)):
+            verify_data(data_path)
+    with stage("create_csv", path=str(data_path)):
+        csv_path = create_csv(outpath, data_path, run_name)
+    with stage("create_template"):
+        template_path = create_template(outpath, args)
+    with stage("create_run_yaml"):
+        create_run_yaml(data_path, template_path, csv_path, outpath)
     
-    start_bcbio(outpath, run_name, cores)
+    with stage("start_bcbio", cores=cores):
+        start_bcbio(outpath, run_name, cores)
+    with stage("build_counts_matrix"):
+        build_counts_matrix(Path(args["upload"]["dir"]))
 
 
-def main_interactive():
+def main_interactive(profile=False):
     """
     Takes the inputs through python inputs, uses default values for YAML
 
         Arguments:
 
-            None (None): exclusivley uses python inputs
+            profile (bool): profiles each stage of each run, see profiling.py
 
         Returns:
             
@@ -272,7 +499,7 @@ def main_interactive():
         
         run_name = input("Enter the name of your run: ")
         run_name = Path(run_name) if run_name.split(".")[-1] == "csv" else Path(run_name + '.csv')
-        cores = input("Enter the number of vCPUS/Cores you want to use: ")
+        cores = input("Enter the number of vCPUS/Cores you want to use (leave empty to size to this machine): ") or "auto"
 
         args = {
             "details": [
@@ -303,10 +530,25 @@ def main_interactive():
         cont = input("Would you like to continue [y/n]? ").lower()
         if cont != "y": break
 
-        csv_path = create_csv(outpath, data_path, run_name)
-        template_path = create_template(outpath, args)
-        create_run_yaml(data_path, template_path, csv_path, outpath)
-        start_bcbio(outpath, run_name, cores)
+        if profile:
+            profiling.start(profiling.default_directory("helper-interactive"))
+        try:
+            with stage("size_run"):
+                cores = size_run(args, cores)
+            with stage("verify_data"):
+                verify_data(data_path)
+            with stage("create_csv"):
+                csv_path = create_csv(outpath, data_path, run_name)
+            with stage("create_template"):
+                template_path = create_template(outpath, args)
+            with stage("create_run_yaml"):
+                create_run_yaml(data_path, template_path, csv_path, outpath)
+            with stage("start_bcbio"):
+                start_bcbio(outpath, run_name, cores)
+            with stage("build_counts_matrix"):
+                build_counts_matrix(Path(args["upload"]["dir"]))
+        finally:
+            profiling.finish()
 
     print("Exiting...")
 
@@ -318,8 +560,24 @@ if __name__ == "__main__":
     
     # check which mode and run
     if arguments["-i"]:
-        main_interactive()
+        main_interactive(profile=arguments["--profile"])
     
+    elif arguments["--counts_matrix"]:
+        build_counts_matrix(Path(arguments["--counts_matrix"]))
+
+    elif arguments["--control"]:
+        control_run(
+            int(arguments["--control"]),
+            pause=arguments["--pause"],
+            resume=arguments["--resume"],
+            nice=int(arguments["--nice"]) if arguments["--nice"] else None,
+            ionice=arguments["--ionice"],
+            affinity=arguments["--affinity"],
+            watch=arguments["--watch"],
+            stop=arguments["--stop"],
+            work_dir=arguments["--work_dir"],
+        )
+
     else:
         main(arguments)
     
@@ -0,0 +1,171 @@
+"""
+bcbio_inventory
+
+Inventory of a bcbio installation: which genome builds are installed under genomes/,
+which aligner indexes each build has and how big they are, and where galaxy/tool-data
+keeps its .loc files.
+
+Walking the index folders is slow on network filesystems, so sizes are cached in
+<cache>/inventory.json (see local_cache.py). A build is only walked again when the
+modification time of its folder or of one of its index folders changes.
+"""
+
+# native
+from concurrent.futures import ThreadPoolExecutor
+import os
+from pathlib import Path
+
+# lib
+import local_cache
+
+
+INDEXES = { # index name -> where bcbio keeps it inside genomes/<species>/<build>/
+    "bwa": ["bwa"],
+    "hisat2": ["hisat2"],
+    "star": ["star"],
+    "salmon": ["salmon", "rnaseq/salmon", "rnaseq/indexes/salmon"],
+    "rtg": ["rtg"],
+}
+LOC_FILE = "sam_fa_indices.loc"
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+
+def dir_size(path):
+    """
+    Adds up the size of every file under a folder, without descending into symlinked folders
+
+        Arguments:
+
+            path (Path): the folder to walk
+
+        Returns:
+
+            size (int): total size in bytes
+    """
+    total = 0
+    stack = [str(path)]
+    while stack:
+        try:
+            with os.scandir(stack.pop()) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.is_file():
+                        total += entry.stat().st_size # follows symlinks, bcbio links indexes between builds
+        except OSError: # unreadable folders are skipped, not fatal
+            continue
+    return total
+
+
+def _build_signature(build_path):
+    """
+    Gets the modification times that decide whether a build's cached sizes are still valid
+    """
+    signature = {".": _mtime(build_path)}
+    for locations in INDEXES.values():
+        for location in locations:
+            mtime = _mtime(build_path / location)
+            if mtime is not None:
+                signature[location] = mtime
+    return signature
+
+
+def _find_indexes(build_path):
+    """
+    Finds where each index of one genome build is, sizes are added later
+    """
+    indexes = {}
+    for index, locations in INDEXES.items():
+        for location in locations:
+            if (build_path / location).is_dir():
+                indexes[index] = {"path": str(build_path / location), "size": None}
+                break
+    return {
+        "species": build_path.parent.name,
+        "build": build_path.name,
+        "has_seq": (build_path / "seq").is_dir(),
+        "indexes": indexes,
+    }
+
+
+def find_loc_files(bcbio_path):
+    """
+    Finds every .loc file under galaxy/tool-data, at any depth
+
+        Arguments:
+
+            bcbio_path (Path): the bcbio installation
+
+        Returns:
+
+            loc_files (list): paths of the .loc files, as str
+    """
+    loc_files = []
+    for root, _, files in os.walk(Path(bcbio_path) / "galaxy" / "tool-data"):
+        loc_files.extend(os.path.join(root, name) for name in files if name.endswith(".loc"))
+    return sorted(loc_files)
+
+
+def inventory(bcbio_path, workers=8, use_cache=True):
+    """
+    Takes an inventory of the genomes and galaxy tool-data of a bcbio installation
+
+        Arguments:
+
+            bcbio_path (Path): the bcbio installation
+            workers    (int):  number of folders to walk at the same time
+            use_cache  (bool): reuse the cached sizes of builds that have not changed
+
+        Returns:
+
+            inventory (dict): "builds" (a list of species, build, has_seq and indexes with their
+                              path and size), "loc_files", and "sam_fa_indices" (path or None)
+    """
+    bcbio_path = Path(bcbio_path).resolve()
+    cache_path = local_cache.cache_dir() / "inventory.json"
+    cache = local_cache.read_json(cache_path, {}) if use_cache else {}
+    cached_builds = cache.get(str(bcbio_path), {})
+
+    build_paths = sorted(
+        build for species in (bcbio_path / "genomes").glob("*") if species.is_dir()
+        for build in species.glob("*") if build.is_dir()
+    )
+    signatures = {str(path): _build_signature(path) for path in build_paths}
+    stale = [
+        path for path in build_paths
+        if cached_builds.get(str(path), {}).get("signature") != signatures[str(path)]
+    ]
+
+    scanned = {str(path): _find_indexes(path) for path in stale}
+    index_infos = [info for build in scanned.values() for info in build["indexes"].values()]
+
+    with ThreadPoolExecutor(max_workers=workers) as pool: # the walks are io bound, threads are enough
+        loc_files = pool.submit(find_loc_files, bcbio_path)
+        for info, size in zip(index_infos, pool.map(dir_size, [info["path"] for info in index_infos])):
+            info["size"] = size
+        loc_files = loc_files.result()
+
+    builds = {}
+    for path in build_paths:
+        if str(path) in scanned:
+            builds[str(path)] = {"signature": signatures[str(path)], "result": scanned[str(path)]}
+        else:
+            builds[str(path)] = cached_builds[str(path)]
+
+    if use_cache and (stale or set(builds) != set(cached_builds)):
+        cache[str(bcbio_path)] = builds
+        local_cache.write_json(cache_path, cache)
+
+    sam_fa_indices = [path for path in loc_files if os.path.basename(path) == LOC_FILE]
+
+    return {
+        "builds": [builds[str(path)]["result"] for path in build_paths],
+        "loc_files": loc_files,
+        "sam_fa_indices": sam_fa_indices[0] if sam_fa_indices else None,
+    }
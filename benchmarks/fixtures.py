@@ -0,0 +1,170 @@
+"""
+fixtures
+
+Synthetic inputs for the benchmarks: a nested tree of gzipped FASTQ samples, a transcriptome
+FASTA and its GTF, a bcbio installation with genomes and indexes, and a local HTTP server to
+download from. Everything is generated from a fixed seed, so two runs time the same inputs.
+"""
+
+# native
+from functools import partial
+import gzip
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+import os
+import random
+import threading
+
+
+SEED = 42
+READ_LENGTH = 100
+SEQNAMES = [str(i) for i in range(1, 23)] + ["X", "Y", "MT"]
+
+
+def _reads(count, rng):
+    lines = []
+    for i in range(count):
+        lines.append(f"@read{i}/1\n{''.join(rng.choices('ACGT', k=READ_LENGTH))}\n+\n{'I' * READ_LENGTH}\n")
+    return "".join(lines).encode()
+
+
+def make_fastq_tree(root, samples, reads, depth=1):
+    """
+    Writes paired gzipped FASTQ files, <sample>_1.fq.gz and <sample>_2.fq.gz, spread over nested folders
+
+        Arguments:
+
+            root    (Path): where the tree is made
+            samples (int):  number of samples
+            reads   (int):  reads in each file
+            depth   (int):  folders between root and the files, 0 for all files in root
+
+        Returns:
+
+            files (int): FASTQ files written
+    """
+    rng = random.Random(SEED)
+    data = gzip.compress(_reads(reads, rng), compresslevel=1) # every file holds the same reads
+
+    for sample in range(samples):
+        folder = root
+        for level in range(depth): # 4 folders per level, so samples spread out as they would in a real delivery
+            folder = folder / f"lane{(sample >> (2 * level)) % 4}"
+        os.makedirs(folder, exist_ok=True)
+        for mate in (1, 2):
+            with open(folder / f"S{sample:05d}_{mate}.fq.gz", "wb") as f:
+                f.write(data)
+    return samples * 2
+
+
+def make_fasta(path, transcripts, length=1500, versioned=True):
+    """
+    Writes a transcriptome FASTA, ENST... ids wrapped at 60 bases
+
+        Arguments:
+
+            path        (Path): the FASTA
+            transcripts (int):  number of transcripts
+            length      (int):  mean transcript length
+            versioned   (bool): ids have a .N version suffix
+
+        Returns:
+
+            path (Path)
+    """
+    rng = random.Random(SEED)
+    with open(path, "w") as f:
+        for i in range(transcripts):
+            sequence = "".join(rng.choices("ACGT", k=rng.randint(length // 2, length * 3 // 2)))
+            f.write(f">ENST{i:011d}{'.1' if versioned else ''}\n")
+            f.writelines(sequence[start:start + 60] + "\n" for start in range(0, len(sequence), 60))
+    return path
+
+
+def make_gtf(path, transcripts, chr_prefix=False):
+    """
+    Writes a GTF with a gene, a transcript and three exons for each transcript of make_fasta
+
+        Arguments:
+
+            path        (Path): the GTF
+            transcripts (int):  number of transcripts
+            chr_prefix  (bool): seqnames are chr1.. instead of 1..
+
+        Returns:
+
+            path (Path)
+    """
+    with open(path, "w") as f:
+        for i in range(transcripts):
+            seqname = ("chr" if chr_prefix else "") + SEQNAMES[i % len(SEQNAMES)]
+            start = 1000 + i * 5000
+            gene = f'gene_id "ENSG{i:011d}"; gene_version "1"; gene_name "G{i}";'
+            transcript = f'{gene} transcript_id "ENST{i:011d}"; transcript_version "1";'
+            f.write(f"{seqname}\tbench\tgene\t{start}\t{start + 3000}\t.\t+\t.\t{gene}\n")
+            f.write(f"{seqname}\tbench\ttranscript\t{start}\t{start + 3000}\t.\t+\t.\t{transcript}\n")
+            for exon in range(3):
+                exon_start = start + exon * 1000
+                f.write(
+                    f"{seqname}\tbench\texon\t{exon_start}\t{exon_start + 500}\t.\t+\t.\t"
+                    f'{transcript} exon_number "{exon + 1}";\n'
+                )
+    return path
+
+
+def make_bcbio_install(root, builds=(("Hsapiens", "hg38"), ("Mmusculus", "mm10")), index_files=200, file_kb=16):
+    """
+    Lays out a bcbio installation: genomes/<species>/<build>/ with seq/ and aligner indexes,
+    and galaxy/tool-data/sam_fa_indices.loc
+
+        Arguments:
+
+            root        (Path): the installation folder
+            builds      (list): (species, build) pairs
+            index_files (int):  files in each index folder
+            file_kb     (int):  size of each index file
+
+        Returns:
+
+            root (Path)
+    """
+    block = b"\0" * (file_kb * 1024)
+    loc_lines = []
+    for species, build in builds:
+        build_path = root / "genomes" / species / build
+        os.makedirs(build_path / "seq", exist_ok=True)
+        with open(build_path / "seq" / f"{build}.fa", "w") as f:
+            f.write(f">1\n{'ACGT' * 15}\n")
+        for index in ("bwa", "hisat2", "star", "rnaseq/salmon"):
+            os.makedirs(build_path / index, exist_ok=True)
+            for i in range(index_files):
+                with open(build_path / index / f"{build}.{i}.idx", "wb") as f:
+                    f.write(block)
+        loc_lines.append(f"index\t{build}\t{build_path / 'seq' / (build + '.fa')}\n")
+
+    os.makedirs(root / "galaxy" / "tool-data", exist_ok=True)
+    with open(root / "galaxy" / "tool-data" / "sam_fa_indices.loc", "w") as f:
+        f.writelines(loc_lines)
+    return root
+
+
+class _QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_directory(path):
+    """
+    Serves a folder over HTTP on a free local port, from a background thread
+
+        Arguments:
+
+            path (Path): the folder to serve
+
+        Returns:
+
+            server (ThreadingHTTPServer): call server.shutdown() when done
+            url    (str):                 base url of the folder, ending in /
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", 0), partial(_QuietHandler, directory=str(path)))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/"
@@ -0,0 +1,233 @@
+"""
+run_benchmarks
+
+Times the slow paths of bcbio_helper and bcbio_doctor on synthetic inputs (see fixtures.py),
+and compares each time with the stored baseline. The run fails if a benchmark got slower than
+its baseline by more than the tolerance.
+
+Usage:
+    run_benchmarks.py [--samples=<int>] [--reads=<int>] [--depth=<int>] [--transcripts=<int>] [--download_mb=<int>] [--repeat=<int>] [--tolerance=<float>] [--baseline=<path>] [--only=<names>] [--update]
+
+Options:
+    --samples=<int>     paired samples in the FASTQ tree (default: 2000)
+    --reads=<int>       reads in each FASTQ file (default: 1000)
+    --depth=<int>       folders between the data folder and the FASTQ files (default: 3)
+    --transcripts=<int>     transcripts in the FASTA and GTF (default: 20000)
+    --download_mb=<int>     size of the file downloaded from the local HTTP server (default: 64)
+    --repeat=<int>      times each benchmark is run, the fastest run counts (default: 3)
+    --tolerance=<float>     how much slower than its baseline a benchmark may be, 0.5 is 50% (default: 0.5)
+    --baseline=<path>   baselines to compare with (default: baselines.json next to this script)
+    --only=<names>      comma separated benchmarks to run (default: all)
+    --update            stores the times as the new baselines instead of comparing
+
+Baselines are only compared when they were stored for the same fixture sizes, on a machine with
+the same number of CPUs and Python version. Times from another machine say nothing about this one,
+store baselines of your own with --update.
+"""
+
+# native
+import contextlib
+import io
+import json
+import os
+from pathlib import Path
+import platform
+import sys
+import tempfile
+import time
+
+# pkg
+from docopt import docopt
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent)) # the modules live in the repo root
+
+# lib
+import fixtures
+import func_doctor
+import func_helper
+
+
+NOISE_FLOOR = 0.02 # seconds, slowdowns smaller than this are timer noise
+
+
+def make_inputs(root, sizes):
+    """
+    Generates every fixture the benchmarks need under root
+
+        Arguments:
+
+            root  (Path): an empty folder
+            sizes (dict): samples, reads, depth, transcripts and download_mb
+
+        Returns:
+
+            inputs (dict): paths of the fixtures
+    """
+    inputs = {
+        "data": root / "data",
+        "genomes": root / "genomes",
+        "bcbio": root / "bcbio",
+        "served": root / "served",
+        "out": root / "out",
+    }
+    for path in inputs.values():
+        os.makedirs(path)
+
+    fixtures.make_fastq_tree(inputs["data"], sizes["samples"], sizes["reads"], sizes["depth"])
+    fixtures.make_fasta(inputs["genomes"] / "transcripts.fa", sizes["transcripts"])
+    fixtures.make_gtf(inputs["genomes"] / "transcripts.gtf", sizes["transcripts"])
+    fixtures.make_bcbio_install(inputs["bcbio"])
+    with open(inputs["served"] / "reference.gtf.gz", "wb") as f:
+        f.write(os.urandom(sizes["download_mb"] * 1024 * 1024))
+    return inputs
+
+
+def benchmarks(inputs, url):
+    """
+    The benchmarks, each a function of the repeat number that runs the code being timed once
+    """
+    template_args = {
+        "analysis": None, "genome": None, "aligner": None, "adapter": None, "strandedness": None,
+        "fasta_path": str(inputs["genomes"] / "transcripts.fa"),
+        "gtf_path": str(inputs["genomes"] / "transcripts.gtf"),
+        "outpath": str(inputs["out"]) + "/",
+    }
+
+    def check_genome_paths(repeat):
+        os.environ["BCBIO_HELPER_CACHE"] = str(inputs["out"] / f"cache{repeat}") # a cold inventory cache
+        func_doctor.check_genome_paths(inputs["bcbio"])
+
+    def check_gene_names(repeat):
+        fai = inputs["genomes"] / "transcripts.fa.fai"
+        if fai.exists(): # otherwise only the first run reads the fasta
+            os.remove(fai)
+        func_doctor.check_gene_names(inputs["genomes"])
+
+    return {
+        "create_csv": lambda repeat: func_helper.create_csv(inputs["out"], inputs["data"], "bench.csv"),
+        "create_template": lambda repeat: func_helper.create_template(inputs["out"], func_helper.get_args(template_args)),
+        "check_gene_names": check_gene_names,
+        "check_gene_annotation": lambda repeat: func_doctor.check_gene_annotation(inputs["genomes"]),
+        "check_genome_paths": check_genome_paths,
+        "download_url": lambda repeat: func_doctor.download_url(
+            url + "reference.gtf.gz", inputs["out"] / "downloads" / f"reference{repeat}.gtf.gz", "reference.gtf.gz"
+        ),
+    }
+
+
+def time_benchmark(run, repeat):
+    """
+    Runs a benchmark repeat times, with its prints and progress bars hidden
+
+        Returns:
+
+            seconds (float): the fastest run
+    """
+    times = []
+    for i in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+            start = time.perf_counter()
+            run(i)
+            times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def compare(results, baseline, tolerance):
+    """
+    Prints each time next to its baseline
+
+        Returns:
+
+            regressions (list): names of the benchmarks that got slower than the tolerance allows
+    """
+    regressions = []
+    print(f"{'benchmark':<24}{'seconds':>10}{'baseline':>10}{'change':>9}")
+    for name, seconds in results.items():
+        before = baseline.get(name)
+        if before is None:
+            print(f"{name:<24}{seconds:>10.3f}{'-':>10}{'-':>9}")
+            continue
+        change = seconds / before - 1 if before else 0.0
+        regressed = change > tolerance and seconds - before > NOISE_FLOOR
+        print(f"{name:<24}{seconds:>10.3f}{before:>10.3f}{change:>+9.0%}" + ("  REGRESSION" if regressed else ""))
+        if regressed:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    arguments = docopt(__doc__)
+    sizes = {
+        "samples": int(arguments["--samples"] or 2000),
+        "reads": int(arguments["--reads"] or 1000),
+        "depth": int(arguments["--depth"] or 3),
+        "transcripts": int(arguments["--transcripts"] or 20000),
+        "download_mb": int(arguments["--download_mb"] or 64),
+    }
+    repeat = int(arguments["--repeat"] or 3)
+    tolerance = float(arguments["--tolerance"] or 0.5)
+    baseline_path = Path(arguments["--baseline"] or Path(__file__).resolve().parent / "baselines.json")
+
+    stored = {}
+    if baseline_path.exists():
+        with open(baseline_path) as f:
+            stored = json.load(f)
+    machine = {"cpus": os.cpu_count(), "python": platform.python_version()}
+    if not arguments["--update"] and stored and stored.get("sizes") != sizes:
+        print(f"Baselines in {baseline_path} are for {stored.get('sizes')}, not comparing\n")
+        stored = {}
+    if not arguments["--update"] and stored and {key: stored.get(key) for key in machine} != machine:
+        print(
+            f"Baselines in {baseline_path} were stored with {stored.get('cpus')} CPUs and Python {stored.get('python')}, "
+            f"this machine has {machine['cpus']} and {machine['python']}, not comparing. Store its own with --update\n"
+        )
+        stored = {}
+
+    cache = os.environ.get("BCBIO_HELPER_CACHE")
+    with tempfile.TemporaryDirectory(prefix="bcbio_bench_") as root:
+        print("Generating fixtures...")
+        start = time.perf_counter()
+        inputs = make_inputs(Path(root), sizes)
+        print(f"\tdone in {time.perf_counter() - start:.1f}s\n")
+
+        server, url = fixtures.serve_directory(inputs["served"])
+        try:
+            selected = benchmarks(inputs, url)
+            if arguments["--only"]:
+                selected = {name: selected[name] for name in arguments["--only"].split(",")}
+            results = {name: time_benchmark(run, repeat) for name, run in selected.items()}
+        finally:
+            server.shutdown()
+            if cache is None:
+                os.environ.pop("BCBIO_HELPER_CACHE", None)
+            else:
+                os.environ["BCBIO_HELPER_CACHE"] = cache
+
+    if arguments["--update"]:
+        same = stored.get("sizes") == sizes and all(stored.get(key) == value for key, value in machine.items())
+        stored_results = stored.get("benchmarks", {}) if same else {}
+        stored_results.update(results)
+        with open(baseline_path, "w") as f:
+            json.dump(
+                {"sizes": sizes, **machine, "benchmarks": stored_results},
+                f,
+                indent=1,
+            )
+            f.write("\n")
+        compare(results, {}, tolerance)
+        print(f"\nBaselines stored to {baseline_path}")
+        return 0
+
+    regressions = compare(results, stored.get("benchmarks", {}), tolerance)
+    if regressions:
+        print(f"\n{len(regressions)} benchmarks regressed by more than {tolerance:.0%}: {', '.join(regressions)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
+
+    # python benchmarks/run_benchmarks.py
+
+    # python benchmarks/run_benchmarks.py --samples=200 --transcripts=2000 --update
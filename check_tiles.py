@@ -0,0 +1,181 @@
+"""
+check_tiles
+
+A dock for app_doctor that runs the doctor's checks in-process, at the same time (see
+doctor_report.py), and shows a tile for each check: its status and how long it has taken,
+ticking while it runs. Clicking a tile prints what that check printed.
+
+The checks run on a thread of their own, so the window, and downloads, carry on meanwhile.
+"""
+
+# native
+import threading
+import time
+
+# pkg
+from PyQt5 import QtCore, QtWidgets
+
+# lib
+import doctor_report
+
+
+COLUMNS = 3
+TICK_MS = 100
+COLORS = {
+    "pending": "#e0e0e0",
+    "running": "#bbdefb",
+    "ok": "#c8e6c9",
+    "warning": "#ffe0b2",
+    "failed": "#ffcdd2",
+    "skipped": "#eeeeee",
+}
+
+
+class CheckTile(QtWidgets.QFrame):
+    """
+    The status and timing of one check
+
+        Arguments:
+
+            name (str): name of the check
+    """
+
+    clicked = QtCore.pyqtSignal(str)
+
+    def __init__(self, name, parent=None):
+        super().__init__(parent)
+        self.name = name
+        self.started = None
+        self.record = None
+
+        self.setFrameShape(QtWidgets.QFrame.StyledPanel)
+        self.setObjectName("checkTile")
+        self.title = QtWidgets.QLabel(name)
+        self.title.setStyleSheet("font-weight: bold")
+        self.status = QtWidgets.QLabel()
+        self.timing = QtWidgets.QLabel()
+        layout = QtWidgets.QVBoxLayout()
+        layout.addWidget(self.title)
+        layout.addWidget(self.status)
+        layout.addWidget(self.timing)
+        self.setLayout(layout)
+        self.set_status("pending")
+
+    def set_status(self, status):
+        self.status.setText(status.upper())
+        self.setStyleSheet(f"#checkTile {{ background: {COLORS[status]}; }}")
+
+    def start(self):
+        self.started = time.perf_counter()
+        self.set_status("running")
+
+    def finish(self, record):
+        self.record = record
+        self.set_status(record["status"])
+        self.timing.setText(f"{record['duration']:.2f}s")
+        self.setToolTip(record["error"] or "Click to show its output")
+
+    def tick(self):
+        if self.started is not None and self.record is None:
+            self.timing.setText(f"{time.perf_counter() - self.started:.1f}s")
+
+    def mousePressEvent(self, event):
+        self.clicked.emit(self.name)
+
+
+class ChecksDock(QtWidgets.QDockWidget):
+    """
+    Runs a list of checks on a thread and shows them as tiles
+
+        Arguments:
+
+            parent (QMainWindow)
+    """
+
+    started = QtCore.pyqtSignal(str) # emitted from the checks' thread, delivered on the GUI thread
+    finished_one = QtCore.pyqtSignal(dict)
+    finished = QtCore.pyqtSignal(list)
+
+    def __init__(self, parent=None):
+        super().__init__("Checks", parent)
+        self.setObjectName("checks_dock")
+        self.tiles = {}
+        self.running = False
+
+        self.grid = QtWidgets.QGridLayout()
+        self.summary = QtWidgets.QLabel("Press Run to check bcbio and your genomes")
+        layout = QtWidgets.QVBoxLayout()
+        layout.addWidget(self.summary)
+        layout.addLayout(self.grid)
+        layout.addStretch()
+        widget = QtWidgets.QWidget()
+        widget.setLayout(layout)
+        self.setWidget(widget)
+
+        self.started.connect(lambda name: self.tiles[name].start())
+        self.finished_one.connect(self.on_finished_one)
+        self.finished.connect(self.on_finished)
+        self.timer = QtCore.QTimer(self)
+        self.timer.timeout.connect(self.tick)
+
+    def run(self, checks):
+        """
+        Starts the checks, unless they are running already
+
+            Arguments:
+
+                checks (list): doctor_report.Check objects, in the order of the tiles
+
+            Returns:
+
+                started (bool)
+        """
+        if self.running:
+            return False
+        self.running = True
+        for tile in self.tiles.values():
+            self.grid.removeWidget(tile)
+            tile.deleteLater()
+        self.tiles = {}
+        for i, check in enumerate(checks):
+            tile = self.tiles[check.name] = CheckTile(check.name)
+            tile.clicked.connect(self.on_tile_clicked)
+            self.grid.addWidget(tile, i // COLUMNS, i % COLUMNS)
+
+        self.began = time.perf_counter()
+        self.summary.setText(f"Running {len(checks)} checks...")
+        self.timer.start(TICK_MS)
+        threading.Thread(target=self._run, args=(checks,), daemon=True).start()
+        return True
+
+    def _run(self, checks):
+        records = doctor_report.run_checks(checks, on_finished=self.finished_one.emit, on_started=self.started.emit)
+        self.finished.emit(records)
+
+    def tick(self):
+        for tile in self.tiles.values():
+            tile.tick()
+
+    def on_finished_one(self, record):
+        self.tiles[record["name"]].finish(record)
+
+    def on_finished(self, records):
+        self.running = False
+        self.timer.stop()
+        counts = {}
+        for record in records:
+            counts[record["status"]] = counts.get(record["status"], 0) + 1
+        self.summary.setText(
+            f"Finished in {time.perf_counter() - self.began:.1f}s: "
+            + ", ".join(f"{count} {status}" for status, count in counts.items())
+        )
+
+    def on_tile_clicked(self, name):
+        record = self.tiles[name].record
+        if record is None:
+            return
+        print(f"{name}: {record['status'].upper()} ({record['duration']:.2f}s)\n")
+        if record["output"]:
+            print(record["output"].rstrip("\n") + "\n")
+        if record["error"]:
+            print(record["error"] + "\n")
@@ -0,0 +1,305 @@
+"""
+counts_matrix
+
+The counts and TPM of a finished bcbio RNA-seq run, with its sample metadata, in one compact
+binary file that is read through a memory map instead of parsed as text.
+
+    <final>/<date>_<run>/counts.bcmx
+
+        magic       8 bytes, BCMX0001
+        matrices    float32, little-endian, gene-major: the values of one gene for every sample
+                    are contiguous, so a gene is a single slice of the map
+        footer      json: genes, samples, sample metadata, and the offset of each matrix
+        length      8 bytes, length of the footer
+        magic       8 bytes
+
+The tables are read from the run's project folder: tximport-counts.csv and tximport-tpm.csv
+(salmon), or combined.counts (featureCounts) when there is no tximport output, and the sample
+metadata and QC metrics from project-summary.yaml. Tables are streamed a gene at a time, so
+building the matrix of a large cohort needs little more memory than its gene and sample names.
+"""
+
+# native
+from array import array
+import csv
+import json
+import math
+import mmap
+import os
+from pathlib import Path
+import struct
+import sys
+
+# pkg
+import yaml
+
+
+MAGIC = b"BCMX0001"
+FILE_NAME = "counts.bcmx"
+ITEM = array("f").itemsize
+SOURCES = { # matrix -> tables that hold it, in order of preference
+    "counts": ["tximport-counts.csv", "combined.counts"],
+    "tpm": ["tximport-tpm.csv"],
+}
+SUMMARY = "project-summary.yaml"
+
+
+def find_project(final_path):
+    """
+    Finds the project folder bcbio wrote into the upload dir, the newest if the run was repeated
+
+        Arguments:
+
+            final_path (Path): the upload dir of the run, <outpath>/final/
+
+        Returns:
+
+            project_path (Path): None if no folder has a counts table
+    """
+    projects = {
+        table.parent for name in SOURCES["counts"] for table in Path(final_path).glob(f"*/{name}")
+    }
+    return max(projects, key=lambda path: path.stat().st_mtime) if projects else None
+
+
+def _open_table(path):
+    f = open(path, newline="")
+    reader = csv.reader(f, delimiter="," if path.suffix == ".csv" else "\t")
+    return f, reader
+
+
+def _read_genes(path):
+    f, reader = _open_table(path)
+    with f:
+        header = next(reader)
+        genes = [row[0] for row in reader if row]
+    return header[1:], genes
+
+
+def _read_metadata(project_path, samples):
+    metadata = {sample: {} for sample in samples}
+    try:
+        with open(project_path / SUMMARY) as f:
+            summary = yaml.safe_load(f) or {}
+    except (OSError, yaml.YAMLError): # counts without metadata are still worth having
+        return metadata
+    for entry in summary.get("samples", []):
+        name = entry.get("description")
+        if name in metadata:
+            metadata[name] = {
+                "metadata": entry.get("metadata") or {},
+                "metrics": (entry.get("summary") or {}).get("metrics") or {},
+            }
+    return metadata
+
+
+def build_matrix(project_path, out_path=None):
+    """
+    Assembles the counts, TPM and sample metadata of a run into one memory-mappable file
+
+        Arguments:
+
+            project_path (Path): bcbio's project folder, see find_project()
+            out_path     (Path): the file to write (default: <project_path>/counts.bcmx)
+
+        Returns:
+
+            summary (dict): path, genes, samples, matrices (matrix -> table it was read from),
+                            missing (matrix -> values stored as NaN, missing from its table or NA)
+    """
+    project_path = Path(project_path)
+    out_path = Path(out_path) if out_path else project_path / FILE_NAME
+    tables = {}
+    for matrix, names in SOURCES.items():
+        found = [project_path / name for name in names if (project_path / name).exists()]
+        if found:
+            tables[matrix] = found[0]
+    if "counts" not in tables:
+        raise ValueError(f"No counts table in {project_path}, looked for {', '.join(SOURCES['counts'])}")
+
+    # the counts table decides the order of genes and samples
+    samples, genes = _read_genes(tables["counts"])
+    gene_index = {gene: i for i, gene in enumerate(genes)}
+    size = len(genes) * len(samples) * ITEM
+    offsets = {}
+    position = len(MAGIC)
+    for matrix in tables:
+        offsets[matrix] = position
+        position += size
+
+    missing = {}
+    tmp_path = out_path.with_name(out_path.name + ".tmp")
+    try:
+        with open(tmp_path, "w+b") as out:
+            out.write(MAGIC)
+            out.truncate(position)
+            if size:
+                with mmap.mmap(out.fileno(), position) as mapped:
+                    for matrix, table in tables.items():
+                        missing[matrix] = _fill(mapped, offsets[matrix], table, gene_index, samples)
+            out.seek(position)
+            footer = json.dumps({
+                "genes": genes,
+                "samples": samples,
+                "metadata": _read_metadata(project_path, samples),
+                "matrices": {
+                    matrix: {"offset": offsets[matrix], "dtype": "float32", "source": table.name}
+                    for matrix, table in tables.items()
+                },
+                "byteorder": "little",
+            }).encode()
+            out.write(footer + struct.pack("<Q", len(footer)) + MAGIC)
+        os.replace(tmp_path, out_path) # a reader never sees half a matrix
+    except BaseException: # a bad table or ctrl-c, don't leave a large .tmp behind
+        if tmp_path.exists():
+            os.remove(tmp_path)
+        raise
+
+    return {
+        "path": out_path,
+        "genes": len(genes),
+        "samples": len(samples),
+        "matrices": {matrix: table.name for matrix, table in tables.items()},
+        "missing": missing,
+    }
+
+
+def _values(fields):
+    try:
+        return array("f", map(float, fields))
+    except ValueError: # R writes NA for a missing value
+        return array("f", (float(field) if field not in ("", "NA", "NaN") else math.nan for field in fields))
+
+
+def _fill(mapped, offset, table, gene_index, samples):
+    """
+    Writes one table into its matrix, a gene at a time, and NaN where the table has no value,
+    including the last samples of a row that is shorter than the header
+
+        Returns:
+
+            missing (int): values stored as NaN: genes or samples not in the table, values past the
+                           end of a short row, and NA or empty cells
+    """
+    width = len(samples) * ITEM
+    written = bytearray(len(gene_index))
+    f, reader = _open_table(table)
+    with f:
+        columns = next(reader)[1:]
+        position = {sample: i for i, sample in enumerate(columns)}
+        in_order = columns == samples # usually, then rows are copied as they are
+        order = [position.get(sample) for sample in samples]
+        blank = 0
+        for row in reader:
+            gene = gene_index.get(row[0]) if row else None
+            if gene is None:
+                continue
+            fields = row[1:]
+            if len(fields) > len(columns):
+                raise ValueError(
+                    f"{table} line {reader.line_num} has {len(fields)} values, its header has {len(columns)} samples"
+                )
+            if len(fields) < len(columns): # a truncated row, its last samples have no value
+                fields += ["NA"] * (len(columns) - len(fields))
+            values = _values(fields)
+            if not in_order:
+                values = array("f", (values[i] if i is not None else math.nan for i in order))
+            blank += sum(map(math.isnan, values))
+            if sys.byteorder != "little":
+                values.byteswap()
+            start = offset + gene * width
+            mapped[start:start + width] = values.tobytes()
+            written[gene] = 1
+
+    empty = array("f", [math.nan] * len(samples))
+    if sys.byteorder != "little":
+        empty.byteswap()
+    for gene, done in enumerate(written):
+        if not done:
+            start = offset + gene * width
+            mapped[start:start + width] = empty.tobytes()
+    return (len(written) - sum(written)) * len(samples) + blank
+
+
+class CountsMatrix:
+    """
+    A counts.bcmx, opened read-only through a memory map
+
+        Arguments:
+
+            path (Path): the file written by build_matrix()
+
+    Values of one gene come straight from the map without a copy, e.g.
+
+        with CountsMatrix(path) as matrix:
+            tpm = matrix.gene("ENSG00000141510", "tpm")  # every sample, in matrix.samples order
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.file = open(self.path, "rb")
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.map[:len(MAGIC)] != MAGIC or self.map[-len(MAGIC):] != MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not a counts matrix")
+
+        (length,) = struct.unpack("<Q", self.map[-len(MAGIC) - 8:-len(MAGIC)])
+        footer = json.loads(self.map[-len(MAGIC) - 8 - length:-len(MAGIC) - 8])
+        self.genes = footer["genes"]
+        self.samples = footer["samples"]
+        self.metadata = footer["metadata"]
+        self.matrices = footer["matrices"]
+        self.gene_index = {gene: i for i, gene in enumerate(self.genes)}
+        self.sample_index = {sample: i for i, sample in enumerate(self.samples)}
+        if sys.byteorder != "little":
+            raise ValueError("counts matrices are little-endian, read them on a little-endian machine")
+        self._views = {
+            matrix: memoryview(self.map)[info["offset"]:info["offset"] + len(self.genes) * len(self.samples) * ITEM].cast("f")
+            for matrix, info in self.matrices.items()
+        }
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if getattr(self, "_views", None):
+            for view in self._views.values():
+                view.release()
+            self._views = {}
+        try:
+            self.map.close()
+        except BufferError: # values handed out are still in use, the map closes when they are gone
+            pass
+        self.file.close()
+
+    def gene(self, gene, matrix="counts"):
+        """
+        Gets one gene across every sample, as a view of the map
+
+            Arguments:
+
+                gene   (str): the gene id, as in the counts table
+                matrix (str): counts or tpm
+
+            Returns:
+
+                values (memoryview): float32 per sample, in self.samples order, use .tolist() for a list
+        """
+        start = self.gene_index[gene] * len(self.samples)
+        return self._views[matrix][start:start + len(self.samples)]
+
+    def sample(self, sample, matrix="counts"):
+        """
+        Gets one sample across every gene, a strided read of the whole matrix
+
+            Returns:
+
+                values (memoryview): float32 per gene, in self.genes order
+        """
+        return self._views[matrix][self.sample_index[sample]::len(self.samples)]
+
+    def value(self, gene, sample, matrix="counts"):
+        return self._views[matrix][self.gene_index[gene] * len(self.samples) + self.sample_index[sample]]
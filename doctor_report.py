@@ -0,0 +1,185 @@
+"""
+doctor_report
+
+A registry of bcbio_doctor checks that runs independent checks at the same time and records
+the status, duration, printed output and returned data of each one.
+
+Checks print as they always have. While they run, sys.stdout is swapped for a router that
+sends each thread's prints to that check's own buffer, so concurrent checks don't interleave.
+"""
+
+# native
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import io
+import json
+import sys
+import threading
+import time
+import traceback
+
+
+class Check:
+    """
+    One registered check
+
+        Arguments:
+
+            name     (str):      name of the check, usually the function name
+            run      (function): called as run(results), where results maps the names of
+                                 finished checks to their data, returns this check's data
+            requires (list):     names of checks that must finish first
+            status   (function): called as status(data), returns "ok", "warning" or "failed"
+    """
+
+    def __init__(self, name, run, requires=(), status=None):
+        self.name = name
+        self.run = run
+        self.requires = list(requires)
+        self.status = status or (lambda data: "ok")
+
+
+class _ThreadRouter(io.TextIOBase):
+    """
+    Stands in for sys.stdout, sending each registered thread's writes to its own buffer
+    """
+
+    def __init__(self, fallback):
+        self.fallback = fallback
+        self.buffers = {}
+
+    def write(self, text):
+        buffer = self.buffers.get(threading.get_ident())
+        return (buffer or self.fallback).write(text)
+
+    def flush(self):
+        self.fallback.flush()
+
+
+def _run_one(check, results, router):
+    buffer = io.StringIO()
+    router.buffers[threading.get_ident()] = buffer
+    start = time.perf_counter()
+    record = {"name": check.name, "status": None, "duration": None, "output": "", "data": None, "error": None}
+
+    try:
+        record["data"] = check.run(results)
+        record["status"] = check.status(record["data"])
+    except Exception as e: # one broken check shouldn't hide the results of the others
+        record["status"] = "failed"
+        record["error"] = f"{type(e).__name__}: {e}"
+        buffer.write(traceback.format_exc())
+    finally:
+        record["duration"] = time.perf_counter() - start
+        record["output"] = buffer.getvalue()
+        del router.buffers[threading.get_ident()]
+
+    return record
+
+
+def run_checks(checks, workers=4, on_finished=None, on_started=None):
+    """
+    Runs checks, starting each one as soon as the checks it requires have finished
+
+        Arguments:
+
+            checks      (list):     Check objects, in the order they should be reported
+            workers     (int):      number of checks to run at once
+            on_finished (function): optional, called with each check's record as it finishes
+            on_started  (function): optional, called with each check's name as it starts
+
+        Returns:
+
+            records (list): name, status, duration (seconds), output, data and error of each check,
+                            in the order of checks. A check whose requirement raised an error is "skipped".
+    """
+    records = {}
+    results = {}
+    pending = list(checks)
+    running = {}
+
+    router = _ThreadRouter(sys.stdout)
+    sys.stdout = router
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            while pending or running:
+                for check in list(pending):
+                    required = [records.get(name) for name in check.requires]
+                    if any(r is not None and (r["error"] or r["status"] == "skipped") for r in required):
+                        records[check.name] = {
+                            "name": check.name, "status": "skipped", "duration": 0.0, "output": "",
+                            "data": None, "error": "requires " + ", ".join(check.requires),
+                        }
+                        pending.remove(check)
+                        on_finished(records[check.name]) if on_finished else None
+                    elif all(r is not None for r in required):
+                        running[pool.submit(_run_one, check, dict(results), router)] = check
+                        pending.remove(check)
+                        on_started(check.name) if on_started else None
+
+                if not running:
+                    continue
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    check = running.pop(future)
+                    records[check.name] = future.result()
+                    results[check.name] = records[check.name]["data"]
+                    on_finished(records[check.name]) if on_finished else None
+    finally:
+        sys.stdout = router.fallback
+
+    return [records[check.name] for check in checks]
+
+
+def print_report(records):
+    """
+    Prints the output of each check in order, in the doctor's usual format
+
+        Arguments:
+
+            records (list): as returned by run_checks
+
+        Returns:
+
+            None
+    """
+    print("_" * 25 + "\n")
+    for record in records:
+        print(f"{record['name']}: {record['status'].upper()} ({record['duration']:.2f}s)\n")
+        if record["output"]:
+            print(record["output"].rstrip("\n") + "\n")
+        if record["error"] and record["status"] == "skipped":
+            print(record["error"] + "\n")
+        print("_" * 25 + "\n")
+
+
+def write_json(records, path, started=None):
+    """
+    Writes the checks as a machine-readable report
+
+        Arguments:
+
+            records (list): as returned by run_checks
+            path    (str):  file to write, or - for stdout
+            started (float): when the checks started, as time.time()
+
+        Returns:
+
+            None
+    """
+    report = {
+        "started": started,
+        "duration": time.time() - started if started else None,
+        "status": (
+            "failed" if any(r["status"] == "failed" for r in records)
+            else "warning" if any(r["status"] in ("warning", "skipped") for r in records)
+            else "ok"
+        ),
+        "checks": records,
+    }
+    text = json.dumps(report, indent=1, default=str) # Paths and the like are written as strings
+
+    if path == "-":
+        print(text)
+    else:
+        with open(path, "w") as f:
+            f.write(text + "\n")
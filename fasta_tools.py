@@ -0,0 +1,557 @@
+"""
+fasta_tools
+
+FASTA checks and tools used by bcbio_doctor, including the transcript id join between a
+transcriptome FASTA and its GTF, stripping or adding id version suffixes, and a
+samtools compatible (.fai) index that later checks reuse instead of rescanning the FASTA.
+
+Transcript ids are kept as sorted arrays of 64 bit hashes rather than sets of strings,
+which keeps a 250k transcript reference at a few MB.
+"""
+
+# native
+from array import array
+from bisect import bisect_left
+from contextlib import contextmanager
+import mmap
+import os
+from pathlib import Path
+import re
+import tempfile
+
+
+READ_BUFFER = 16 * 1024 * 1024
+MAX_EXAMPLES = 5
+
+TRANSCRIPT_ID = re.compile(rb'transcript_id "([^"]*)"')
+TRANSCRIPT_VERSION = re.compile(rb'transcript_version "([^"]*)"')
+
+
+def _id_hash(name):
+    return hash(name) & 0xFFFFFFFFFFFFFFFF # only compared within this process, so hash() is stable enough
+
+
+def strip_version(name):
+    """
+    Removes a trailing .<number> version from an id
+
+        Arguments:
+
+            name (bytes): an id, e.g. b"ENST00000456328.2"
+
+        Returns:
+
+            name (bytes): the id without its version, e.g. b"ENST00000456328"
+    """
+    base, dot, version = name.rpartition(b".")
+    return base if dot and version.isdigit() else name
+
+
+def fasta_ids(path):
+    """
+    Streams the record ids (the first word of each header) of a FASTA file
+
+        Arguments:
+
+            path (Path): the FASTA file
+
+        Returns:
+
+            ids (generator): bytes ids, in file order
+    """
+    with open(path, "rb", buffering=READ_BUFFER) as f:
+        for line in f:
+            if line[:1] == b">":
+                yield line[1:].split(None, 1)[0] if line[1:].strip() else b""
+
+
+def gtf_transcript_ids(path):
+    """
+    Streams the distinct-in-a-row transcript ids of a GTF file
+
+        Arguments:
+
+            path (Path): the GTF file
+
+        Returns:
+
+            ids (generator): (transcript_id, transcript_version or None) as bytes
+    """
+    last = None
+    with open(path, "rb", buffering=READ_BUFFER) as f:
+        for line in f:
+            if line[:1] == b"#":
+                continue
+            match = TRANSCRIPT_ID.search(line)
+            if not match or match.group(1) == last: # records of one transcript are usually together
+                continue
+            last = match.group(1)
+            version = TRANSCRIPT_VERSION.search(line)
+            yield last, version.group(1) if version else None
+
+
+class HashedIdSet:
+    """
+    A compact, sorted set of id hashes, with a bit per id to record which were matched
+
+        Arguments:
+
+            ids (iterable): bytes ids
+    """
+
+    def __init__(self, ids):
+        self.hashes = array("Q", sorted({_id_hash(name) for name in ids}))
+        self.matched = bytearray(len(self.hashes))
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def find(self, name):
+        """
+        Finds an id, returning its position or -1
+        """
+        h = _id_hash(name)
+        i = bisect_left(self.hashes, h)
+        return i if i < len(self.hashes) and self.hashes[i] == h else -1
+
+    def mark(self, name):
+        """
+        Marks an id as matched, returning None if it isn't in the set,
+        False if it was already marked and True if it is newly marked
+        """
+        i = self.find(name)
+        if i == -1:
+            return None
+        if self.matched[i]:
+            return False
+        self.matched[i] = 1
+        return True
+
+    def is_marked(self, name):
+        """
+        Checks whether an id is in the set and was matched
+        """
+        i = self.find(name)
+        return i != -1 and self.matched[i] == 1
+
+
+def check_transcript_ids(fasta_path, gtf_path, fasta_id_source=None):
+    """
+    Joins the transcript ids of a transcriptome FASTA against the transcript_ids of a GTF
+
+        Arguments:
+
+            fasta_path      (Path):     the transcriptome FASTA
+            gtf_path        (Path):     the transcriptome GTF
+            fasta_id_source (function): optional function returning an iterable of FASTA ids,
+                                        used instead of reading the .fai or the headers of fasta_path
+
+        Returns:
+
+            report (dict): counts of fasta and gtf transcripts, matched, version_mismatch,
+                           missing_from_gtf and extra_in_gtf, with a few examples of each problem
+    """
+    if fasta_id_source is None and _fresh_fai(fasta_path): # the index is far smaller than the fasta
+        fasta_id_source = lambda: (entry[0].encode() for entry in read_fai(fasta_path))
+    fasta_id_source = fasta_id_source or (lambda: fasta_ids(fasta_path))
+
+    full = HashedIdSet(fasta_id_source())
+    stripped = HashedIdSet(strip_version(name) for name in fasta_id_source())
+
+    report = {
+        "fasta_transcripts": len(full),
+        "gtf_transcripts": 0,
+        "matched": 0,
+        "version_mismatch": 0,
+        "missing_from_gtf": 0,
+        "extra_in_gtf": 0,
+        "examples": {"version_mismatch": [], "missing_from_gtf": [], "extra_in_gtf": []},
+    }
+    seen_extra = set() # hashes of gtf-only ids, so transcripts that aren't contiguous count once
+
+    def example(kind, name):
+        if len(report["examples"][kind]) < MAX_EXAMPLES:
+            report["examples"][kind].append(name.decode(errors="replace"))
+
+    for transcript_id, version in gtf_transcript_ids(gtf_path):
+        marked = full.mark(transcript_id)
+        kind = "matched"
+
+        if marked is None and version:
+            # ensembl gtfs keep the version in transcript_version, while the cdna headers have it in the id
+            marked = full.mark(transcript_id + b"." + version)
+            kind = "version_mismatch"
+        if marked is None:
+            marked = stripped.mark(strip_version(transcript_id))
+            kind = "version_mismatch"
+        if marked is None:
+            h = _id_hash(transcript_id)
+            marked = h not in seen_extra
+            seen_extra.add(h)
+            kind = "extra_in_gtf"
+
+        if not marked: # seen before, transcripts that aren't contiguous in the gtf only count once
+            continue
+
+        report["gtf_transcripts"] += 1
+        report[kind] += 1
+        if kind != "matched":
+            example(kind, transcript_id + (b" (transcript_version " + version + b")" if version else b""))
+
+    for name in fasta_id_source(): # second pass over the ids only, to name what the gtf is missing
+        if not full.is_marked(name) and not stripped.is_marked(strip_version(name)):
+            report["missing_from_gtf"] += 1
+            example("missing_from_gtf", name)
+
+    return report
+
+
+GTF_VERSIONED_ID = re.compile(rb'\b((?:transcript_id|gene_id) "[^"]*?)\.\d+"')
+GTF_ID = re.compile(rb'\b(transcript_id|gene_id) "([^"]*)"')
+GTF_VERSION = re.compile(rb'\b(transcript_version|gene_version) "([^"]*)"')
+
+
+@contextmanager
+def atomic_output(out_path):
+    """
+    Opens a temporary file next to out_path, which replaces out_path only if the block succeeds
+
+        Arguments:
+
+            out_path (Path): the file to write
+
+        Returns:
+
+            file (file): a binary file object with a large write buffer
+    """
+    out_dir = os.path.dirname(os.path.abspath(out_path))
+    fd, tmp_path = tempfile.mkstemp(dir=out_dir, prefix=os.path.basename(out_path) + ".")
+    try:
+        with os.fdopen(fd, "wb", buffering=READ_BUFFER) as out:
+            yield out
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, out_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def _blocks(f, block_size=READ_BUFFER):
+    """
+    Reads a file in large blocks that always end on a line boundary
+    """
+    while True:
+        block = f.read(block_size)
+        if not block:
+            return
+        if not block.endswith(b"\n"):
+            block += f.readline()
+        yield block
+
+
+def _next_header(block, pos):
+    """
+    Finds the start of the next header line, with bytes.find so sequence lines are never parsed
+    """
+    i = block.find(b"\n>", pos)
+    return -1 if i == -1 else i + 1
+
+
+def strip_fasta_versions(in_path, out_path):
+    """
+    Removes the .<number> version from the id of every FASTA header.
+    Sequence lines are copied through in blocks without being parsed.
+
+        Arguments:
+
+            in_path  (Path): the FASTA to read
+            out_path (Path): where to write the FASTA with unversioned ids
+
+        Returns:
+
+            records (int): number of headers that were rewritten
+    """
+    records = 0
+
+    with open(in_path, "rb", buffering=0) as f, atomic_output(out_path) as out:
+        for block in _blocks(f):
+            start = 0
+            header = 0 if block[:1] == b">" else _next_header(block, 0)
+            while header != -1:
+                end = block.find(b"\n", header)
+                end = len(block) if end == -1 else end
+                name, space, rest = block[header + 1:end].partition(b" ")
+                out.write(block[start:header])
+                out.write(b">" + strip_version(name) + space + rest)
+                records += 1
+                start = end
+                header = _next_header(block, end)
+            out.write(block[start:])
+
+    return records
+
+
+def strip_gtf_versions(in_path, out_path):
+    """
+    Removes the .<number> version from every transcript_id and gene_id of a GTF
+
+        Arguments:
+
+            in_path  (Path): the GTF to read
+            out_path (Path): where to write the GTF with unversioned ids
+
+        Returns:
+
+            records (int): number of ids that were rewritten
+    """
+    records = 0
+
+    with open(in_path, "rb", buffering=0) as f, atomic_output(out_path) as out:
+        for block in _blocks(f):
+            block, n = GTF_VERSIONED_ID.subn(rb'\1"', block)
+            records += n
+            out.write(block)
+
+    return records
+
+
+def add_gtf_versions(in_path, out_path):
+    """
+    Appends transcript_version and gene_version to the transcript_id and gene_id of every GTF record,
+    which makes an ensembl GTF match the versioned ids of the ensembl cDNA FASTA
+
+        Arguments:
+
+            in_path  (Path): the GTF to read
+            out_path (Path): where to write the GTF with versioned ids
+
+        Returns:
+
+            records (int): number of ids that were rewritten
+    """
+    records = 0
+
+    with open(in_path, "rb", buffering=READ_BUFFER) as f, atomic_output(out_path) as out:
+        for line in f:
+            if line[:1] == b"#" or b"_version" not in line:
+                out.write(line)
+                continue
+
+            versions = {key[:-len(b"_version")]: value for key, value in GTF_VERSION.findall(line)}
+
+            def add(match):
+                nonlocal records
+                kind, name = match.group(1), match.group(2)
+                version = versions.get(kind[:-len(b"_id")])
+                if not version or strip_version(name) != name: # no version, or already versioned
+                    return match.group(0)
+                records += 1
+                return kind + b' "' + name + b"." + version + b'"'
+
+            out.write(GTF_ID.sub(add, line))
+
+    return records
+
+
+COUNT_BLOCK = 16 * 1024 * 1024
+
+
+def fai_path(fasta_path):
+    """
+    Gets the path of the samtools index of a FASTA file
+    """
+    return Path(str(fasta_path) + ".fai")
+
+
+def _fresh_fai(fasta_path):
+    index_path = fai_path(fasta_path)
+    return index_path.is_file() and index_path.stat().st_mtime >= Path(fasta_path).stat().st_mtime
+
+
+def build_fai(fasta_path):
+    """
+    Scans a FASTA file once, over a memory map, and builds its samtools faidx index
+
+        Arguments:
+
+            fasta_path (Path): the FASTA to index
+
+        Returns:
+
+            entries   (list): (name, length, offset, linebases, linewidth) for each record,
+                              records without sequence are skipped like samtools does
+            irregular (list): names of records whose lines are not all the same length,
+                              which samtools can't index
+    """
+    entries = []
+    irregular = []
+
+    with open(fasta_path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return entries, irregular
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    with mm:
+        size = len(mm)
+        header = 0 if mm[:1] == b">" else _next_header(mm, 0)
+
+        while header != -1:
+            header_end = mm.find(b"\n", header)
+            header_end = size if header_end == -1 else header_end
+            name = mm[header + 1:header_end].split(None, 1)
+            name = name[0] if name else b""
+
+            offset = min(header_end + 1, size)
+            following = _next_header(mm, header_end)
+            end = size if following == -1 else following
+
+            first_newline = mm.find(b"\n", offset, end)
+            if offset == end: # samtools skips records without sequence
+                header = following
+                continue
+            if first_newline == -1: # a single unterminated line
+                linebases = end - offset
+                linewidth = linebases + 1
+                newlines = 0
+            else:
+                linewidth = first_newline - offset + 1
+                linebases = linewidth - (2 if mm[first_newline - 1:first_newline] == b"\r" else 1)
+                newlines = sum(
+                    mm[i:min(i + COUNT_BLOCK, end)].count(b"\n") for i in range(offset, end, COUNT_BLOCK)
+                )
+
+            region = end - offset
+            terminated = mm[end - 1:end] == b"\n"
+            full_lines = newlines - 1 if terminated else newlines
+            last_line = region - full_lines * linewidth
+            length = full_lines * linebases + last_line - (linewidth - linebases if terminated else 0)
+
+            # every full line must end exactly where linewidth says, which a strided slice checks in C
+            line_ends = mm[offset + linewidth - 1:offset + full_lines * linewidth:linewidth] if full_lines > 0 else b""
+            if line_ends.count(b"\n") != full_lines or not 0 < last_line <= linewidth:
+                irregular.append(name.decode(errors="replace"))
+
+            entries.append((name.decode(errors="replace"), length, offset, linebases, linewidth))
+            header = following
+
+    return entries, irregular
+
+
+def write_fai(fasta_path, entries):
+    """
+    Writes a samtools compatible .fai next to the FASTA file
+    """
+    with atomic_output(fai_path(fasta_path)) as out:
+        out.write("".join("\t".join(str(x) for x in entry) + "\n" for entry in entries).encode())
+
+
+def read_fai(fasta_path):
+    """
+    Reads the .fai of a FASTA file
+
+        Arguments:
+
+            fasta_path (Path): the FASTA whose index to read
+
+        Returns:
+
+            entries (list): (name, length, offset, linebases, linewidth) for each record
+    """
+    entries = []
+    with open(fai_path(fasta_path), "r") as f:
+        for line in f:
+            name, *numbers = line.rstrip("\n").split("\t")[:5]
+            entries.append((name, *(int(x) for x in numbers)))
+    return entries
+
+
+def index_fasta(fasta_path):
+    """
+    Gets the index of a FASTA file, reusing its .fai when it is newer than the FASTA
+
+        Arguments:
+
+            fasta_path (Path): the FASTA to index
+
+        Returns:
+
+            entries   (list): (name, length, offset, linebases, linewidth) for each record
+            irregular (list): records samtools can't index, always empty for a reused .fai
+    """
+    if _fresh_fai(fasta_path):
+        return read_fai(fasta_path), []
+
+    entries, irregular = build_fai(fasta_path)
+    if not irregular:
+        try:
+            write_fai(fasta_path, entries)
+        except OSError: # a read-only reference folder is fine, the index is just not kept
+            pass
+    return entries, irregular
+
+
+def fetch_sequence(fasta_path, entry, start=0, end=None):
+    """
+    Reads part of one record using its index entry, without scanning the file
+
+        Arguments:
+
+            fasta_path (Path):  the FASTA file
+            entry      (tuple): the record's (name, length, offset, linebases, linewidth)
+            start      (int):   0-based start of the sequence to read
+            end        (int):   end of the sequence to read (default: the end of the record)
+
+        Returns:
+
+            sequence (bytes): the bases, without newlines
+    """
+    _, length, offset, linebases, linewidth = entry
+    end = length if end is None else min(end, length)
+    if start >= end or linebases == 0:
+        return b""
+
+    def position(base):
+        return offset + base // linebases * linewidth + base % linebases
+
+    with open(fasta_path, "rb") as f:
+        f.seek(position(start))
+        raw = f.read(position(end - 1) - position(start) + 1)
+    return raw.replace(b"\r", b"").replace(b"\n", b"")
+
+
+def fasta_stats(entries):
+    """
+    Summarizes the header format and sequence lengths of an indexed FASTA
+
+        Arguments:
+
+            entries (list): as returned by index_fasta
+
+        Returns:
+
+            stats (dict): records, versioned and unversioned id counts, duplicate ids, and
+                          total, min, max, mean and N50 sequence length
+    """
+    lengths = sorted((entry[1] for entry in entries), reverse=True)
+    versioned = sum(1 for entry in entries if strip_version(entry[0].encode()) != entry[0].encode())
+    total = sum(lengths)
+
+    n50 = 0
+    running = 0
+    for length in lengths:
+        running += length
+        if running * 2 >= total:
+            n50 = length
+            break
+
+    return {
+        "records": len(entries),
+        "versioned": versioned,
+        "unversioned": len(entries) - versioned,
+        "duplicates": len(entries) - len(HashedIdSet(entry[0].encode() for entry in entries)),
+        "total_length": total,
+        "min_length": lengths[-1] if lengths else 0,
+        "max_length": lengths[0] if lengths else 0,
+        "mean_length": total / len(lengths) if lengths else 0,
+        "n50": n50,
+    }
@@ -0,0 +1,133 @@
+"""
+fastq_check
+
+Verifies that every input *.fq.gz decompresses completely and passes its CRC checks, before
+bcbio starts. A truncated or corrupt FASTQ otherwise only fails bcbio hours into a run.
+
+Files are verified at the same time across a process pool. Files that verified before are
+remembered in <cache>/fastq_verified.json (see local_cache.py) by path, size and modification
+time, so unchanged files are not decompressed again on later runs.
+"""
+
+# native
+from multiprocessing import Pool
+import os
+import time
+import zlib
+
+# lib
+import local_cache
+
+
+READ_SIZE = 4 * 1024 * 1024
+
+
+def _fingerprint(path):
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def verify_gzip(path):
+    """
+    Decompresses a whole gzip file, checking the CRC and length of every member
+
+        Arguments:
+
+            path (str): the gzip file, plain or multi-member (e.g. bgzip)
+
+        Returns:
+
+            result (dict): path, size, uncompressed (bytes), seconds, cached (False) and error
+                           (None if the file is intact)
+    """
+    start = time.perf_counter()
+    result = {"path": str(path), "size": os.path.getsize(path), "uncompressed": 0,
+              "seconds": None, "cached": False, "error": None}
+    members = 0
+    pending = False # part of a member was read, but not its end
+
+    try:
+        with open(path, "rb") as f:
+            for data in iter(lambda: f.read(READ_SIZE), b""):
+                while data:
+                    if not pending and not data.strip(b"\x00"): # gzip allows zero padding after a member
+                        break
+                    if not pending:
+                        decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16) # zlib checks CRC32 and ISIZE
+                        pending = True
+                    result["uncompressed"] += len(decompressor.decompress(data))
+                    if not decompressor.eof:
+                        break
+                    members += 1 # a member ended, the rest of data belongs to the next one
+                    pending = False
+                    data = decompressor.unused_data
+
+        if pending:
+            result["error"] = "truncated: the file ends in the middle of a gzip member"
+        elif members == 0:
+            result["error"] = "empty: the file has no gzip data"
+    except zlib.error as e:
+        result["error"] = f"corrupt: {e}"
+    except OSError as e:
+        result["error"] = str(e)
+
+    result["seconds"] = time.perf_counter() - start
+    return result
+
+
+def verify_fastqs(paths, workers=None, use_cache=True):
+    """
+    Verifies many gzip files at the same time, skipping those that verified before and have not changed
+
+        Arguments:
+
+            paths     (list): the gzip files
+            workers   (int):  number of worker processes (default: all cores)
+            use_cache (bool): skip files whose path, size and modification time verified before
+
+        Returns:
+
+            report (dict): files (one verify_gzip result per path, in paths order), failed (those with an error),
+                           verified_bytes, seconds and MBps (compressed throughput of the files verified now)
+    """
+    start = time.perf_counter()
+    paths = [os.path.realpath(path) for path in paths]
+    cache_path = local_cache.cache_dir() / "fastq_verified.json"
+    cache = local_cache.read_json(cache_path, {}) if use_cache else {}
+
+    results = {}
+    todo = []
+    for path in paths:
+        fingerprint = _fingerprint(path)
+        if cache.get(path) == fingerprint:
+            results[path] = {"path": path, "size": fingerprint["size"], "uncompressed": None,
+                             "seconds": 0.0, "cached": True, "error": None}
+        else:
+            todo.append(path)
+
+    todo.sort(key=os.path.getsize, reverse=True) # largest first, so one big file doesn't finish last alone
+    workers = max(1, min(workers or os.cpu_count() or 1, len(todo)))
+    if todo:
+        with Pool(workers) as pool:
+            for result in pool.imap_unordered(verify_gzip, todo):
+                results[result["path"]] = result
+                status = "OK" if result["error"] is None else "FAILED: " + result["error"]
+                print(f"{os.path.basename(result['path'])}: {status}")
+
+    if use_cache and todo:
+        for path in todo:
+            if results[path]["error"] is None:
+                cache[path] = _fingerprint(path)
+            else:
+                cache.pop(path, None)
+        local_cache.write_json(cache_path, cache)
+
+    seconds = time.perf_counter() - start
+    verified_bytes = sum(results[path]["size"] for path in todo)
+    return {
+        "files": [results[path] for path in paths],
+        "failed": [results[path] for path in paths if results[path]["error"]],
+        "verified_bytes": verified_bytes,
+        "seconds": seconds,
+        "MBps": verified_bytes / 1e6 / seconds if todo else None,
+    }
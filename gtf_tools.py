@@ -0,0 +1,354 @@
+"""
+gtf_tools
+
+Whole-file GTF checks and seqname renaming used by bcbio_doctor.
+
+Large GTFs are split into chunks that end on line boundaries, and each chunk is scanned by
+its own worker process over a memory map of the file. Renamed chunks are written to part
+files and joined in order into a temporary file, which replaces the output in one step.
+
+Worker processes are started by a forkserver (spawn where there is none), never forked from the
+caller: bcbio_doctor runs its checks on threads, and a fork taken while another thread holds a
+lock (stdout, a subprocess pipe) can leave the worker deadlocked.
+"""
+
+# native
+from collections import Counter
+import mmap
+import multiprocessing
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import time
+
+
+MIN_CHUNK_SIZE = 32 * 1024 * 1024 # smaller files are scanned in-process, a pool costs more than it saves
+MAX_EXAMPLES = 5 # how many malformed lines to keep for the report
+START_METHOD = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+
+ATTRIBUTE_KEY = re.compile(rb'(?:^|;)\s*([A-Za-z_][\w.]*)\s')
+
+
+def chunk_boundaries(path, n_chunks):
+    """
+    Splits a file into byte ranges that start and end on line boundaries
+
+        Arguments:
+
+            path     (Path): the file to split
+            n_chunks (int):  how many ranges to aim for
+
+        Returns:
+
+            ranges (list): (start, end) byte offsets, covering the whole file
+    """
+    size = os.path.getsize(path)
+    if size == 0:
+        return []
+
+    starts = [0]
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        for i in range(1, n_chunks):
+            newline = mm.find(b"\n", max(starts[-1], i * size // n_chunks))
+            if newline == -1 or newline + 1 >= size:
+                break
+            if newline + 1 > starts[-1]:
+                starts.append(newline + 1)
+
+    return list(zip(starts, starts[1:] + [size]))
+
+
+def _scan_chunk(job):
+    """
+    Scans one chunk of a GTF, this runs inside a worker process
+
+        Arguments:
+
+            job (tuple): (path, start, end) of the chunk
+
+        Returns:
+
+            stats (dict): counts for the chunk, malformed line numbers are relative to the chunk
+    """
+    path, start, end = job
+    seqnames = Counter()
+    features = Counter()
+    attribute_keys = Counter()
+    lines = records = comments = malformed = 0
+    examples = []
+
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        for line in mm[start:end].splitlines():
+            lines += 1
+            if not line or line[:1] == b"#":
+                comments += 1
+                continue
+
+            fields = line.split(b"\t")
+            if len(fields) != 9 or not fields[3].isdigit() or not fields[4].isdigit():
+                malformed += 1
+                if len(examples) < MAX_EXAMPLES:
+                    examples.append((lines, line[:200].decode(errors="replace")))
+                continue
+
+            records += 1
+            seqnames[fields[0]] += 1
+            features[fields[2]] += 1
+            attribute_keys.update(set(ATTRIBUTE_KEY.findall(fields[8]))) # once per record, for coverage
+
+    return {
+        "lines": lines,
+        "records": records,
+        "comments": comments,
+        "malformed": malformed,
+        "malformed_examples": examples,
+        "seqnames": seqnames,
+        "features": features,
+        "attribute_keys": attribute_keys,
+    }
+
+
+def _pool(processes):
+    return multiprocessing.get_context(START_METHOD).Pool(processes)
+
+
+def validate_gtf(path, workers=None):
+    """
+    Scans every line of a GTF file and summarizes it
+
+        Arguments:
+
+            path    (Path): the GTF to scan
+            workers (int):  number of worker processes (default: all cores)
+
+        Returns:
+
+            report (dict): line, record, comment and malformed line counts, malformed examples
+                           (line number, text), and Counters of seqnames, features and
+                           attribute keys (number of records with each key)
+    """
+    workers = workers or os.cpu_count() or 1
+    workers = max(1, min(workers, os.path.getsize(path) // MIN_CHUNK_SIZE))
+    jobs = [(str(path), start, end) for start, end in chunk_boundaries(path, workers)]
+
+    if len(jobs) > 1:
+        with _pool(len(jobs)) as pool:
+            results = pool.map(_scan_chunk, jobs)
+    else:
+        results = [_scan_chunk(job) for job in jobs]
+
+    report = {
+        "lines": 0,
+        "records": 0,
+        "comments": 0,
+        "malformed": 0,
+        "malformed_examples": [],
+        "seqnames": Counter(),
+        "features": Counter(),
+        "attribute_keys": Counter(),
+    }
+    for result in results: # chunks come back in file order, so line numbers just add up
+        for line_no, text in result["malformed_examples"]:
+            if len(report["malformed_examples"]) < MAX_EXAMPLES:
+                report["malformed_examples"].append((report["lines"] + line_no, text))
+        for key in ("lines", "records", "comments", "malformed"):
+            report[key] += result[key]
+        for key in ("seqnames", "features", "attribute_keys"):
+            report[key].update(result[key])
+
+    for key in ("seqnames", "features", "attribute_keys"): # bytes -> str for printing and json
+        report[key] = Counter({k.decode(errors="replace"): v for k, v in report[key].items()})
+
+    return report
+
+
+def annotation_style(seqnames):
+    """
+    Classifies a set of seqnames by their chr prefix
+
+        Arguments:
+
+            seqnames (iterable): seqnames found in a GTF
+
+        Returns:
+
+            style (str): "chrX", "X", "mixed", or "empty"
+    """
+    prefixed = any(name.startswith("chr") for name in seqnames)
+    unprefixed = any(not name.startswith("chr") for name in seqnames)
+
+    if prefixed and unprefixed:
+        return "mixed"
+    if prefixed:
+        return "chrX"
+    if unprefixed:
+        return "X"
+    return "empty"
+
+
+RENAME_BLOCK_SIZE = 64 * 1024 * 1024 # each worker renames at most this much of the file at a time
+PRIMARY_CONTIGS = [str(i) for i in range(1, 23)] + ["X", "Y"]
+
+
+def seqname_mapping(style="ucsc", mapping_path=None):
+    """
+    Builds the seqname mapping used by rename_seqnames
+
+        Arguments:
+
+            style        (str):  "ucsc" to rename X -> chrX, or "ensembl" to rename chrX -> X
+            mapping_path (Path): optional two column file (from, to) with extra or overriding entries,
+                                 e.g. scaffold names, which can't be derived from the name alone
+
+        Returns:
+
+            mapping (dict): bytes seqname -> bytes seqname
+    """
+    if style not in ("ucsc", "ensembl"):
+        raise ValueError(f"Unknown seqname style {style}, use ucsc or ensembl")
+
+    mapping = {name: "chr" + name for name in PRIMARY_CONTIGS}
+    mapping["MT"] = "chrM" # ensembl and ucsc disagree on the mitochondrial name, not just the prefix
+
+    if style == "ensembl":
+        mapping = {to: name for name, to in mapping.items()}
+
+    if mapping_path:
+        with open(mapping_path, "r") as f:
+            for line in f:
+                if line.startswith("#") or not line.strip():
+                    continue
+                fields = line.split()
+                if len(fields) < 2:
+                    raise ValueError(f"{mapping_path} should have two columns, got: {line.strip()}")
+                mapping[fields[0]] = fields[1]
+
+    return {name.encode(): to.encode() for name, to in mapping.items()}
+
+
+def _rename_chunk(job):
+    """
+    Renames the seqnames of one chunk of a GTF into a part file, this runs inside a worker process
+
+        Arguments:
+
+            job (tuple): (path, start, end, mapping, part_path)
+
+        Returns:
+
+            result (tuple): (part_path, Counter of seqnames that had no mapping)
+    """
+    path, start, end, mapping, part_path = job
+    unmapped = Counter()
+    out = []
+
+    get = mapping.get # bound once, this loop runs for every line of the file
+    append = out.append
+
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        for line in mm[start:end].splitlines(keepends=True):
+            name, tab, rest = line.partition(b"\t")
+            new_name = get(name)
+            if new_name is None: # headers and blank lines pass through untouched
+                append(line)
+                if tab and line[:1] != b"#":
+                    unmapped[name] += 1
+            else:
+                append(new_name)
+                append(tab)
+                append(rest)
+
+    with open(part_path, "wb", buffering=8 * 1024 * 1024) as part:
+        part.write(b"".join(out))
+
+    return part_path, unmapped
+
+
+def rename_seqnames(in_path, out_path, mapping, workers=None):
+    """
+    Rewrites the seqnames of a GTF, the output only appears once it is complete
+
+        Arguments:
+
+            in_path  (Path): the GTF to rename
+            out_path (Path): where to write the renamed GTF
+            mapping  (dict): bytes seqname -> bytes seqname, as made by seqname_mapping
+            workers  (int):  number of worker processes (default: all cores)
+
+        Returns:
+
+            unmapped (Counter): seqnames that were left as they were, with their record counts
+    """
+    workers = workers or os.cpu_count() or 1
+    n_chunks = max(1, os.path.getsize(in_path) // RENAME_BLOCK_SIZE + 1)
+    out_dir = os.path.dirname(os.path.abspath(out_path))
+    fd, tmp_path = tempfile.mkstemp(dir=out_dir, prefix=os.path.basename(out_path) + ".")
+    os.close(fd)
+
+    jobs = [
+        (str(in_path), start, end, mapping, f"{tmp_path}.part{i}")
+        for i, (start, end) in enumerate(chunk_boundaries(in_path, n_chunks))
+    ]
+    unmapped = Counter()
+
+    try:
+        with open(tmp_path, "wb") as out, _pool(min(workers, max(1, len(jobs)))) as pool:
+            for part_path, part_unmapped in pool.imap(_rename_chunk, jobs): # parts come back in file order
+                with open(part_path, "rb") as part:
+                    shutil.copyfileobj(part, out, 16 * 1024 * 1024)
+                os.remove(part_path)
+                unmapped.update(part_unmapped)
+        shutil.copymode(in_path, tmp_path)
+        os.replace(tmp_path, out_path) # atomic, a killed run never leaves a half-renamed GTF behind
+    finally:
+        for job in jobs:
+            if os.path.exists(job[-1]):
+                os.remove(job[-1])
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    return Counter({name.decode(errors="replace"): count for name, count in unmapped.items()})
+
+
+def benchmark_rename(in_path, mapping, workers=None):
+    """
+    Times rename_seqnames against the awk one-liner it replaces
+
+        Arguments:
+
+            in_path (Path): the GTF to rename
+            mapping (dict): as made by seqname_mapping
+            workers (int):  number of worker processes (default: all cores)
+
+        Returns:
+
+            results (dict): seconds and MB/s for "rename_seqnames" and "awk" (None if awk is missing)
+    """
+    size_mb = os.path.getsize(in_path) / 1e6
+    results = {}
+
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(in_path))) as tmp_dir:
+        out_path = os.path.join(tmp_dir, "renamed.gtf")
+
+        start = time.perf_counter()
+        rename_seqnames(in_path, out_path, mapping, workers)
+        elapsed = time.perf_counter() - start
+        results["rename_seqnames"] = {"seconds": elapsed, "MB/s": size_mb / elapsed}
+
+        if shutil.which("awk"):
+            start = time.perf_counter()
+            with open(in_path, "rb") as f_in, open(out_path, "wb") as f_out:
+                subprocess.run(
+                    ["awk", 'OFS="\\t" {if (NR > 5) $1="chr"$1; print}'],
+                    stdin=f_in,
+                    stdout=f_out,
+                    check=True,
+                )
+            elapsed = time.perf_counter() - start
+            results["awk"] = {"seconds": elapsed, "MB/s": size_mb / elapsed}
+        else:
+            results["awk"] = None
+
+    return results
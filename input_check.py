@@ -0,0 +1,207 @@
+"""
+input_check
+
+Checks the inputs of a bcbio_helper run before it starts: discovers and pairs the FASTQ files
+of each sample, and checks the format of the transcriptome FASTA and GTF and that they agree.
+
+Findings are (level, message) pairs, where level is "ERROR", "WARNING" or "INFO". An ERROR
+means bcbio would fail on the input.
+"""
+
+# native
+from collections import Counter
+import os
+import re
+import time
+
+# lib
+import fasta_tools
+import gtf_tools
+
+
+FASTQ = re.compile(r"\.(?:fq|fastq)\.gz$")
+MATE = re.compile(r"^(?P<before>.*?[._])(?P<read>R?)(?P<mate>[12])(?P<after>(?:_\d{3})?\.(?:fq|fastq)\.gz)$")
+GZIP_MAGIC = b"\x1f\x8b"
+
+
+def _walk_fastqs(path):
+    """
+    Yields the FASTQ files of each folder under path, a folder at a time, as the walk goes
+    """
+    stack = [str(path)]
+    while stack:
+        directory = stack.pop()
+        files = {}
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.is_dir():
+                        stack.append(entry.path)
+                    elif FASTQ.search(entry.name) and entry.is_file():
+                        files[entry.path] = entry.stat().st_size
+        except OSError: # unreadable folders are skipped, bcbio couldn't read them either
+            continue
+        if files:
+            yield directory, files
+
+
+def _is_gzip(path):
+    try:
+        with open(path, "rb") as f:
+            return f.read(2) == GZIP_MAGIC
+    except OSError:
+        return False
+
+
+def _pair(directory, files):
+    """
+    Pairs read 1 with read 2 of each sample of one folder, mates are always in the same folder
+    """
+    pairs = {}
+    for file_path in sorted(files):
+        name = os.path.basename(file_path)
+        match = MATE.match(name)
+        if match:
+            key = (match["before"], match["read"], match["after"])
+            pairs.setdefault(key, {})[match["mate"]] = file_path
+        else:
+            pairs[(name,)] = {"": file_path}
+
+    # samples are named like bcbio_helper.create_csv names them
+    for mates in pairs.values():
+        read_1 = mates.get("1") or mates.get("")
+        read_2 = mates.get("2")
+        yield {
+            "sample": os.path.basename(read_1 or read_2).split("_")[0],
+            "read_1": read_1,
+            "read_2": read_2,
+            "size": sum(files[p] for p in (read_1, read_2) if p),
+            "problem": None,
+        }
+
+
+def discover_fastqs(path, batch_size=500, batch_seconds=0.5):
+    """
+    Finds the FASTQ files under a folder and pairs read 1 with read 2 of each sample.
+    Rows stream out as folders are walked, rather than after the whole tree was.
+
+        Arguments:
+
+            path          (Path):  the data folder, as given to bcbio_helper
+            batch_size    (int):   rows per batch
+            batch_seconds (float): a smaller batch is yielded when the walk has taken this long since the last one
+
+        Returns:
+
+            batches (generator): lists of rows, each a dict of sample, read_1, read_2, size (bytes, both reads)
+                                 and problem (None, or why bcbio_helper or bcbio would trip on it). A name
+                                 used by two samples is reported on the later one, the earlier was yielded already.
+    """
+    seen = Counter()
+    batch = []
+    last = time.monotonic()
+    for directory, files in _walk_fastqs(path):
+        for row in _pair(directory, files):
+            read_1, read_2 = row["read_1"], row["read_2"]
+            seen[row["sample"]] += 1
+            if read_1 is None:
+                row["problem"] = "read 2 without a read 1"
+            elif not read_1.endswith("1.fq.gz"):
+                row["problem"] = "not named *1.fq.gz, bcbio_helper won't pick it up"
+            elif seen[row["sample"]] > 1:
+                row["problem"] = f"{seen[row['sample']]} samples so far are named {row['sample']}"
+            elif any(files[p] == 0 for p in (read_1, read_2) if p):
+                row["problem"] = "empty file"
+            elif not all(_is_gzip(p) for p in (read_1, read_2) if p):
+                row["problem"] = "not gzip compressed"
+            batch.append(row)
+            if len(batch) == batch_size:
+                yield batch
+                batch, last = [], time.monotonic()
+        if batch and time.monotonic() - last > batch_seconds:
+            yield batch
+            batch, last = [], time.monotonic()
+    if batch:
+        yield batch
+
+
+def check_fasta(path):
+    """
+    Checks that a transcriptome FASTA can be indexed, and summarizes it
+
+        Arguments:
+
+            path (Path): the FASTA
+
+        Returns:
+
+            findings (list): (level, message) pairs
+    """
+    with open(path, "rb") as f:
+        if f.read(1) != b">":
+            return [("ERROR", f"{path} is not a FASTA file, it doesn't start with >")]
+
+    entries, irregular = fasta_tools.build_fai(path)
+    stats = fasta_tools.fasta_stats(entries)
+    findings = [("INFO", f"FASTA has {stats['records']} transcripts, {stats['versioned']} with a version")]
+    if not stats["records"]:
+        findings.append(("ERROR", "FASTA has no sequences"))
+    if stats["duplicates"]:
+        findings.append(("WARNING", f"FASTA has {stats['duplicates']} duplicate transcript ids"))
+    if irregular:
+        findings.append(("WARNING", f"FASTA has {len(irregular)} records with uneven line lengths, samtools faidx will fail"))
+    return findings
+
+
+def check_gtf(path):
+    """
+    Checks that a GTF is well formed and has transcript ids, and what its seqnames look like
+
+        Arguments:
+
+            path (Path): the GTF
+
+        Returns:
+
+            findings (list): (level, message) pairs
+    """
+    report = gtf_tools.validate_gtf(path, workers=1) # runs in a GUI thread pool, which shouldn't fork
+    style = gtf_tools.annotation_style(report["seqnames"])
+    findings = [("INFO", f"GTF has {report['records']} records on {len(report['seqnames'])} seqnames, {style} style")]
+
+    if not report["records"]:
+        findings.append(("ERROR", "GTF has no records"))
+    if report["malformed"]:
+        line_no, text = report["malformed_examples"][0]
+        findings.append(("ERROR", f"GTF has {report['malformed']} malformed lines, e.g. line {line_no}: {text[:80]}"))
+    if report["records"] and not report["attribute_keys"].get("transcript_id"):
+        findings.append(("ERROR", "GTF has no transcript_id attributes"))
+    if style == "mixed":
+        findings.append(("WARNING", "GTF mixes chr-prefixed and plain seqnames, see bcbio_doctor.py --rename_chr"))
+    return findings
+
+
+def check_pair(fasta_path, gtf_path):
+    """
+    Checks that the transcripts of a FASTA and a GTF match
+
+        Arguments:
+
+            fasta_path (Path): the FASTA
+            gtf_path   (Path): the GTF
+
+        Returns:
+
+            findings (list): (level, message) pairs
+    """
+    report = fasta_tools.check_transcript_ids(fasta_path, gtf_path)
+    findings = [("INFO", f"{report['matched']} of {report['fasta_transcripts']} FASTA transcripts are in the GTF")]
+    if report["fasta_transcripts"] and not report["matched"] and not report["version_mismatch"]:
+        findings.append(("ERROR", "no FASTA transcript is in the GTF, they are probably from different sources"))
+    if report["version_mismatch"]:
+        findings.append((
+            "WARNING",
+            f"{report['version_mismatch']} transcripts only match without their versions, "
+            "see bcbio_doctor.py --strip_versions",
+        ))
+    return findings
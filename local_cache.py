@@ -0,0 +1,74 @@
+"""
+local_cache
+
+Small helpers for the per-user cache that bcbio_doctor and bcbio_helper keep between runs.
+The cache lives in $BCBIO_HELPER_CACHE, or ~/.cache/bcbio_helper by default.
+"""
+
+# native
+import json
+import os
+from pathlib import Path
+import tempfile
+
+
+CACHE_ENV = "BCBIO_HELPER_CACHE"
+
+
+def cache_dir():
+    """
+    Gets (and creates) the cache directory
+
+        Arguments:
+
+            None
+
+        Returns:
+
+            cache_path (Path): path to the cache directory
+    """
+    cache_path = Path(
+        os.environ.get(CACHE_ENV) or Path.home() / ".cache" / "bcbio_helper"
+    )
+    os.makedirs(cache_path, exist_ok=True)
+    return cache_path
+
+
+def read_json(path, default=None):
+    """
+    Reads a json file from the cache, ignoring missing or corrupt files
+
+        Arguments:
+
+            path    (Path): the file to read
+            default (any):  what to return if the file can't be read
+
+        Returns:
+
+            data (any): the parsed json, or default
+    """
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default
+
+
+def write_json(path, data):
+    """
+    Writes a json file atomically, so a crashed run never leaves a half-written cache
+
+        Arguments:
+
+            path (Path): the file to write
+            data (any):  json serializable data
+
+        Returns:
+
+            None
+    """
+    os.makedirs(Path(path).parent, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=Path(path).parent, suffix=".tmp")
+    with os.fdopen(fd, "w") as f:
+        json.dump(data, f, indent=1)
+    os.replace(tmp_path, path)
@@ -0,0 +1,421 @@
+"""
+log_view
+
+A console widget for the GUIs that stays fast over multi-day bcbio runs.
+
+Only the last max_lines lines are kept in memory, in a ring buffer, and the list view only
+renders the lines that are visible. Output is decoded incrementally (a multibyte character
+split across two reads is no longer an error) and added to the view in batches on a timer,
+instead of on every readyRead. The full log is written to an indexed run log on disk as it
+arrives (see run_log.py), which the search dock reads from.
+"""
+
+# native
+import codecs
+from collections import deque
+import os
+import time
+
+# pkg
+from PyQt5 import QtCore, QtGui, QtWidgets
+
+# lib
+import local_cache
+import run_log
+
+
+MAX_LINES = 100_000
+FLUSH_MS = 100
+
+
+def default_spill_path(name):
+    """
+    Gets a new file under <cache>/logs for the full log of one window or run
+
+        Arguments:
+
+            name (str): prefix of the file, e.g. helper
+
+        Returns:
+
+            path (Path): <cache>/logs/<name>-<date>-<time>-<pid>.log
+    """
+    logs = local_cache.cache_dir() / "logs"
+    logs.mkdir(parents=True, exist_ok=True)
+    return logs / f"{name}-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}.log"
+
+
+class LogBuffer:
+    """
+    Ring buffer of decoded log lines
+
+        Arguments:
+
+            max_lines (int): lines kept in memory, older lines are dropped (but stay in the run log)
+    """
+
+    def __init__(self, max_lines=MAX_LINES):
+        self.lines = deque(maxlen=max_lines)
+        self.partial = "" # text after the last newline
+        self.dropped = 0 # lines pushed out of the ring so far
+        self.decoders = {} # one incremental decoder per source, so sources don't split each other's characters
+
+    def decode(self, data, source=None):
+        """
+        Decodes bytes, keeping an incomplete multibyte character for the next call of the same source
+        """
+        if source not in self.decoders:
+            self.decoders[source] = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        return self.decoders[source].decode(data)
+
+    def split(self, text):
+        """
+        Works out what adding text would do, without changing the buffer
+
+            Returns:
+
+                complete (list): complete lines to add
+                partial  (str):  the new unfinished line
+                removed  (int):  lines to drop from the front to make room
+        """
+        text = self.partial + text.replace("\r\n", "\n")
+        *complete, partial = text.split("\n")
+        removed = max(0, len(self.lines) + len(complete) - self.lines.maxlen)
+        return complete, partial, removed
+
+    def drop(self, count):
+        """
+        Drops lines from the front
+        """
+        for _ in range(min(count, len(self.lines))):
+            self.lines.popleft()
+        self.dropped += count
+
+    def add(self, complete):
+        """
+        Adds complete lines as split() gave them, the ring drops what doesn't fit
+        """
+        self.dropped += max(0, len(self.lines) + len(complete) - self.lines.maxlen)
+        self.lines.extend(complete)
+
+
+class LogModel(QtCore.QAbstractListModel):
+    """
+    Exposes a LogBuffer, and its unfinished last line, to a list view
+    """
+
+    def __init__(self, buffer, parent=None):
+        super().__init__(parent)
+        self.buffer = buffer
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else len(self.buffer.lines) + 1 # the last row is the partial line
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if role != QtCore.Qt.DisplayRole or not index.isValid():
+            return None
+        lines = self.buffer.lines
+        return lines[index.row()] if index.row() < len(lines) else self.buffer.partial
+
+    def append(self, text):
+        # * each begin* call comes before the buffer changes, as Qt requires
+        rows = len(self.buffer.lines)
+        complete, partial, removed = self.buffer.split(text)
+        if removed > rows: # even some of the new lines would be dropped, start over
+            self.beginResetModel()
+            self.buffer.add(complete)
+            self.buffer.partial = partial
+            self.endResetModel()
+            return
+
+        if removed:
+            self.beginRemoveRows(QtCore.QModelIndex(), 0, removed - 1)
+            self.buffer.drop(removed)
+            self.endRemoveRows()
+        if complete:
+            first = rows - removed # before the partial line row
+            self.beginInsertRows(QtCore.QModelIndex(), first, first + len(complete) - 1)
+            self.buffer.add(complete)
+            self.endInsertRows()
+        self.buffer.partial = partial # the last row, announced by dataChanged below
+        last = self.index(self.rowCount() - 1)
+        self.dataChanged.emit(last, last) # the partial line grew, or moved
+
+
+class LogView(QtWidgets.QListView):
+    """
+    Console output widget, a stand in for the QTextBrowser the GUIs were designed with
+
+        Arguments:
+
+            spill_path (Path): run log that receives the full output, None to keep nothing on disk
+            max_lines  (int):  lines kept in memory
+            parent     (QWidget)
+    """
+
+    flushed = QtCore.pyqtSignal(str) # each batch of text, after it was added
+    log_changed = QtCore.pyqtSignal() # run_log was closed or replaced, line numbers of the old one mean nothing now
+
+    def __init__(self, spill_path=None, max_lines=MAX_LINES, parent=None):
+        super().__init__(parent)
+        self.buffer = LogBuffer(max_lines)
+        self.model_ = LogModel(self.buffer, self)
+        self.setModel(self.model_)
+
+        self.setUniformItemSizes(True) # lets the view lay out only the visible rows
+        self.setFont(QtGui.QFontDatabase.systemFont(QtGui.QFontDatabase.FixedFont))
+        self.setSelectionMode(QtWidgets.QAbstractItemView.ExtendedSelection)
+        self.setEditTriggers(QtWidgets.QAbstractItemView.NoEditTriggers)
+
+        self.pending = []
+        self.run_log = run_log.RunLog(spill_path) if spill_path else None
+        self.log_first_line = 0 # line of the buffer (counting dropped lines) that is line 0 of run_log
+
+        self.timer = QtCore.QTimer(self)
+        self.timer.setInterval(FLUSH_MS)
+        self.timer.timeout.connect(self.flush)
+        self.timer.start()
+
+    def feed_bytes(self, data, source=None):
+        """
+        Queues raw process output, decoding it incrementally per source
+        """
+        self.feed_text(self.buffer.decode(bytes(data), source))
+
+    def feed_text(self, text):
+        """
+        Queues text, it is shown on the next timer tick
+        """
+        if text:
+            self.pending.append(text)
+
+    def insertPlainText(self, text):
+        # * same call as QTextBrowser, so existing messages keep working
+        self.feed_text(text)
+
+    def flush(self):
+        """
+        Adds everything queued since the last tick to the view and to the run log
+        """
+        if not self.pending:
+            return
+        text = "".join(self.pending)
+        self.pending = []
+
+        if self.run_log is not None:
+            self.run_log.append(text)
+            self.run_log.flush()
+
+        scrollbar = self.verticalScrollBar()
+        follow = scrollbar.value() >= scrollbar.maximum() # only follow the output if already at the bottom
+        self.model_.append(text)
+        if follow:
+            self.scrollToBottom()
+        self.flushed.emit(text)
+
+    def keyPressEvent(self, event):
+        if event.matches(QtGui.QKeySequence.Copy):
+            rows = sorted(index.row() for index in self.selectedIndexes())
+            QtWidgets.QApplication.clipboard().setText("\n".join(self.model_.data(self.model_.index(row)) for row in rows))
+        else:
+            super().keyPressEvent(event)
+
+    def start_run_log(self, spill_path):
+        """
+        Sends the output from now on to a new run log, e.g. when a run starts
+        """
+        self.close_spill()
+        self.run_log = run_log.RunLog(spill_path)
+        self.log_first_line = self.buffer.dropped + len(self.buffer.lines)
+        self.log_changed.emit()
+
+    def scroll_to_line(self, number):
+        """
+        Scrolls to a line of the run log, if it is still in memory
+
+            Returns:
+
+                shown (bool): False if the line was dropped from the view, or isn't in this view's log
+        """
+        self.flush()
+        row = self.log_first_line + number - self.buffer.dropped
+        if not 0 <= row < len(self.buffer.lines):
+            return False
+        self.scrollTo(self.model_.index(row), QtWidgets.QAbstractItemView.PositionAtCenter)
+        self.setCurrentIndex(self.model_.index(row))
+        return True
+
+    def close_spill(self):
+        self.flush()
+        if self.run_log is not None:
+            self.run_log.close()
+            self.run_log = None
+            self.log_changed.emit() # before anything reads the closed log again
+
+
+def replace_console(ui, name):
+    """
+    Swaps the QTextBrowser console of a generated Ui_MainWindow for a LogView, in the same place
+
+        Arguments:
+
+            ui   (Ui_MainWindow): after setupUi(), has consoleOutput_textbrowser
+            name (str):           prefix of the run log, see default_spill_path
+
+        Returns:
+
+            view (LogView): also set as ui.consoleOutput_textbrowser
+    """
+    old = ui.consoleOutput_textbrowser
+    view = LogView(default_spill_path(name), parent=old.parentWidget())
+    view.setSizePolicy(old.sizePolicy())
+    view.setMaximumSize(old.maximumSize())
+    view.setObjectName(old.objectName())
+
+    ui.centralwidget.layout().replaceWidget(old, view) # searches nested layouts too
+    old.deleteLater()
+    ui.consoleOutput_textbrowser = view
+    return view
+
+
+class SearchResults(QtCore.QAbstractListModel):
+    """
+    Line numbers of a run log, each shown as "<number>: <line>", read from the log only when visible
+    """
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.log = None
+        self.numbers = []
+
+    def set_numbers(self, log, numbers):
+        self.beginResetModel()
+        self.log, self.numbers = log, numbers
+        self.endResetModel()
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else len(self.numbers)
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if role != QtCore.Qt.DisplayRole or not index.isValid() or self.log is None:
+            return None
+        number = self.numbers[index.row()]
+        return f"{number + 1}: {self.log.line(number)}"
+
+
+class SearchDock(QtWidgets.QDockWidget):
+    """
+    Search, level filter and jump to line over the run log of a LogView
+
+        Arguments:
+
+            view   (LogView)
+            parent (QMainWindow)
+    """
+
+    CONTEXT = 50 # lines shown around a line that was jumped to
+
+    def __init__(self, view, parent=None):
+        super().__init__("Search Log", parent)
+        self.view = view
+        self.setObjectName("searchLog_dock")
+
+        self.query = QtWidgets.QLineEdit()
+        self.query.setPlaceholderText("Words to find, in any order")
+        self.level = QtWidgets.QComboBox()
+        self.level.addItems(["All", "ERROR", "WARNING"])
+        self.line_number = QtWidgets.QSpinBox()
+        self.line_number.setRange(1, 2 ** 31 - 1)
+        self.jump = QtWidgets.QPushButton("Go to Line")
+        self.summary = QtWidgets.QLabel()
+
+        self.results_model = SearchResults(self)
+        self.results = QtWidgets.QListView()
+        self.results.setModel(self.results_model)
+        self.results.setUniformItemSizes(True)
+        self.results.setFont(QtGui.QFontDatabase.systemFont(QtGui.QFontDatabase.FixedFont))
+
+        controls = QtWidgets.QHBoxLayout()
+        controls.addWidget(self.query, 1)
+        controls.addWidget(self.level)
+        controls.addWidget(self.line_number)
+        controls.addWidget(self.jump)
+        layout = QtWidgets.QVBoxLayout()
+        layout.addLayout(controls)
+        layout.addWidget(self.summary)
+        layout.addWidget(self.results)
+        widget = QtWidgets.QWidget()
+        widget.setLayout(layout)
+        self.setWidget(widget)
+
+        # * search as the query is typed, once typing pauses
+        self.debounce = QtCore.QTimer(self)
+        self.debounce.setSingleShot(True)
+        self.debounce.setInterval(250)
+        self.debounce.timeout.connect(self.search)
+        self.query.textChanged.connect(self.debounce.start)
+        self.query.returnPressed.connect(self.search)
+        self.level.currentIndexChanged.connect(self.search)
+        self.jump.clicked.connect(lambda: self.jump_to(self.line_number.value() - 1))
+        self.results.doubleClicked.connect(lambda index: self.jump_to(self.results_model.numbers[index.row()]))
+        view.log_changed.connect(self.on_log_changed)
+
+    def on_log_changed(self):
+        # * the results are line numbers of a closed log, search the new one instead
+        self.results_model.set_numbers(None, [])
+        self.summary.setText("")
+        self.search()
+
+    def search(self):
+        log = self.view.run_log
+        if log is None:
+            return
+        self.view.flush()
+        query = self.query.text().strip()
+        level = None if self.level.currentText() == "All" else self.level.currentText()
+        if not query and not level:
+            self.results_model.set_numbers(log, [])
+            self.summary.setText("")
+            return
+
+        numbers = log.search(query, level)
+        self.results_model.set_numbers(log, numbers)
+        self.summary.setText(f"{len(numbers)} matching lines of {len(log)}" + (" (first shown)" if len(numbers) >= 10_000 else ""))
+
+    def jump_to(self, number):
+        """
+        Shows the lines around a line of the run log, and scrolls the console to it if it is still there
+        """
+        log = self.view.run_log
+        if log is None or not len(log):
+            return
+        self.view.flush()
+        number = min(max(0, number), len(log) - 1)
+        self.results_model.set_numbers(log, list(range(max(0, number - self.CONTEXT), min(len(log), number + self.CONTEXT + 1))))
+        row = self.results_model.numbers.index(number)
+        self.results.scrollTo(self.results_model.index(row), QtWidgets.QAbstractItemView.PositionAtCenter)
+        self.results.setCurrentIndex(self.results_model.index(row))
+        shown = self.view.scroll_to_line(number)
+        self.summary.setText(f"Line {number + 1} of {len(log)}" + ("" if shown else ", no longer in the console"))
+
+
+def add_search_dock(window, view):
+    """
+    Adds a SearchDock for a LogView to the bottom of a main window, shown with Ctrl+F
+
+        Arguments:
+
+            window (QMainWindow)
+            view   (LogView)
+
+        Returns:
+
+            dock (SearchDock)
+    """
+    dock = SearchDock(view, window)
+    window.addDockWidget(QtCore.Qt.BottomDockWidgetArea, dock)
+    dock.hide()
+
+    shortcut = QtWidgets.QShortcut(QtGui.QKeySequence.Find, window)
+    shortcut.activated.connect(lambda: (dock.show(), dock.query.setFocus(), dock.query.selectAll()))
+    return dock
@@ -0,0 +1,473 @@
+"""
+process_control
+
+Throttles a running bcbio process tree without killing it: pause and resume (SIGSTOP/SIGCONT),
+niceness, I/O priority (ionice) and CPU affinity. Also stops a tree for good, see shutdown_tree.
+
+Children inherit niceness, ionice and affinity from their parent, but a child that was being
+started while the tree was changed can slip through, and a paused tree must not leave new
+children running. A TreeControl therefore remembers the settings and applies them again, with
+enforce(), to any process that has joined the tree since.
+"""
+
+# native
+import json
+import os
+from pathlib import Path
+import shutil
+import time
+
+# pkg
+import psutil
+
+
+IONICE_CLASSES = {
+    "idle": psutil.IOPRIO_CLASS_IDLE if hasattr(psutil, "IOPRIO_CLASS_IDLE") else None,
+    "best-effort": psutil.IOPRIO_CLASS_BE if hasattr(psutil, "IOPRIO_CLASS_BE") else None,
+    "realtime": psutil.IOPRIO_CLASS_RT if hasattr(psutil, "IOPRIO_CLASS_RT") else None,
+}
+
+CPU_SAMPLE = 0.5 # seconds over which the cores a tree uses are measured
+KILL_ROUNDS = 3 # rounds of SIGKILL for processes that keep appearing
+KILL_WAIT = 5 # seconds to wait after each SIGKILL
+TX_DIRS = ("tx", "bcbiotx") # bcbio's transaction directories, partial outputs only
+MAX_TX_DEPTH = 4 # how deep under work/ to look for them
+LOG_DIRS = ("log",) # work/log/ holds bcbio-nextgen.log, -debug.log and -commands.log, kept to debug the run
+LOG_SUFFIXES = (".log", ".err", ".out")
+
+
+def parse_cpus(text):
+    """
+    Parses a CPU list like 0-3,8,10-11
+
+        Arguments:
+
+            text (str): comma separated CPUs and ranges
+
+        Returns:
+
+            cpus (list): sorted CPU numbers
+    """
+    cpus = set()
+    for part in text.split(","):
+        part = part.strip()
+        if "-" in part:
+            first, last = part.split("-")
+            cpus.update(range(int(first), int(last) + 1))
+        elif part:
+            cpus.add(int(part))
+    return sorted(cpus)
+
+
+def parse_ionice(text):
+    """
+    Parses an ionice setting: idle, best-effort[:<0-7>] or realtime[:<0-7>] (be and rt work too)
+
+        Returns:
+
+            ionice (tuple): (class name, level or None)
+    """
+    name, _, level = text.partition(":")
+    name = {"be": "best-effort", "rt": "realtime"}.get(name, name)
+    if name not in IONICE_CLASSES:
+        raise ValueError(f"unknown ionice class {name}, use idle, best-effort or realtime")
+    return name, int(level) if level else None
+
+
+class TreeControl:
+    """
+    Settings for a process and all of its children, present and future
+
+        Arguments:
+
+            pid (int): the root of the tree, e.g. the bcbio_helper.py process
+    """
+
+    def __init__(self, pid):
+        self.root = psutil.Process(pid)
+        self.paused = False
+        self.nice = None
+        self.ionice = None # (class name, level)
+        self.affinity = None # list of CPUs
+        self.applied = set() # pids that have the current settings
+
+    def tree(self):
+        try:
+            return [self.root] + self.root.children(recursive=True)
+        except psutil.NoSuchProcess:
+            return []
+
+    def alive(self):
+        try:
+            return self.root.is_running() and self.root.status() != psutil.STATUS_ZOMBIE
+        except psutil.NoSuchProcess:
+            return False
+
+    def _apply(self, process):
+        """
+        Applies every setting to one process, returns the problems, e.g. AccessDenied for a lower niceness
+        """
+        problems = []
+        steps = [
+            ("nice", self.nice is not None, lambda: process.nice(self.nice)),
+            ("ionice", self.ionice is not None and hasattr(process, "ionice"),
+             lambda: process.ionice(IONICE_CLASSES[self.ionice[0]], self.ionice[1])),
+            ("affinity", self.affinity is not None and hasattr(process, "cpu_affinity"),
+             lambda: process.cpu_affinity(self.affinity)),
+            ("pause", self.paused, process.suspend),
+        ]
+        for name, wanted, apply in steps:
+            if not wanted:
+                continue
+            try:
+                apply()
+            except psutil.NoSuchProcess:
+                return problems
+            except (psutil.AccessDenied, ValueError, OSError) as e:
+                problems.append(f"{name} of {process.pid}: {type(e).__name__} {e}".strip())
+        return problems
+
+    def enforce(self, everyone=False):
+        """
+        Applies the settings to the processes that joined the tree since the last call
+
+            Arguments:
+
+                everyone (bool): apply to every process, after the settings changed
+
+            Returns:
+
+                result (dict): processes (in the tree), applied (processes changed now) and problems
+        """
+        if everyone:
+            self.applied = set()
+        tree = self.tree()
+        if self.paused:
+            tree.sort(key=lambda p: p.pid != self.root.pid) # stop the root first, so it starts nothing new
+        problems = []
+        applied = 0
+        for process in tree:
+            if process.pid in self.applied:
+                continue
+            problems += self._apply(process)
+            self.applied.add(process.pid)
+            applied += 1
+        self.applied &= {p.pid for p in tree} # pids are reused, forget the ones that exited
+        return {"processes": len(tree), "applied": applied, "problems": problems}
+
+    def pause(self):
+        self.paused = True
+        return self.enforce(everyone=True)
+
+    def resume(self):
+        """
+        Continues every process of the tree, children first so none is left waiting on a stopped parent
+        """
+        self.paused = False
+        problems = []
+        for process in reversed(self.tree()):
+            try:
+                process.resume()
+            except psutil.NoSuchProcess:
+                continue
+            except psutil.AccessDenied as e:
+                problems.append(f"resume of {process.pid}: AccessDenied {e}".strip())
+        return {"processes": len(self.tree()), "applied": 0, "problems": problems}
+
+    def set(self, nice=None, ionice=None, affinity=None):
+        """
+        Changes some settings and applies them to the whole tree
+
+            Arguments:
+
+                nice     (int):   niceness, -20 (highest priority) to 19
+                ionice   (tuple): as returned by parse_ionice
+                affinity (list):  CPUs the tree may run on
+        """
+        if nice is not None:
+            self.nice = nice
+        if ionice is not None:
+            self.ionice = ionice
+        if affinity is not None:
+            self.affinity = affinity
+        return self.enforce(everyone=True)
+
+    def watch(self, interval=2.0, on_applied=None):
+        """
+        Keeps applying the settings to new processes until the root exits
+
+            Arguments:
+
+                interval   (float):    seconds between scans
+                on_applied (function): called with each enforce() result that changed a process
+        """
+        while self.alive():
+            result = self.enforce()
+            if result["applied"] and on_applied:
+                on_applied(result)
+            time.sleep(interval)
+
+
+def terminate_tree(pid):
+    """
+    Terminates a process and its children, continuing them too, since a stopped process
+    doesn't act on SIGTERM until it runs again
+
+        Arguments:
+
+            pid (int): the root of the tree
+
+        Returns:
+
+            processes (list): the psutil.Process objects that were signalled
+    """
+    try:
+        root = psutil.Process(pid)
+        tree = [root] + root.children(recursive=True)
+    except psutil.NoSuchProcess:
+        return []
+    for process in tree:
+        try:
+            process.terminate()
+            process.resume()
+        except psutil.NoSuchProcess:
+            continue
+    return tree
+
+
+def _rescan(processes):
+    """
+    Adds the children of every known process that is still alive, including children whose
+    parent already exited, which init adopted and a scan from the root would miss
+    """
+    known = {p.pid: p for p in processes}
+    added = True
+    while added:
+        added = False
+        for process in list(known.values()):
+            try:
+                children = process.children(recursive=True)
+            except psutil.NoSuchProcess:
+                continue
+            for child in children:
+                if child.pid not in known:
+                    known[child.pid] = child
+                    added = True
+    return list(known.values())
+
+
+def _signal_all(processes, signal_name):
+    for process in processes:
+        try:
+            getattr(process, signal_name)()
+        except psutil.NoSuchProcess:
+            continue
+        except psutil.AccessDenied:
+            continue
+
+
+def run_work_dir(outpath, run_name):
+    """
+    Gets the work/ directory bcbio_helper runs bcbio in, <outpath>/<run>/work, see start_bcbio
+
+        Arguments:
+
+            outpath  (Path): the run's output directory
+            run_name (str):  name of the run, with or without .csv
+
+        Returns:
+
+            work_dir (Path): absolute, it may not exist yet
+    """
+    return Path(outpath).resolve() / str(run_name).split(".")[0] / "work"
+
+
+def is_run_work_dir(work_dir):
+    """
+    Whether a directory is the work/ directory of a bcbio run, from what bcbio leaves next to and in it:
+    its config/<run>.yaml, or work/log/bcbio-nextgen.log. Any other folder named work is left alone.
+    """
+    work_dir = Path(work_dir)
+    return work_dir.name == "work" and (
+        (work_dir / "log" / "bcbio-nextgen.log").is_file()
+        or (work_dir.parent / "config" / f"{work_dir.parent.name}.yaml").is_file()
+    )
+
+
+def _work_dirs(processes):
+    """
+    Finds the bcbio work/ directories the processes run in, from their working directories.
+    Only directories that are a bcbio run's work/, see is_run_work_dir.
+    """
+    work_dirs = set()
+    for process in processes:
+        try:
+            cwd = Path(process.cwd())
+        except (psutil.NoSuchProcess, psutil.AccessDenied, OSError):
+            continue
+        for path in [cwd] + list(cwd.parents):
+            if is_run_work_dir(path):
+                work_dirs.add(path)
+                break
+    return sorted(work_dirs)
+
+
+def _written_files(processes):
+    files = set()
+    for process in processes:
+        try:
+            files.update(f.path for f in process.open_files() if getattr(f, "mode", "r") != "r")
+        except (psutil.NoSuchProcess, psutil.AccessDenied, OSError):
+            continue
+    return files
+
+
+def _is_step_output(path, work_dir):
+    """
+    Whether a file under work/ is the output of a pipeline step, rather than a log
+    """
+    relative = Path(path).relative_to(work_dir)
+    if any(part in LOG_DIRS for part in relative.parts[:-1]):
+        return False
+    return not relative.name.endswith(LOG_SUFFIXES)
+
+
+def reclaim_outputs(work_dirs, written_files):
+    """
+    Cleans up after an interrupted bcbio run, so that resuming it redoes the interrupted steps
+
+    bcbio writes through transaction directories (tx/, bcbiotx/) and moves outputs in place when
+    a step succeeds, so those directories only hold partial outputs and are removed. Step outputs
+    that were open for writing elsewhere in work/ are renamed to <name>.partial, because bcbio takes
+    any non-empty output as done when it resumes. Logs (work/log/, *.log) are left alone, they are
+    what the interrupted run is debugged with. Both are listed in work/bcbio_helper_partial.json.
+    Directories that aren't a bcbio run's work/ (see is_run_work_dir) are never touched.
+
+        Arguments:
+
+            work_dirs     (list): bcbio work/ directories
+            written_files (set):  files the killed processes had open for writing
+
+        Returns:
+
+            reclaimed (dict): tx_removed (directories) and partial (renamed files)
+    """
+    reclaimed = {"tx_removed": [], "partial": []}
+    for work_dir in work_dirs:
+        if not is_run_work_dir(work_dir):
+            continue
+        for root, dirs, _ in os.walk(work_dir):
+            depth = len(Path(root).relative_to(work_dir).parts)
+            for name in list(dirs):
+                if name in TX_DIRS:
+                    shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+                    reclaimed["tx_removed"].append(os.path.join(root, name))
+                    dirs.remove(name)
+            if depth >= MAX_TX_DEPTH:
+                dirs[:] = []
+
+        for path in sorted(written_files):
+            if Path(work_dir) in Path(path).parents and _is_step_output(path, work_dir) and os.path.exists(path):
+                os.replace(path, path + ".partial")
+                reclaimed["partial"].append(path)
+
+        if reclaimed["tx_removed"] or reclaimed["partial"]:
+            with open(Path(work_dir) / "bcbio_helper_partial.json", "w") as f:
+                json.dump(dict(reclaimed, stopped=time.time()), f, indent=1)
+    return reclaimed
+
+
+def shutdown_tree(pid, timeout=10.0, cleanup=True, on_progress=None, work_dir=None):
+    """
+    Stops a process tree for good, escalating from SIGTERM to SIGKILL
+
+    The tree is frozen first (SIGSTOP), so it can't start anything new while it is scanned,
+    then every process gets SIGTERM and SIGCONT and has timeout seconds to exit. Whatever
+    is left, including children started or orphaned in the meantime, gets SIGKILL.
+
+        Arguments:
+
+            pid         (int):      the root of the tree
+            timeout     (float):    seconds to wait after SIGTERM
+            cleanup     (bool):     reclaim partial outputs in the run's work/ directory, see reclaim_outputs.
+                                    Skipped if any process survived, it could still be writing them.
+            on_progress (function): called with a message at each step
+            work_dir    (Path):     the run's work/ directory, see run_work_dir. Found from the
+                                    working directories of the processes when None
+
+        Returns:
+
+            report (dict): processes, terminated (exited after SIGTERM), killed, survivors (pids),
+                           cores_freed and memory_freed_gb (used by the tree before the shutdown),
+                           work_dirs, tx_removed, partial, reclaim_skipped (survivors kept the outputs
+                           from being reclaimed) and seconds
+    """
+    started = time.time()
+    progress = on_progress or (lambda message: None)
+    try:
+        root = psutil.Process(pid)
+    except psutil.NoSuchProcess:
+        return {"processes": 0, "terminated": 0, "killed": 0, "survivors": [], "cores_freed": 0.0,
+                "memory_freed_gb": 0.0, "work_dirs": [], "tx_removed": [], "partial": [],
+                "reclaim_skipped": False, "seconds": 0.0}
+
+    # * snapshot, usage is measured before freezing since a stopped process uses no cpu
+    processes = _rescan([root])
+    _signal_all(processes, "cpu_percent")
+    time.sleep(CPU_SAMPLE)
+    cpu, rss = 0.0, 0
+    for process in processes:
+        try:
+            cpu += process.cpu_percent(None)
+            rss += process.memory_info().rss
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            continue
+
+    # * freeze, root first, then scan again for anything started in the meantime
+    _signal_all(processes, "suspend")
+    processes = _rescan(processes)
+    _signal_all(processes, "suspend")
+    progress(f"Stopping {len(processes)} processes")
+    if not cleanup:
+        work_dirs = []
+    elif work_dir is not None:
+        work_dirs = [Path(work_dir)] if is_run_work_dir(work_dir) else [] # bcbio may not have started yet
+    else:
+        work_dirs = _work_dirs(processes)
+    written = _written_files(processes) if cleanup else set()
+
+    # * terminate, then escalate
+    _signal_all(processes, "terminate")
+    _signal_all(processes, "resume")
+    gone, alive = psutil.wait_procs(processes, timeout=timeout)
+    terminated = len(gone)
+
+    killed = 0
+    for _ in range(KILL_ROUNDS):
+        alive = [p for p in _rescan(alive) if p.is_running()]
+        if not alive:
+            break
+        progress(f"Killing {len(alive)} processes that outlived SIGTERM")
+        _signal_all(alive, "kill")
+        gone, alive = psutil.wait_procs(alive, timeout=KILL_WAIT)
+        killed += len(gone)
+    survivors = [p.pid for p in alive]
+
+    reclaim_skipped = bool(cleanup and survivors and work_dirs)
+    if cleanup and not survivors:
+        reclaimed = reclaim_outputs(work_dirs, written)
+    else: # a survivor may still write into tx/ or the files, leave them for the next attempt
+        reclaimed = {"tx_removed": [], "partial": []}
+    return {
+        "processes": len(processes),
+        "terminated": terminated,
+        "killed": killed,
+        "survivors": survivors,
+        "cores_freed": cpu / 100,
+        "memory_freed_gb": rss / 1024 ** 3,
+        "work_dirs": [str(path) for path in work_dirs],
+        "tx_removed": reclaimed["tx_removed"],
+        "partial": reclaimed["partial"],
+        "reclaim_skipped": reclaim_skipped,
+        "seconds": time.time() - started,
+    }
@@ -0,0 +1,189 @@
+"""
+profiling
+
+Per-stage profiles of a bcbio_helper or bcbio_doctor run, for --profile. Each stage runs under
+cProfile and leaves its own artifacts, so a slow run on someone else's data can be looked at
+afterwards, without a guess:
+
+    <cache>/profiles/<name>-<date>-<time>-<pid>/
+        01-create_csv.prof      the raw profile, for pstats, snakeviz or gprof2dot
+        01-create_csv.txt       its hottest functions
+        summary.txt             seconds per stage, and the hottest functions of the whole run
+
+A stage opened inside another one is part of the outer profile. Only one stage is profiled at a
+time: from Python 3.12, cProfile is built on sys.monitoring and a process can have only one active
+profiler, so callers run their stages one after the other when profiling (the doctor runs its checks
+with one worker). A stage that starts while another thread's stage is profiled runs unprofiled.
+"""
+
+# native
+from contextlib import contextmanager
+import cProfile
+import functools
+import io
+import itertools
+import os
+import pstats
+import threading
+import time
+
+# lib
+import local_cache
+
+
+TOP = 15 # functions in each summary
+
+
+class Profiler:
+    """
+    Where the stages of one run are written
+
+        Arguments:
+
+            directory (Path): created if it doesn't exist
+            top       (int):  functions in each summary
+    """
+
+    def __init__(self, directory, top=TOP):
+        self.directory = directory
+        self.top = top
+        self.numbers = itertools.count(1)
+        self.stages = [] # (name, seconds, .prof path)
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        os.makedirs(directory, exist_ok=True)
+
+    def top_functions(self, stats, orders=("tottime", "cumulative")):
+        out = io.StringIO()
+        stats.stream = out
+        stats.files = [] # pstats would list every .prof it read
+        for order in orders:
+            stats.sort_stats(order).print_stats(self.top)
+        return out.getvalue()
+
+    def record(self, name, profile, seconds):
+        with self.lock:
+            prefix = f"{next(self.numbers):02d}-{name.replace(os.sep, '_')}"
+        path = self.directory / f"{prefix}.prof"
+        profile.dump_stats(path)
+        with open(self.directory / f"{prefix}.txt", "w") as f:
+            f.write(f"{name}: {seconds:.2f}s\n")
+            f.write(self.top_functions(pstats.Stats(str(path))))
+        with self.lock:
+            self.stages.append((name, seconds, path))
+
+    def summary(self):
+        with self.lock:
+            stages = list(self.stages)
+        lines = [f"{'stage':<32}{'seconds':>10}"]
+        lines += [f"{name:<32}{seconds:>10.2f}" for name, seconds, _ in stages]
+        text = "\n".join(lines) + "\n\n"
+        if stages:
+            text += "Hottest functions of all stages, see each stage's .txt for more:\n"
+            text += self.top_functions(pstats.Stats(*(str(path) for _, _, path in stages)), orders=("tottime",))
+        with open(self.directory / "summary.txt", "w") as f:
+            f.write(text)
+        return text
+
+
+_profiler = None
+
+
+def default_directory(name):
+    """
+    Gets a new folder under <cache>/profiles for the profiles of one run
+
+        Arguments:
+
+            name (str): prefix of the folder, e.g. helper
+
+        Returns:
+
+            path (Path): <cache>/profiles/<name>-<date>-<time>-<pid>
+    """
+    return local_cache.cache_dir() / "profiles" / f"{name}-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}"
+
+
+def start(directory, top=TOP):
+    """
+    Turns profiling on for this process
+
+        Arguments:
+
+            directory (Path): where the profiles are written, see default_directory()
+            top       (int):  functions in each summary
+
+        Returns:
+
+            None
+    """
+    global _profiler
+    _profiler = Profiler(directory, top)
+
+
+def finish(verbose=True):
+    """
+    Writes and prints the summary of the run, and turns profiling off
+
+        Arguments:
+
+            verbose (bool): prints the summary, as well as writing it
+
+        Returns:
+
+            directory (Path): where the profiles are, None if profiling was off
+    """
+    global _profiler
+    if _profiler is None:
+        return None
+    profiler, _profiler = _profiler, None
+    summary = profiler.summary()
+    if verbose:
+        print(summary)
+        print(f"Profiles of each stage written to {profiler.directory}\n")
+    return profiler.directory
+
+
+@contextmanager
+def stage(name):
+    """
+    Profiles the code in a with block as one stage, does nothing when profiling is off
+
+        Arguments:
+
+            name (str): the stage, e.g. create_csv
+
+        Returns:
+
+            None
+    """
+    profiler = _profiler
+    if profiler is None or getattr(profiler.local, "active", False):
+        yield
+        return
+
+    profile = cProfile.Profile()
+    try:
+        profile.enable()
+    except ValueError: # another thread's stage holds the process' profiler, Python 3.12+
+        yield
+        return
+    profiler.local.active = True
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.disable()
+        profiler.local.active = False
+        profiler.record(name, profile, time.perf_counter() - start_time)
+
+
+def profiled(name, function):
+    """
+    Wraps a function so each call is profiled as a stage, e.g. a doctor check run on a thread pool
+    """
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        with stage(name):
+            return function(*args, **kwargs)
+    return wrapper
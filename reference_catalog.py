@@ -0,0 +1,256 @@
+"""
+reference_catalog
+
+A versioned catalog of the reference files bcbio_doctor can download, indexed by
+species, build, release and file type.
+
+The list of upstream Ensembl releases is cached in <cache>/catalog.json (see local_cache.py),
+so lookups never touch the network. The snapshot is only refreshed when asked to
+(`bcbio_doctor.py --catalog --refresh_catalog`) or when there is no snapshot yet, and the
+catalog falls back to the releases it ships with when it is offline.
+
+File types:
+
+    cdna     Ensembl cDNA FASTA
+    gtf      Ensembl GTF, seqnames without chr (X)
+    gtf_chr  UCSC ncbiRefSeq GTF, seqnames with chr (chrX), this is not versioned by release
+"""
+
+# native
+import re
+import time
+
+# pkg
+import requests
+
+# lib
+import local_cache
+import reference_store
+
+
+ENSEMBL_BASE = "http://ftp.ensembl.org/pub/"
+UCSC_BASE = "https://hgdownload.cse.ucsc.edu/goldenpath/"
+
+DEFAULT_BUILD = "hg38"
+DEFAULT_RELEASE = "96" # the release used in `bcbio_debugging.md`
+BUILTIN_RELEASES = [96]
+
+BUILDS = { # build name -> species, assembly, ucsc name, and the ensembl releases that carry it
+    "hg38": {"species": "homo_sapiens", "assembly": "GRCh38", "ucsc": "hg38", "releases": (76, None)},
+    "mm10": {"species": "mus_musculus", "assembly": "GRCm38", "ucsc": "mm10", "releases": (68, 102)},
+    "mm39": {"species": "mus_musculus", "assembly": "GRCm39", "ucsc": "mm39", "releases": (103, None)},
+}
+BUILD_ALIASES = {"GRCh38": "hg38", "GRCm38": "mm10", "GRCm39": "mm39"}
+
+FILE_TYPES = ("cdna", "gtf", "gtf_chr")
+
+
+def _ensembl_entry(build, release, file_type):
+    info = BUILDS[build]
+    species, assembly = info["species"], info["assembly"]
+    prefix = species.capitalize()
+
+    if file_type == "cdna":
+        name = f"{prefix}.{assembly}.cdna.all.fa.gz"
+        url = f"{ENSEMBL_BASE}release-{release}/fasta/{species}/cdna/{name}"
+    else:
+        name = f"{prefix}.{assembly}.{release}.gtf.gz"
+        url = f"{ENSEMBL_BASE}release-{release}/gtf/{species}/{name}"
+
+    return {
+        "species": species,
+        "build": build,
+        "release": str(release),
+        "file_type": file_type,
+        "url": url,
+        "name": name,
+    }
+
+
+def _ucsc_entry(build):
+    info = BUILDS[build]
+    name = f"{info['ucsc']}.ncbiRefSeq.gtf.gz"
+    return {
+        "species": info["species"],
+        "build": build,
+        "release": "ucsc",
+        "file_type": "gtf_chr",
+        "url": f"{UCSC_BASE}{info['ucsc']}/bigZips/genes/{name}",
+        "name": name,
+    }
+
+
+def fetch_ensembl_releases(timeout=10):
+    """
+    Lists the releases available on the Ensembl ftp site
+
+        Arguments:
+
+            timeout (int): seconds to wait for the listing
+
+        Returns:
+
+            releases (list): sorted release numbers
+    """
+    r = requests.get(ENSEMBL_BASE, timeout=timeout)
+    r.raise_for_status()
+    return sorted({int(x) for x in re.findall(r"release-(\d+)/", r.text)})
+
+
+class Catalog:
+    """
+    Indexed lookup over every known reference file
+
+        Arguments:
+
+            releases (list): the ensembl releases to catalog
+            fetched  (float): when the release list was fetched, None for the builtin list
+    """
+
+    def __init__(self, releases, fetched=None):
+        self.releases = sorted(set(releases))
+        self.fetched = fetched
+        self.index = {} # (build, release, file_type) -> entry
+        self.latest = {} # (build, file_type) -> release
+
+        for build, info in BUILDS.items():
+            first, last = info["releases"]
+            for release in self.releases:
+                if release < first or (last is not None and release > last):
+                    continue
+                for file_type in ("cdna", "gtf"):
+                    self._add(_ensembl_entry(build, release, file_type))
+            self._add(_ucsc_entry(build))
+
+    def _add(self, entry):
+        self.index[(entry["build"], entry["release"], entry["file_type"])] = entry
+        if entry["release"].isdigit(): # the ucsc gtf has no release, so it is never "latest"
+            latest_key = (entry["build"], entry["file_type"])
+            latest = self.latest.get(latest_key)
+            if latest is None or int(entry["release"]) > int(latest):
+                self.latest[latest_key] = entry["release"]
+
+    def resolve(self, build, file_type, release=DEFAULT_RELEASE):
+        """
+        Finds the catalog entry for a reference file
+
+            Arguments:
+
+                build     (str): genome build, e.g. hg38 or GRCh38
+                file_type (str): one of FILE_TYPES
+                release   (str): ensembl release number, or "latest"
+
+            Returns:
+
+                entry (dict): species, build, release, file_type, url and name of the file
+        """
+        build = BUILD_ALIASES.get(build, build)
+        if build not in BUILDS:
+            raise KeyError(f"Unknown genome build {build}, known builds are: {', '.join(BUILDS)}")
+        if file_type not in FILE_TYPES:
+            raise KeyError(f"Unknown file type {file_type}, known types are: {', '.join(FILE_TYPES)}")
+
+        if file_type == "gtf_chr":
+            release = "ucsc"
+        elif str(release) == "latest":
+            release = self.latest.get((build, file_type))
+
+        entry = self.index.get((build, str(release), file_type))
+        if entry is None:
+            raise KeyError(
+                f"{file_type} for {build} release {release} is not in the catalog, "
+                "try `bcbio_doctor.py --catalog --refresh_catalog`"
+            )
+        return entry
+
+    def entries(self, build=None, file_type=None):
+        """
+        Lists catalog entries, optionally filtered
+
+            Arguments:
+
+                build     (str): only list this build
+                file_type (str): only list this file type
+
+            Returns:
+
+                entries (list): the matching entries, oldest release first
+        """
+        build = BUILD_ALIASES.get(build, build)
+        return [
+            entry
+            for key, entry in sorted(
+                self.index.items(),
+                key=lambda item: (item[0][0], item[0][2], item[0][1].zfill(4)),
+            )
+            if (build is None or key[0] == build) and (file_type is None or key[2] == file_type)
+        ]
+
+
+def catalog_path():
+    return local_cache.cache_dir() / "catalog.json"
+
+
+def load_catalog(refresh=False, offline=False):
+    """
+    Loads the catalog from the cached snapshot, refreshing it from upstream only when needed
+
+        Arguments:
+
+            refresh (bool): fetch a fresh release listing even if a snapshot exists
+            offline (bool): never touch the network
+
+        Returns:
+
+            catalog (Catalog): the loaded catalog
+    """
+    snapshot = local_cache.read_json(catalog_path())
+
+    if not offline and (refresh or snapshot is None):
+        try:
+            snapshot = {"fetched": time.time(), "ensembl_releases": fetch_ensembl_releases()}
+            local_cache.write_json(catalog_path(), snapshot)
+        except requests.RequestException as e:
+            print(f"Could not refresh the reference catalog ({e}), using the cached snapshot")
+
+    if not snapshot:
+        return Catalog(BUILTIN_RELEASES)
+
+    return Catalog(
+        set(snapshot["ensembl_releases"]) | set(BUILTIN_RELEASES), snapshot.get("fetched")
+    )
+
+
+def resolve_path(path, store_path=None):
+    """
+    Resolves `catalog:<build>:<file_type>[:<release>]` to a file in the reference store.
+    Any other path is returned unchanged.
+
+        Arguments:
+
+            path       (str):  a path, or a catalog spec
+            store_path (Path): the shared reference store
+
+        Returns:
+
+            path (str): a path to the file
+    """
+    if not str(path).startswith("catalog:"):
+        return path
+
+    if store_path is None: # nothing to look the file up in, downloading it wouldn't help
+        raise ValueError(
+            f"{path} needs a reference store, set ${reference_store.STORE_ENV} to the store "
+            "that `bcbio_doctor.py -d --store=<path>` downloads into"
+        )
+
+    build, file_type, *release = str(path).split(":")[1:]
+    entry = load_catalog(offline=True).resolve(build, file_type, *release)
+    object_path = reference_store.lookup(store_path, entry["url"])
+
+    if object_path is None:
+        raise ValueError(
+            f"{entry['name']} is not in the reference store, download it first with "
+            f"`bcbio_doctor.py -d --{file_type} --build={build} --release={entry['release']} <output_path>`"
+        )
+    return str(object_path)
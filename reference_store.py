@@ -0,0 +1,265 @@
+"""
+reference_store
+
+A shared, content-addressed store for downloaded reference files, so that every user on a
+machine does not download (and keep) their own copy of the same Ensembl/UCSC files.
+
+Layout of a store:
+
+    <store>/objects/<sha256[:2]>/<sha256>   the file contents, read-only
+    <store>/index.json                      maps url -> {"sha256", "name", "size"}
+    <store>/locks/<key>.lock                per-url locks, held while downloading
+    <store>/tmp/                            partial downloads, published with os.replace
+
+The store is used by setting `BCBIO_REFERENCE_STORE` (or passing `--store` to bcbio_doctor.py).
+An alternate mirror base url can be set with `BCBIO_REFERENCE_MIRROR` (or `--mirror`).
+"""
+
+# native
+from contextlib import contextmanager
+import fcntl
+import hashlib
+import json
+import os
+from pathlib import Path
+import tempfile
+from urllib.parse import urlsplit
+
+
+STORE_ENV = "BCBIO_REFERENCE_STORE"
+MIRROR_ENV = "BCBIO_REFERENCE_MIRROR"
+
+
+def default_store_path():
+    """
+    Gets the store location from the environment
+
+        Arguments:
+
+            None
+
+        Returns:
+
+            store_path (Path): path to the store, or None if no store is configured
+    """
+    store = os.environ.get(STORE_ENV)
+    return Path(store) if store else None
+
+
+def default_mirror():
+    """
+    Gets the mirror base url from the environment
+
+        Arguments:
+
+            None
+
+        Returns:
+
+            mirror (str): the mirror base url, or None if no mirror is configured
+    """
+    return os.environ.get(MIRROR_ENV) or None
+
+
+def mirror_url(url, mirror):
+    """
+    Rewrites an upstream url to point at a mirror, keeping the path
+
+        Arguments:
+
+            url    (str): the upstream url
+            mirror (str): base url of the mirror, e.g. http://mirror.local/refs
+
+        Returns:
+
+            url (str): the url to fetch from
+    """
+    if not mirror:
+        return url
+    return mirror.rstrip("/") + urlsplit(url).path # the mirror is expected to keep the upstream layout
+
+
+def _url_key(url):
+    return hashlib.sha1(url.encode()).hexdigest()
+
+
+def _init_store(store_path):
+    for sub in ("objects", "locks", "tmp"): # group-writable so every user can publish
+        os.makedirs(store_path / sub, mode=0o2775, exist_ok=True)
+
+
+@contextmanager
+def store_lock(store_path, key="index"):
+    """
+    Holds an exclusive lock on part of the store
+
+        Arguments:
+
+            store_path (Path): path to the store
+            key        (str):  what to lock, the index or a single url key
+
+        Returns:
+
+            lock (None): the lock is released when the context exits
+    """
+    _init_store(store_path)
+    with open(store_path / "locks" / (key + ".lock"), "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX) # blocks until any other user is done
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _read_index(store_path):
+    try:
+        with open(store_path / "index.json", "r") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def _write_index(store_path, index):
+    fd, tmp_path = tempfile.mkstemp(dir=store_path / "tmp", suffix=".json")
+    with os.fdopen(fd, "w") as f:
+        json.dump(index, f, indent=1, sort_keys=True)
+    os.chmod(tmp_path, 0o664)
+    os.replace(tmp_path, store_path / "index.json") # readers never see a half-written index
+
+
+def _object_path(store_path, sha256):
+    return store_path / "objects" / sha256[:2] / sha256
+
+
+def sha256sum(path, block_size=1 << 20):
+    """
+    Computes the sha256 checksum of a file
+
+        Arguments:
+
+            path       (Path): the file to checksum
+            block_size (int):  how many bytes to read at a time
+
+        Returns:
+
+            sha256 (str): the hex digest
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def lookup(store_path, url, sha256=None):
+    """
+    Finds a url in the store, without touching the network
+
+        Arguments:
+
+            store_path (Path): path to the store
+            url        (str):  the upstream url of the file
+            sha256     (str):  optional checksum the stored file must match
+
+        Returns:
+
+            object_path (Path): path to the stored file, or None if it is not in the store
+    """
+    entry = _read_index(store_path).get(url)
+    if not entry or (sha256 and entry["sha256"] != sha256):
+        return None
+    object_path = _object_path(store_path, entry["sha256"])
+    return object_path if object_path.is_file() else None
+
+
+def publish(store_path, url, file_path, name, sha256=None):
+    """
+    Moves a downloaded file into the store and records it in the index
+
+        Arguments:
+
+            store_path (Path): path to the store
+            url        (str):  the upstream url of the file
+            file_path  (Path): the downloaded file, must be on the same filesystem as the store
+            name       (str):  the file name to record
+            sha256     (str):  optional checksum the file must match
+
+        Returns:
+
+            object_path (Path): path to the stored file
+    """
+    digest = sha256sum(file_path)
+    if sha256 and digest != sha256:
+        os.remove(file_path)
+        raise ValueError(f"Checksum mismatch for {url}: expected {sha256}, got {digest}")
+
+    object_path = _object_path(store_path, digest)
+    os.makedirs(object_path.parent, mode=0o2775, exist_ok=True)
+    os.chmod(file_path, 0o444) # read-only, since users get hardlinks to the same inode
+    os.replace(file_path, object_path) # atomic publish, identical content just replaces itself
+
+    with store_lock(store_path):
+        index = _read_index(store_path)
+        index[url] = {"sha256": digest, "name": name, "size": object_path.stat().st_size}
+        _write_index(store_path, index)
+
+    return object_path
+
+
+def fetch(store_path, url, name, download, mirror=None, sha256=None):
+    """
+    Gets a file from the store, downloading and publishing it first if it is missing
+
+        Arguments:
+
+            store_path (Path):     path to the store
+            url        (str):      the upstream url of the file
+            name       (str):      the file name, used for progress and the index
+            download   (function): called as download(url, output_path, name)
+            mirror     (str):      optional mirror base url to download from
+            sha256     (str):      optional checksum the file must match
+
+        Returns:
+
+            object_path (Path): path to the stored file
+    """
+    object_path = lookup(store_path, url, sha256)
+    if object_path:
+        return object_path
+
+    with store_lock(store_path, _url_key(url)): # only one user downloads a given url at a time
+        object_path = lookup(store_path, url, sha256) # someone may have finished while we waited
+        if object_path:
+            return object_path
+
+        fd, tmp_path = tempfile.mkstemp(dir=store_path / "tmp", prefix=name + ".")
+        os.close(fd)
+        try:
+            download(mirror_url(url, mirror), Path(tmp_path), name)
+            return publish(store_path, url, Path(tmp_path), name, sha256)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+
+def link_into(object_path, output_path):
+    """
+    Places a stored file at output_path, as a hardlink when possible and a symlink otherwise
+
+        Arguments:
+
+            object_path (Path): path to the stored file
+            output_path (Path): where the user wants the file
+
+        Returns:
+
+            output_path (Path): the path that was linked
+    """
+    os.makedirs(output_path.parent, exist_ok=True)
+    if output_path.is_symlink() or output_path.exists():
+        os.remove(output_path)
+    try:
+        os.link(object_path, output_path)
+    except OSError: # different filesystem, or hardlinks not allowed
+        os.symlink(object_path.resolve(), output_path)
+    return output_path
@@ -0,0 +1,183 @@
+"""
+resources
+
+Sizes a bcbio run to the machine it runs on: how many cores to give `bcbio_nextgen.py -n`,
+and how much memory per core the aligner and samtools get in the template's `resources` section.
+
+CPU and memory limits set by cgroups (containers, SLURM jobs) and by CPU affinity are respected,
+so a job that was given 8 of a node's 64 cores is sized for 8.
+"""
+
+# native
+import math
+import os
+from pathlib import Path
+import shutil
+
+# lib
+import bcbio_inventory
+
+
+MIN_MEMORY_PER_CORE = 1.0 # GB, below this bcbio's tools start failing
+SAMTOOLS_MEMORY_PER_CORE = 2.0 # GB, samtools sort -m is per thread and gains little past this
+MEMORY_HEADROOM = 0.85 # share of the available memory the run may plan to use
+INDEX_MEMORY_FACTOR = 1.2 # aligners load their whole index, plus working memory
+
+DEFAULT_INDEX_GB = { # used when the bcbio installation can't be inspected
+    "hisat2": 4.5,
+    "star": 32.0,
+    "bwa": 5.5,
+    "salmon": 8.0,
+}
+
+
+def _read(path):
+    try:
+        with open(path, "r") as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def available_cpus():
+    """
+    Counts the CPUs this process may use, respecting affinity and cgroup quotas
+
+        Arguments:
+
+            None
+
+        Returns:
+
+            cpus (int): number of usable cores
+    """
+    cpus = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count() or 1
+
+    quota = _read("/sys/fs/cgroup/cpu.max") # cgroup v2: "<quota> <period>" or "max <period>"
+    if quota and not quota.startswith("max"):
+        limit, period = (int(x) for x in quota.split()[:2])
+        cpus = min(cpus, max(1, math.ceil(limit / period)))
+
+    limit = _read("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") # cgroup v1
+    period = _read("/sys/fs/cgroup/cpu/cpu.cfs_period_us")
+    if limit and period and int(limit) > 0:
+        cpus = min(cpus, max(1, math.ceil(int(limit) / int(period))))
+
+    return cpus
+
+
+def available_memory_gb():
+    """
+    Gets the memory this process may use, respecting cgroup limits
+
+        Arguments:
+
+            None
+
+        Returns:
+
+            memory (float): available memory in GB
+    """
+    available = None
+    meminfo = _read("/proc/meminfo") or ""
+    for line in meminfo.splitlines():
+        if line.startswith("MemAvailable:"):
+            available = int(line.split()[1]) * 1024
+    if available is None: # not linux, fall back to the total
+        available = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+
+    for limit_path, usage_path in (
+        ("/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory.current"), # cgroup v2
+        ("/sys/fs/cgroup/memory/memory.limit_in_bytes", "/sys/fs/cgroup/memory/memory.usage_in_bytes"), # v1
+    ):
+        limit, usage = _read(limit_path), _read(usage_path)
+        if limit and limit.isdigit() and usage and usage.isdigit():
+            available = min(available, int(limit) - int(usage))
+
+    return available / 1024 ** 3
+
+
+def index_size_gb(genome_build, aligner):
+    """
+    Gets the size of the aligner's index for a genome build from the bcbio installation
+
+        Arguments:
+
+            genome_build (str): e.g. hg38
+            aligner      (str): e.g. hisat2
+
+        Returns:
+
+            size (float): index size in GB, a typical size if it can't be found
+    """
+    bcbio_nextgen = shutil.which("bcbio_nextgen.py")
+    if bcbio_nextgen:
+        bcbio_path = Path(os.path.realpath(bcbio_nextgen)).parents[2] # <bcbio>/anaconda/bin/bcbio_nextgen.py
+        for build in bcbio_inventory.inventory(bcbio_path)["builds"]:
+            if build["build"] == genome_build and aligner in build["indexes"]:
+                return build["indexes"][aligner]["size"] / 1024 ** 3
+    return DEFAULT_INDEX_GB.get(aligner, 8.0)
+
+
+def _gb(value):
+    return f"{max(value, MIN_MEMORY_PER_CORE):.1f}G".replace(".0G", "G")
+
+
+def auto_size(genome_build="hg38", aligner="hisat2"):
+    """
+    Picks the number of cores and the per-core memory of the aligner and samtools for this machine
+
+        Arguments:
+
+            genome_build (str): genome build of the run
+            aligner      (str): aligner of the run
+
+        Returns:
+
+            sizing (dict): cores (int), resources (the template's resources section),
+                           and cpus, memory_gb, index_gb and warning, for reporting
+    """
+    cpus = available_cpus()
+    memory = available_memory_gb() * MEMORY_HEADROOM
+    index = index_size_gb(genome_build, aligner)
+
+    cores = max(1, min(cpus, int(memory // MIN_MEMORY_PER_CORE))) # don't plan more cores than memory allows
+    per_core = memory / cores
+    aligner_needed = index * INDEX_MEMORY_FACTOR
+
+    warning = None
+    if aligner_needed > memory:
+        warning = (
+            f"{aligner} needs about {aligner_needed:.0f} GB for its {genome_build} index, "
+            f"but only {memory:.0f} GB is available, expect it to run out of memory"
+        )
+
+    return {
+        "cores": cores,
+        "resources": {
+            aligner: {"memory": _gb(max(per_core, aligner_needed / cores)), "cores": cores},
+            "samtools": {"memory": _gb(min(per_core, SAMTOOLS_MEMORY_PER_CORE)), "cores": cores},
+        },
+        "cpus": cpus,
+        "memory_gb": memory,
+        "index_gb": index,
+        "warning": warning,
+    }
+
+
+def add_to_template(args, sizing):
+    """
+    Adds the resources section of an auto sizing to the template arguments
+
+        Arguments:
+
+            args   (dict): the yaml.dump() ready template arguments, see get_args
+            sizing (dict): as returned by auto_size
+
+        Returns:
+
+            args (dict): the same arguments, with resources set on every detail
+    """
+    for detail in args["details"]:
+        detail["resources"] = sizing["resources"]
+    return args
@@ -0,0 +1,432 @@
+"""
+run_dashboard
+
+A dock for app_helper that follows a bcbio run: the pipeline stage, the stage of each sample,
+elapsed time and an ETA, and CPU, memory and disk I/O of the whole bcbio process tree. Its
+controls pause, resume and throttle that tree (see process_control.py).
+
+Stages come from bcbio's log: it prints "Timing: <stage>" when the pipeline moves on, and a
+sample is at the latest stage in which its name appeared in the log. Lines are parsed as the
+console flushes them, while the widgets are only redrawn once a second, however many samples
+are running.
+"""
+
+# native
+from collections import deque
+import re
+import time
+
+# pkg
+from PyQt5 import QtCore, QtGui, QtWidgets
+import psutil
+
+# lib
+import process_control
+
+
+STAGES = [ # bcbio RNA-seq "Timing:" stages, in order, matched by their start
+    "organize samples",
+    "prepare",
+    "trimming",
+    "alignment",
+    "alignment post-processing",
+    "transcript assembly",
+    "estimate expression",
+    "quantitation",
+    "quality control",
+    "finished",
+]
+TIMING = re.compile(r"Timing: (.+?)\s*$")
+REFRESH_MS = 1000
+HISTORY = 120 # samples in each sparkline, at one per refresh
+
+
+def stage_index(stage):
+    """
+    Gets the position of a bcbio stage in STAGES, None if it isn't a known stage
+    """
+    stage = stage.lower()
+    matches = [i for i, known in enumerate(STAGES) if stage.startswith(known)]
+    return max(matches) if matches else None # "alignment post-processing" over "alignment"
+
+
+class StageTracker:
+    """
+    Follows the stage of a run, and of each of its samples, from log lines
+
+        Arguments:
+
+            samples (list): sample names, as in the description column of the run's csv
+    """
+
+    def __init__(self, samples):
+        self.samples = {}
+        self.pattern = None
+        self.set_samples(samples)
+        self.stage = None
+        self.index = -1
+        self.stage_started = None
+        self.started = time.time()
+        self.finished = False
+
+    def set_samples(self, samples):
+        """
+        Sets the samples to follow, e.g. once they are known after the run started. Samples seen already keep their stage.
+        """
+        self.samples = {sample: self.samples.get(sample, {"stage": None, "index": -1, "updated": None}) for sample in samples}
+        self.pattern = re.compile("|".join(re.escape(s) for s in sorted(samples, key=len, reverse=True))) if samples else None
+
+    def feed(self, text):
+        """
+        Parses a batch of log text
+
+            Returns:
+
+                changed (bool): whether anything shown changed
+        """
+        changed = False
+        for line in text.splitlines():
+            timing = TIMING.search(line)
+            if timing:
+                index = stage_index(timing.group(1))
+                self.stage = timing.group(1)
+                self.stage_started = time.time()
+                if index is not None:
+                    self.index = max(self.index, index)
+                    self.finished = self.finished or STAGES[index] == "finished"
+                changed = True
+                continue
+
+            if self.pattern and self.stage:
+                for sample in set(self.pattern.findall(line)):
+                    record = self.samples[sample]
+                    if record["stage"] != self.stage:
+                        record["stage"] = self.stage
+                        record["index"] = max(record["index"], self.index)
+                        changed = True
+                    record["updated"] = time.time()
+        return changed
+
+    def progress(self):
+        """
+        Gets the share of the run that is done, counting the samples that are already past the run's stage
+
+            Returns:
+
+                progress (float): between 0 and 1
+        """
+        if self.finished:
+            return 1.0
+        if self.index < 0:
+            return 0.0
+        ahead = [r for r in self.samples.values() if r["index"] > self.index]
+        within = len(ahead) / len(self.samples) if self.samples else 0.0
+        return min(1.0, (self.index + within) / (len(STAGES) - 1))
+
+    def eta(self):
+        """
+        Estimates the seconds left, from the progress so far, None until there is some
+        """
+        progress = self.progress()
+        if progress <= 0.0 or self.finished:
+            return None
+        elapsed = time.time() - self.started
+        return elapsed / progress - elapsed
+
+
+class TreeSampler:
+    """
+    Samples CPU, memory and disk I/O of a process and all of its children
+
+        Arguments:
+
+            pid (int): the root of the tree
+    """
+
+    def __init__(self, pid):
+        self.root = psutil.Process(pid)
+        self.processes = {} # pid -> Process, kept so cpu_percent has a previous value to compare to
+        self.last_io = None
+        self.last_time = None
+
+    def sample(self):
+        """
+        Returns:
+
+            usage (dict): cpu (% of one core, summed), rss (bytes), io (bytes/s read and written) and
+                          processes, or None once the root has exited
+        """
+        try:
+            tree = [self.root] + self.root.children(recursive=True)
+        except psutil.NoSuchProcess:
+            return None
+
+        cpu, rss, io = 0.0, 0, 0
+        alive = {}
+        for process in tree:
+            process = self.processes.get(process.pid, process)
+            try:
+                with process.oneshot():
+                    cpu += process.cpu_percent(None) # 0.0 the first time a process is seen
+                    rss += process.memory_info().rss
+                    if hasattr(process, "io_counters"):
+                        counters = process.io_counters()
+                        io += counters.read_bytes + counters.write_bytes
+            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                continue
+            alive[process.pid] = process
+        self.processes = alive
+
+        now = time.time()
+        rate = (io - self.last_io) / (now - self.last_time) if self.last_io is not None else 0.0
+        self.last_io, self.last_time = io, now
+        return {"cpu": cpu, "rss": rss, "io": max(0.0, rate), "processes": len(alive)}
+
+
+class Sparkline(QtWidgets.QWidget):
+    """
+    A small line chart of the last HISTORY values, with the latest value as its label
+    """
+
+    def __init__(self, title, unit, scale=1.0, parent=None):
+        super().__init__(parent)
+        self.title, self.unit, self.scale = title, unit, scale
+        self.values = deque(maxlen=HISTORY)
+        self.setMinimumSize(160, 48)
+
+    def add(self, value):
+        self.values.append(value / self.scale)
+
+    def clear(self):
+        self.values.clear()
+        self.update()
+
+    def paintEvent(self, event):
+        painter = QtGui.QPainter(self)
+        painter.setRenderHint(QtGui.QPainter.Antialiasing)
+        rect = self.rect().adjusted(2, 16, -2, -2)
+        painter.drawText(2, 12, f"{self.title}: {self.values[-1]:.1f} {self.unit}" if self.values else self.title)
+        if len(self.values) < 2:
+            return
+
+        top = max(self.values) or 1.0
+        step = rect.width() / (HISTORY - 1)
+        offset = HISTORY - len(self.values) # new values enter on the right
+        points = [
+            QtCore.QPointF(rect.left() + (offset + i) * step, rect.bottom() - value / top * rect.height())
+            for i, value in enumerate(self.values)
+        ]
+        painter.setPen(QtGui.QPen(self.palette().highlight().color(), 1.5))
+        painter.drawPolyline(QtGui.QPolygonF(points))
+
+
+class SampleModel(QtCore.QAbstractTableModel):
+    """
+    Stage and last activity of each sample of a StageTracker
+    """
+
+    HEADERS = ["Sample", "Stage", "Last Activity"]
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.tracker = None
+        self.names = []
+
+    def set_tracker(self, tracker):
+        self.beginResetModel()
+        self.tracker = tracker
+        self.names = sorted(tracker.samples) if tracker else []
+        self.endResetModel()
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else len(self.names)
+
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else len(self.HEADERS)
+
+    def headerData(self, section, orientation, role=QtCore.Qt.DisplayRole):
+        if role == QtCore.Qt.DisplayRole and orientation == QtCore.Qt.Horizontal:
+            return self.HEADERS[section]
+        return None
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if role != QtCore.Qt.DisplayRole or not index.isValid():
+            return None
+        name = self.names[index.row()]
+        record = self.tracker.samples[name]
+        if index.column() == 0:
+            return name
+        if index.column() == 1:
+            return record["stage"] or "waiting"
+        return _duration(time.time() - record["updated"]) + " ago" if record["updated"] else ""
+
+    def refresh(self):
+        if self.names:
+            self.dataChanged.emit(self.index(0, 1), self.index(len(self.names) - 1, 2))
+
+
+def _duration(seconds):
+    seconds = int(seconds)
+    return f"{seconds // 3600}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+
+
+class DashboardDock(QtWidgets.QDockWidget):
+    """
+    The run dashboard, fed the console's text and sampling the process tree once a second
+    """
+
+    def __init__(self, parent=None):
+        super().__init__("Run Dashboard", parent)
+        self.setObjectName("runDashboard_dock")
+        self.tracker = None
+        self.sampler = None
+        self.control = None
+        self.dirty = False
+
+        self.stage = QtWidgets.QLabel("No run")
+        self.progress = QtWidgets.QProgressBar()
+        self.progress.setRange(0, 1000)
+        self.times = QtWidgets.QLabel()
+        self.cpu = Sparkline("CPU", "%")
+        self.rss = Sparkline("Memory", "GB", scale=1024 ** 3)
+        self.io = Sparkline("Disk I/O", "MB/s", scale=1e6)
+
+        self.samples_model = SampleModel(self)
+        self.samples = QtWidgets.QTableView()
+        self.samples.setModel(self.samples_model)
+        self.samples.verticalHeader().setDefaultSectionSize(self.samples.fontMetrics().height() + 4)
+        self.samples.verticalHeader().hide()
+        self.samples.horizontalHeader().setStretchLastSection(True)
+
+        # * throttling, for the whole tree and the processes it starts later
+        self.pause_button = QtWidgets.QPushButton("Pause")
+        self.pause_button.setCheckable(True)
+        self.nice = QtWidgets.QSpinBox()
+        self.nice.setRange(0, 19)
+        self.nice.setPrefix("Nice ")
+        self.ionice = QtWidgets.QComboBox()
+        self.ionice.addItems(["best-effort", "idle"])
+        self.affinity = QtWidgets.QLineEdit()
+        self.affinity.setPlaceholderText("All cores, or e.g. 0-3,8")
+        self.apply_button = QtWidgets.QPushButton("Apply")
+        controls = QtWidgets.QHBoxLayout()
+        for control in (self.pause_button, self.nice, self.ionice, self.affinity, self.apply_button):
+            controls.addWidget(control)
+        self.pause_button.toggled.connect(self.on_push_pause)
+        self.apply_button.clicked.connect(self.on_push_apply)
+
+        charts = QtWidgets.QHBoxLayout()
+        for chart in (self.cpu, self.rss, self.io):
+            charts.addWidget(chart)
+        layout = QtWidgets.QVBoxLayout()
+        layout.addWidget(self.stage)
+        layout.addWidget(self.progress)
+        layout.addWidget(self.times)
+        layout.addLayout(controls)
+        layout.addLayout(charts)
+        layout.addWidget(self.samples)
+        widget = QtWidgets.QWidget()
+        widget.setLayout(layout)
+        self.setWidget(widget)
+
+        self.timer = QtCore.QTimer(self)
+        self.timer.setInterval(REFRESH_MS)
+        self.timer.timeout.connect(self.refresh)
+
+    def start(self, pid, samples):
+        """
+        Starts following a run
+
+            Arguments:
+
+                pid     (int):  the process that runs bcbio_helper.py
+                samples (list): sample names
+        """
+        self.tracker = StageTracker(samples)
+        try:
+            self.sampler = TreeSampler(pid)
+            self.control = process_control.TreeControl(pid)
+        except psutil.NoSuchProcess:
+            self.sampler = self.control = None
+        self.pause_button.setChecked(False)
+        self.samples_model.set_tracker(self.tracker)
+        for chart in (self.cpu, self.rss, self.io):
+            chart.clear()
+        self.dirty = True
+        self.show()
+        self.timer.start()
+
+    def set_samples(self, samples):
+        """
+        Follows these samples in the run that was started, when they weren't known yet at start()
+        """
+        if self.tracker is None:
+            return
+        self.tracker.set_samples(samples)
+        self.samples_model.set_tracker(self.tracker)
+        self.dirty = True
+
+    def stop(self):
+        self.refresh()
+        self.timer.stop()
+        self.sampler = self.control = None
+        self.pause_button.setChecked(False)
+
+    def on_push_pause(self, paused):
+        if self.control is None:
+            return
+        result = self.control.pause() if paused else self.control.resume()
+        self.pause_button.setText("Resume" if paused else "Pause")
+        self.report(("Paused" if paused else "Resumed"), result)
+
+    def on_push_apply(self):
+        if self.control is None:
+            return
+        try:
+            affinity = process_control.parse_cpus(self.affinity.text()) if self.affinity.text().strip() else None
+        except ValueError:
+            print(f"Could not read the cores {self.affinity.text()}, use e.g. 0-3,8\n")
+            return
+        result = self.control.set(
+            nice=self.nice.value(), ionice=(self.ionice.currentText(), None), affinity=affinity,
+        )
+        self.report("Throttled", result)
+
+    def report(self, action, result):
+        print(f"{action} {result['processes']} processes of the run\n")
+        for problem in result["problems"]:
+            print(f"WARNING: could not set {problem}\n")
+
+    def feed(self, text):
+        # * called on every console flush, only parses, refresh() redraws
+        if self.tracker is not None and self.tracker.feed(text):
+            self.dirty = True
+
+    def refresh(self):
+        if self.tracker is None:
+            return
+
+        usage = self.sampler.sample() if self.sampler else None
+        if self.control is not None:
+            self.control.enforce() # processes started since the last tick get the same settings
+        if usage:
+            self.cpu.add(usage["cpu"])
+            self.rss.add(usage["rss"])
+            self.io.add(usage["io"])
+            for chart in (self.cpu, self.rss, self.io):
+                chart.update()
+
+        elapsed = time.time() - self.tracker.started
+        eta = self.tracker.eta()
+        processes = f", {usage['processes']} processes" if usage else ""
+        self.times.setText(
+            f"Elapsed {_duration(elapsed)}, " + (f"about {_duration(eta)} left" if eta is not None else "ETA unknown") + processes
+        )
+
+        if self.dirty:
+            stage = self.tracker.stage or "starting"
+            waiting = sum(1 for r in self.tracker.samples.values() if r["stage"] is None)
+            self.stage.setText(f"Stage: {stage} ({len(self.tracker.samples) - waiting} of {len(self.tracker.samples)} samples seen)")
+            self.progress.setValue(int(self.tracker.progress() * 1000))
+            self.dirty = False
+        self.samples_model.refresh() # also ages "Last Activity"
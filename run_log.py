@@ -0,0 +1,319 @@
+"""
+run_log
+
+The full output of a run on disk, indexed as it is written, so it can be searched, filtered by
+level and read from any line without holding it in memory.
+
+    <name>.log      the output, as it arrived
+    <name>.log.idx  the byte offset of the start of each line, 8 bytes per line, appended as lines complete
+
+Lines are read back through a memory map of the log. The token index (lowercased words of 3 or
+more characters -> line numbers) and the level index (ERROR, WARNING -> line numbers) are kept in
+memory for the last INDEX_LINES lines only, so a multi-GB log doesn't fill the GUI's memory. They
+are built as lines arrive, or on the first search of a log that was reopened. Older lines are
+searched by scanning the map, which is slower but rarely needed: the end of a run is what's read.
+"""
+
+# native
+from array import array
+import bisect
+import mmap
+import os
+from pathlib import Path
+import re
+
+
+TOKEN = re.compile(rb"[a-z0-9_]{3,}")
+LEVELS = {
+    "ERROR": re.compile(rb"\b(?:ERROR|CRITICAL|Traceback|Exception)\b|\w+Error:"),
+    "WARNING": re.compile(rb"\bWARN(?:ING)?\b|\w+Warning:"),
+}
+SCAN_SIZE = 16 * 1024 * 1024
+INDEX_LINES = 500_000 # newest lines in the token and level indexes
+TRIM_LINES = 50_000 # lines the indexes may grow past INDEX_LINES before the oldest are dropped
+
+
+class RunLog:
+    """
+    An indexed log file, opened for appending
+
+        Arguments:
+
+            path (Path): the log, created if it doesn't exist. An existing log is appended to, and its
+                         .idx is reused if it matches the log.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.index_path = Path(str(path) + ".idx")
+        self.file = open(self.path, "ab")
+        self.offsets = array("Q") # start of each complete line
+        self.end = 0 # end of the last complete line, where the unfinished one starts
+        self.tail = b"" # the unfinished line
+        self.tokens = {}
+        self.levels = {level: array("I") for level in LEVELS}
+        self.index_start = 0 # first line in the token and level indexes, older ones are scanned
+        self.indexed = 0 # end of the token and level indexes
+        self._map = None
+
+        self._load_index()
+        self.index_file = open(self.index_path, "ab")
+
+    def _load_index(self):
+        size = self.file.tell()
+        if self.index_path.exists():
+            with open(self.index_path, "rb") as f:
+                self.offsets.frombytes(f.read(os.path.getsize(self.index_path) // 8 * 8))
+            if self.offsets and self.offsets[-1] >= size: # not this log's index, rebuild it
+                self.offsets = array("Q")
+
+        # finds the lines after the last indexed one, usually none
+        start = self.offsets[-1] if self.offsets else 0
+        with open(self.path, "rb") as f:
+            f.seek(start)
+            position = start
+            if self.offsets: # that line is indexed already, skip past it
+                first = f.readline()
+                if not first.endswith(b"\n"):
+                    self.end, self.tail = start, first
+                    self.offsets.pop()
+                    self._rewrite_index()
+                    return
+                position += len(first)
+            fresh = array("Q")
+            for line in f:
+                if not line.endswith(b"\n"):
+                    self.tail = line
+                    break
+                fresh.append(position)
+                position += len(line)
+            self.end = position
+        if fresh:
+            self.offsets.extend(fresh)
+            self._rewrite_index()
+
+    def _rewrite_index(self):
+        with open(self.index_path, "wb") as f:
+            self.offsets.tofile(f)
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def append(self, text):
+        """
+        Writes text to the log and indexes the lines it completes
+
+            Arguments:
+
+                text (str): any amount of output, lines may be split across calls
+
+            Returns:
+
+                added (int): complete lines added
+        """
+        data = text.encode("utf-8")
+        self.file.write(data)
+
+        *complete, self.tail = (self.tail + data).split(b"\n")
+        first = len(self.offsets)
+        for line in complete:
+            self.offsets.append(self.end)
+            self.end += len(line) + 1
+        self.offsets[first:].tofile(self.index_file)
+
+        if self.indexed == first: # keep the token index current, unless it was never built
+            for number, line in enumerate(complete, first):
+                self._index_line(number, line)
+            self.indexed = len(self.offsets)
+            self._trim_index()
+        return len(complete)
+
+    def flush(self):
+        self.file.flush()
+        self.index_file.flush()
+
+    def close(self):
+        self.flush()
+        if self._map:
+            self._map.close()
+            self._map = None
+        self.file.close()
+        self.index_file.close()
+
+    def _index_line(self, number, line):
+        for token in set(TOKEN.findall(line.lower())):
+            postings = self.tokens.get(token)
+            if postings is None:
+                postings = self.tokens[token] = array("I")
+            postings.append(number)
+        for level, pattern in LEVELS.items():
+            if pattern.search(line):
+                self.levels[level].append(number)
+
+    def _trim_index(self):
+        """
+        Drops the oldest lines from the token and level indexes, once they hold more than INDEX_LINES
+        """
+        if self.indexed - self.index_start <= INDEX_LINES + TRIM_LINES:
+            return
+        start = self.indexed - INDEX_LINES
+        for index in (self.tokens, self.levels):
+            for key, postings in list(index.items()):
+                cut = bisect.bisect_left(postings, start)
+                if cut == len(postings) and index is self.tokens:
+                    del index[key]
+                else:
+                    del postings[:cut]
+        self.index_start = start
+
+    def _mapped(self):
+        """
+        Maps the log, again if it grew since the last map
+        """
+        if self._map is None or len(self._map) < self.end:
+            self.file.flush()
+            if self._map:
+                self._map.close()
+            with open(self.path, "rb") as f:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if self.end else None
+        return self._map
+
+    def line(self, number):
+        """
+        Reads one complete line, without its newline
+
+            Arguments:
+
+                number (int): 0-based line number
+
+            Returns:
+
+                line (str)
+        """
+        return self._mapped()[self.offsets[number]:self._line_end(number)].decode("utf-8", errors="replace")
+
+    def lines(self, start, stop):
+        """
+        Reads the complete lines start..stop-1, in one read
+        """
+        start, stop = max(0, start), min(stop, len(self.offsets))
+        if start >= stop:
+            return []
+        end = self.offsets[stop] if stop < len(self.offsets) else self.end
+        data = self._mapped()[self.offsets[start]:end - 1]
+        return data.decode("utf-8", errors="replace").split("\n")
+
+    def _read(self, start, stop):
+        """
+        Yields the line number and bytes of the complete lines start..stop-1, read about SCAN_SIZE at a time
+        """
+        mapped = self._mapped()
+        number = start
+        while number < stop:
+            chunk = number + 1
+            while chunk < stop and self.offsets[chunk] - self.offsets[number] < SCAN_SIZE:
+                chunk += 1
+            end = self.offsets[chunk] if chunk < len(self.offsets) else self.end
+            for line in mapped[self.offsets[number]:end - 1].split(b"\n"):
+                yield number, line
+                number += 1
+
+    def build_index(self):
+        """
+        Indexes the tokens and levels of every line not indexed yet, e.g. of a reopened log,
+        up to the last INDEX_LINES
+        """
+        if self.indexed == len(self.offsets):
+            return
+        start = max(self.indexed, len(self.offsets) - INDEX_LINES)
+        if start > self.indexed: # too far behind, the lines in between would be dropped again
+            self.tokens = {}
+            self.levels = {level: array("I") for level in LEVELS}
+            self.index_start = start
+        for number, line in self._read(start, len(self.offsets)):
+            self._index_line(number, line)
+        self.indexed = len(self.offsets)
+        self._trim_index()
+
+    def _scan(self, stop, words, level, limit):
+        """
+        Finds the lines before stop, which are not in the indexes, that contain every word and have the level
+        """
+        words = set(words)
+        pattern = LEVELS[level] if level else None
+        numbers = []
+        for number, line in self._read(0, stop):
+            if words and not words <= set(TOKEN.findall(line.lower())):
+                continue
+            if pattern and not pattern.search(line):
+                continue
+            numbers.append(number)
+            if len(numbers) >= limit:
+                break
+        return numbers
+
+    def search(self, query="", level=None, limit=10_000):
+        """
+        Finds the lines that contain every word of query, and have a level
+
+            Arguments:
+
+                query (str): words to look for, case-insensitive. If it has no word of 3 or more
+                             characters, it is matched as a case-sensitive substring instead.
+                level (str): ERROR or WARNING, None for any line
+                limit (int): most line numbers to return
+
+            Returns:
+
+                numbers (list): matching line numbers, in order
+        """
+        self.build_index()
+        words = TOKEN.findall(query.lower().encode("utf-8"))
+
+        older = []
+        if self.index_start and (words or (level and not query)): # lines that were dropped from the indexes
+            older = self._scan(self.index_start, words, level, limit)
+
+        if words:
+            postings = sorted((self.tokens.get(word, array("I")) for word in set(words)), key=len)
+            numbers = postings[0]
+            for other in postings[1:]:
+                other = set(other)
+                numbers = [n for n in numbers if n in other]
+        elif query:
+            needle = query.encode("utf-8")
+            numbers = []
+            mapped = self._mapped()
+            position = mapped.find(needle) if mapped else -1
+            while position != -1 and position < self.end and len(numbers) < limit:
+                number = self._line_at(position)
+                numbers.append(number)
+                next_line = self.offsets[number + 1] if number + 1 < len(self.offsets) else self.end
+                position = mapped.find(needle, next_line)
+        else:
+            numbers = range(len(self.offsets))
+
+        if level:
+            wanted = self.levels[level]
+            if query:
+                wanted = set(wanted)
+                numbers = [
+                    n for n in numbers
+                    if n in wanted or (n < self.index_start and LEVELS[level].search(self._mapped()[self.offsets[n]:self._line_end(n)]))
+                ]
+            else:
+                numbers = wanted
+        return (older + list(numbers[:limit]))[:limit]
+
+    def _line_end(self, number):
+        return self.offsets[number + 1] - 1 if number + 1 < len(self.offsets) else self.end - 1
+
+    def _line_at(self, position):
+        low, high = 0, len(self.offsets) - 1
+        while low < high: # last line that starts at or before position
+            middle = (low + high + 1) // 2
+            if self.offsets[middle] <= position:
+                low = middle
+            else:
+                high = middle - 1
+        return low
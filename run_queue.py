@@ -0,0 +1,391 @@
+"""
+run_queue
+
+A queue of bcbio_helper runs for app_helper. Queued runs start in order as soon as the cores
+they ask for fit in a total core budget, so several projects can run at once without
+oversubscribing the machine. Each run has its own QProcess, status and console, whose full
+output goes to its own run log (see log_view.py and run_log.py).
+"""
+
+# native
+import itertools
+import threading
+import time
+
+# pkg
+from PyQt5 import QtCore, QtWidgets
+
+# lib
+import log_view
+import process_control
+import resources
+
+
+QUEUED, RUNNING, FINISHED, FAILED, CANCELLED = "queued", "running", "finished", "failed", "cancelled"
+
+
+class Job:
+    """
+    One queued run
+
+        Arguments:
+
+            name      (str):  shown in the queue
+            arguments (list): program and arguments, as made by ApplicationWindow.store_arguments
+            cores     (int):  cores the run counts against the budget
+            work_dir  (Path): the run's work/ directory, cleaned up when it is cancelled, see process_control.run_work_dir
+    """
+
+    ids = itertools.count(1)
+
+    def __init__(self, name, arguments, cores, work_dir=None):
+        self.id = next(self.ids)
+        self.name = name
+        self.arguments = arguments
+        self.cores = cores
+        self.work_dir = work_dir
+        self.status = QUEUED
+        self.cancelling = False # running, until its processes have exited
+        self.process = None
+        self.control = None # process_control.TreeControl, once it has been paused
+        self.view = None # its console, a LogView
+        self.started = None
+        self.ended = None
+        self.exit_code = None
+
+
+class JobModel(QtCore.QAbstractTableModel):
+    """
+    The jobs of a RunQueue, in queue order
+    """
+
+    HEADERS = ["#", "Run", "Cores", "Status", "Time"]
+
+    def __init__(self, queue, parent=None):
+        super().__init__(parent)
+        self.queue = queue
+        self.moving = [] # (persistent index, job) while jobs swap places
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else len(self.queue.jobs)
+
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else len(self.HEADERS)
+
+    def headerData(self, section, orientation, role=QtCore.Qt.DisplayRole):
+        if role == QtCore.Qt.DisplayRole and orientation == QtCore.Qt.Horizontal:
+            return self.HEADERS[section]
+        return None
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if role != QtCore.Qt.DisplayRole or not index.isValid():
+            return None
+        job = self.queue.jobs[index.row()]
+        column = index.column()
+        if column == 0:
+            return job.id
+        if column == 1:
+            return job.name
+        if column == 2:
+            return job.cores
+        if column == 3:
+            if job.cancelling and job.status == RUNNING:
+                return "cancelling"
+            if job.control and job.control.paused and job.status == RUNNING:
+                return "paused"
+            return job.status + (f" ({job.exit_code})" if job.status == FAILED else "")
+        if job.started is None:
+            return ""
+        seconds = int((job.ended or time.time()) - job.started)
+        return f"{seconds // 3600}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+
+    def refresh(self):
+        if self.queue.jobs:
+            self.dataChanged.emit(self.index(0, 0), self.index(len(self.queue.jobs) - 1, len(self.HEADERS) - 1))
+
+    # * the queue announces each change before and after making it, as the model contract asks
+
+    def about_to_insert(self, row):
+        self.beginInsertRows(QtCore.QModelIndex(), row, row)
+
+    def inserted(self):
+        self.endInsertRows()
+
+    def about_to_move(self):
+        self.layoutAboutToBeChanged.emit()
+        self.moving = [(index, self.queue.jobs[index.row()]) for index in self.persistentIndexList()]
+
+    def moved(self):
+        for index, job in self.moving: # selections follow their job
+            self.changePersistentIndex(index, self.index(self.queue.jobs.index(job), index.column()))
+        self.moving = []
+        self.layoutChanged.emit()
+
+    def job_changed(self, job):
+        if job in self.queue.jobs:
+            row = self.queue.jobs.index(job)
+            self.dataChanged.emit(self.index(row, 0), self.index(row, len(self.HEADERS) - 1))
+
+
+class RunQueue(QtCore.QObject):
+    """
+    Starts queued jobs, in order, while their cores fit in the budget
+
+        Arguments:
+
+            budget (int): total cores the running jobs may use
+    """
+
+    about_to_insert = QtCore.pyqtSignal(int) # row, emitted before the job is added
+    inserted = QtCore.pyqtSignal()
+    about_to_move = QtCore.pyqtSignal() # emitted before jobs swap places
+    moved = QtCore.pyqtSignal()
+    job_changed = QtCore.pyqtSignal(object) # its status or settings changed
+
+    def __init__(self, budget, parent=None):
+        super().__init__(parent)
+        self.budget = budget
+        self.jobs = []
+        self.reserved = 0 # cores of the run started from the main window, outside the queue
+
+    def used(self):
+        return self.reserved + sum(job.cores for job in self.jobs if job.status == RUNNING)
+
+    def reserve(self, cores):
+        """
+        Counts a run the queue didn't start against the budget, 0 when it has ended
+        """
+        self.reserved = cores
+        self.schedule()
+
+    def add(self, job):
+        job.view = log_view.LogView(log_view.default_spill_path(f"queue-{job.id}"))
+        self.about_to_insert.emit(len(self.jobs))
+        self.jobs.append(job)
+        self.inserted.emit()
+        self.schedule()
+
+    def move(self, job, offset):
+        """
+        Moves a queued job up (offset -1) or down (offset 1), past other queued jobs
+        """
+        if job.status != QUEUED:
+            return
+        queued = [j for j in self.jobs if j.status == QUEUED]
+        position = queued.index(job) + offset
+        if not 0 <= position < len(queued):
+            return
+        other = queued[position]
+        a, b = self.jobs.index(job), self.jobs.index(other)
+        self.about_to_move.emit()
+        self.jobs[a], self.jobs[b] = other, job
+        self.moved.emit()
+        self.schedule() # a smaller job may fit now
+
+    def cancel(self, job):
+        if job.status == QUEUED:
+            job.status = CANCELLED
+        elif job.status == RUNNING and not job.cancelling: # its cores stay in use until it has exited
+            job.cancelling = True
+            threading.Thread(target=self._stop, args=(job, job.process.processId()), daemon=True).start()
+        self.job_changed.emit(job)
+        self.schedule()
+
+    def pause(self, job, paused=True):
+        """
+        Pauses or resumes a running job's process tree, it keeps its cores while paused
+        """
+        if job.status != RUNNING:
+            return
+        if job.control is None:
+            job.control = process_control.TreeControl(job.process.processId())
+        job.control.pause() if paused else job.control.resume()
+        self.job_changed.emit(job)
+
+    def enforce(self):
+        # * keeps processes started by paused jobs paused
+        for job in self.jobs:
+            if job.status == RUNNING and job.control and job.control.paused:
+                job.control.enforce()
+
+    def set_budget(self, budget):
+        self.budget = budget
+        self.schedule()
+
+    def schedule(self):
+        """
+        Starts queued jobs in order while they fit. A job larger than the whole budget
+        starts alone, and a job that doesn't fit yet holds back the ones behind it.
+        """
+        for job in self.jobs:
+            if job.status != QUEUED:
+                continue
+            used = self.used()
+            if used and used + job.cores > self.budget:
+                break
+            self._start(job)
+
+    def _start(self, job):
+        job.process = QtCore.QProcess(self)
+        job.process.setProcessChannelMode(QtCore.QProcess.MergedChannels)
+        job.process.readyRead.connect(lambda: job.view.feed_bytes(job.process.readAll().data()))
+        job.process.finished.connect(lambda code, status: self._finished(job, code))
+        job.process.errorOccurred.connect(lambda error: self._failed_to_start(job, error))
+        job.status = RUNNING
+        job.started = time.time()
+        job.view.feed_text(f"Starting: {' '.join(job.arguments)}\n")
+        job.process.start(job.arguments[0], job.arguments[1:])
+        self.job_changed.emit(job)
+
+    def _finished(self, job, code):
+        job.ended = time.time()
+        job.exit_code = code
+        if job.cancelling:
+            job.status = CANCELLED
+        else:
+            job.status = FINISHED if code == 0 else FAILED
+        job.view.feed_text(f"\nExited with code {code}\n")
+        job.view.close_spill()
+        self.job_changed.emit(job)
+        self.schedule()
+
+    def _failed_to_start(self, job, error):
+        if error == QtCore.QProcess.FailedToStart:
+            job.view.feed_text(f"Failed to start: {job.process.errorString()}\n")
+            self._finished(job, -1)
+
+    def _stop(self, job, pid):
+        # * on a thread, shutdown_tree waits for the tree to exit
+        report = process_control.shutdown_tree(pid, work_dir=job.work_dir)
+        print(
+            f"Cancelled run {job.id} ({job.name}): freed {report['cores_freed']:.1f} cores and "
+            f"{report['memory_freed_gb']:.1f} GB, {len(report['partial'])} partial outputs marked\n"
+        )
+        if report["survivors"]:
+            print(f"WARNING: processes {report['survivors']} of run {job.id} could not be stopped, its outputs were left in place\n")
+
+    def shutdown(self):
+        # * when the window closes, so waits for each tree here
+        for job in self.jobs:
+            if job.status == QUEUED:
+                job.status = CANCELLED
+            elif job.status == RUNNING:
+                job.cancelling = True
+                process_control.shutdown_tree(job.process.processId(), timeout=5, work_dir=job.work_dir)
+
+
+def job_cores(arguments, budget):
+    """
+    Gets the cores a run asks for from its arguments. An "auto" run would size itself to the
+    whole machine, so it is given the whole budget instead, in its arguments too.
+    """
+    if "--cores" not in arguments:
+        arguments += ["--cores", "auto"]
+    position = arguments.index("--cores") + 1
+    if not str(arguments[position]).isdigit():
+        arguments[position] = str(budget)
+    return int(arguments[position])
+
+
+class QueueDock(QtWidgets.QDockWidget):
+    """
+    The queue panel: the jobs, their controls, the core budget, and the console of the selected job
+
+        Arguments:
+
+            enqueue (function): returns (name, arguments) of the run configured in the window
+            parent  (QMainWindow)
+    """
+
+    def __init__(self, enqueue, parent=None):
+        super().__init__("Run Queue", parent)
+        self.setObjectName("runQueue_dock")
+        self.enqueue = enqueue
+        self.queue = RunQueue(resources.available_cpus(), self)
+        self.model = JobModel(self.queue, self)
+
+        self.table = QtWidgets.QTableView()
+        self.table.setModel(self.model)
+        self.table.setSelectionBehavior(QtWidgets.QAbstractItemView.SelectRows)
+        self.table.setSelectionMode(QtWidgets.QAbstractItemView.SingleSelection)
+        self.table.verticalHeader().hide()
+        self.table.horizontalHeader().setStretchLastSection(True)
+        self.consoles = QtWidgets.QStackedWidget()
+        self.consoles.addWidget(QtWidgets.QLabel("Select a run to see its output"))
+
+        self.budget = QtWidgets.QSpinBox()
+        self.budget.setRange(1, 4096)
+        self.budget.setValue(self.queue.budget)
+        self.budget.setPrefix("Core budget: ")
+        buttons = QtWidgets.QHBoxLayout()
+        for label, slot in (
+            ("Add Current Run", self.on_push_add),
+            ("Up", lambda: self.on_push_move(-1)),
+            ("Down", lambda: self.on_push_move(1)),
+            ("Pause", lambda: self.on_push_pause(True)),
+            ("Resume", lambda: self.on_push_pause(False)),
+            ("Cancel", self.on_push_cancel),
+        ):
+            button = QtWidgets.QPushButton(label)
+            button.clicked.connect(slot)
+            buttons.addWidget(button)
+        buttons.addStretch()
+        buttons.addWidget(self.budget)
+
+        splitter = QtWidgets.QSplitter(QtCore.Qt.Vertical)
+        splitter.addWidget(self.table)
+        splitter.addWidget(self.consoles)
+        layout = QtWidgets.QVBoxLayout()
+        layout.addLayout(buttons)
+        layout.addWidget(splitter)
+        widget = QtWidgets.QWidget()
+        widget.setLayout(layout)
+        self.setWidget(widget)
+
+        self.budget.valueChanged.connect(self.queue.set_budget)
+        self.queue.about_to_insert.connect(self.model.about_to_insert)
+        self.queue.inserted.connect(self.model.inserted)
+        self.queue.about_to_move.connect(self.model.about_to_move)
+        self.queue.moved.connect(self.model.moved)
+        self.queue.job_changed.connect(self.model.job_changed)
+        self.table.selectionModel().currentRowChanged.connect(self.on_select)
+        self.timer = QtCore.QTimer(self) # ages the Time column
+        self.timer.timeout.connect(self.model.refresh)
+        self.timer.timeout.connect(self.queue.enforce)
+        self.timer.start(1000)
+
+    def selected(self):
+        row = self.table.currentIndex().row()
+        return self.queue.jobs[row] if 0 <= row < len(self.queue.jobs) else None
+
+    def on_push_add(self):
+        configured = self.enqueue()
+        if configured is None:
+            return
+        name, arguments = configured
+        work_dir = process_control.run_work_dir(arguments[-1], arguments[-2]) # <outpath>, <run_name>, before job_cores adds to them
+        job = Job(name, arguments, job_cores(arguments, self.queue.budget), work_dir)
+        self.queue.add(job)
+        self.consoles.addWidget(job.view)
+        self.table.selectRow(self.queue.jobs.index(job))
+
+    def on_push_move(self, offset):
+        job = self.selected()
+        if job:
+            self.queue.move(job, offset)
+            self.table.selectRow(self.queue.jobs.index(job))
+
+    def on_push_pause(self, paused):
+        job = self.selected()
+        if job:
+            self.queue.pause(job, paused)
+
+    def on_push_cancel(self):
+        job = self.selected()
+        if job:
+            self.queue.cancel(job)
+
+    def on_select(self, current, previous):
+        job = self.queue.jobs[current.row()] if current.isValid() else None
+        if job:
+            self.consoles.setCurrentWidget(job.view)
@@ -0,0 +1,214 @@
+"""
+storage_bench
+
+Benchmarks candidate directories for a bcbio run, and recommends where its work/ and final/
+directories should live.
+
+bcbio's work/ directory sees lots of small files (logs, indexes, checkpoints) next to large
+intermediate BAMs, while final/ is written once, sequentially, and kept. Every benchmark
+works inside a temporary directory with a bounded amount of data, which is removed afterwards.
+"""
+
+# native
+import os
+import shutil
+import statistics
+import tempfile
+import time
+
+
+BLOCK = 4 * 1024 * 1024
+WORK_SPACE_FACTOR = 4 # work/ holds trimmed reads, BAMs and their indexes, a few times the input size
+FINAL_SPACE_FACTOR = 1.5 # final/ holds the BAMs and counts of each sample
+
+
+def _drop_cache(fd):
+    if hasattr(os, "posix_fadvise"): # so the read benchmark measures the disk, not the page cache
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+
+
+def bench_sequential(path, size_mb):
+    """
+    Times writing and reading one file of size_mb
+
+        Arguments:
+
+            path    (str): directory to benchmark in
+            size_mb (int): size of the file to write
+
+        Returns:
+
+            results (dict): write_MBps and read_MBps
+    """
+    block = os.urandom(BLOCK) # random data, so compressing filesystems don't flatter the result
+    blocks = max(1, size_mb * 1024 * 1024 // BLOCK)
+    file_path = os.path.join(path, "sequential.bin")
+
+    fd = os.open(file_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    start = time.perf_counter()
+    for _ in range(blocks):
+        os.write(fd, block)
+    os.fsync(fd)
+    write_seconds = time.perf_counter() - start
+    _drop_cache(fd)
+    os.close(fd)
+
+    fd = os.open(file_path, os.O_RDONLY)
+    _drop_cache(fd)
+    start = time.perf_counter()
+    while os.read(fd, BLOCK):
+        pass
+    read_seconds = time.perf_counter() - start
+    os.close(fd)
+    os.remove(file_path)
+
+    size = blocks * BLOCK / 1e6
+    return {"write_MBps": size / write_seconds, "read_MBps": size / read_seconds}
+
+
+def bench_small_files(path, n_files):
+    """
+    Times creating, stat-ing and deleting many small files
+
+        Arguments:
+
+            path    (str): directory to benchmark in
+            n_files (int): number of 4 KB files
+
+        Returns:
+
+            results (dict): create_per_s, stat_per_s and delete_per_s
+    """
+    data = os.urandom(4096)
+    small_dir = os.path.join(path, "small")
+    os.mkdir(small_dir)
+    names = [os.path.join(small_dir, f"{i}.tmp") for i in range(n_files)]
+
+    start = time.perf_counter()
+    for name in names:
+        with open(name, "wb") as f:
+            f.write(data)
+    create = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for name in names:
+        os.stat(name)
+    stat = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for name in names:
+        os.remove(name)
+    delete = time.perf_counter() - start
+    os.rmdir(small_dir)
+
+    return {
+        "create_per_s": n_files / create,
+        "stat_per_s": n_files / max(stat, 1e-9),
+        "delete_per_s": n_files / delete,
+    }
+
+
+def bench_fsync(path, n_syncs):
+    """
+    Times small writes that are each followed by an fsync
+
+        Arguments:
+
+            path    (str): directory to benchmark in
+            n_syncs (int): number of fsyncs
+
+        Returns:
+
+            results (dict): fsync_ms_median and fsync_ms_p95
+    """
+    file_path = os.path.join(path, "fsync.bin")
+    data = os.urandom(4096)
+    latencies = []
+
+    fd = os.open(file_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    for _ in range(n_syncs):
+        os.write(fd, data)
+        start = time.perf_counter()
+        os.fsync(fd)
+        latencies.append((time.perf_counter() - start) * 1000)
+    os.close(fd)
+    os.remove(file_path)
+
+    latencies.sort()
+    return {
+        "fsync_ms_median": statistics.median(latencies),
+        "fsync_ms_p95": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+    }
+
+
+def bench_directory(path, size_mb=256, n_files=1000, n_syncs=50):
+    """
+    Runs every benchmark in a temporary directory inside path
+
+        Arguments:
+
+            path    (str): candidate directory
+            size_mb (int): size of the sequential file, capped at 5% of the free space
+            n_files (int): number of small files
+            n_syncs (int): number of fsyncs
+
+        Returns:
+
+            results (dict): path, free_GB, and the results of each benchmark, or error if
+                            the directory can't be used
+    """
+    try:
+        free = shutil.disk_usage(path).free
+        results = {"path": os.path.abspath(path), "free_GB": free / 1e9, "error": None}
+        size_mb = max(1, min(size_mb, int(free * 0.05 / 1e6)))
+
+        with tempfile.TemporaryDirectory(dir=path, prefix=".bcbio_bench.") as tmp_dir:
+            results.update(bench_sequential(tmp_dir, size_mb))
+            results.update(bench_small_files(tmp_dir, n_files))
+            results.update(bench_fsync(tmp_dir, n_syncs))
+    except OSError as e:
+        return {"path": os.path.abspath(path), "free_GB": 0, "error": str(e)}
+
+    return results
+
+
+def recommend(results, input_size_gb):
+    """
+    Picks the work/ and final/ directories for a run from benchmark results
+
+        Arguments:
+
+            results       (list):  as returned by bench_directory, one per candidate
+            input_size_gb (float): total size of the input FASTQs
+
+        Returns:
+
+            recommendation (dict): work and final (paths, or None if no candidate has room),
+                                   and the reason for each
+    """
+    usable = [r for r in results if not r["error"]]
+
+    def best(required_gb, score):
+        roomy = [r for r in usable if r["free_GB"] >= required_gb]
+        return max(roomy, key=score) if roomy else None
+
+    # work/ is scored on small file rate and fsync latency as much as on throughput,
+    # final/ is written sequentially once, so only its write throughput matters
+    work = best(
+        input_size_gb * WORK_SPACE_FACTOR,
+        lambda r: min(r["write_MBps"], r["read_MBps"]) * r["create_per_s"] / (1 + r["fsync_ms_median"]),
+    )
+    final = best(input_size_gb * FINAL_SPACE_FACTOR, lambda r: r["write_MBps"])
+
+    return {
+        "work": work["path"] if work else None,
+        "work_reason": (
+            f"needs {input_size_gb * WORK_SPACE_FACTOR:.0f} GB free, fastest for small files and large I/O"
+            if work else f"no candidate has {input_size_gb * WORK_SPACE_FACTOR:.0f} GB free"
+        ),
+        "final": final["path"] if final else None,
+        "final_reason": (
+            f"needs {input_size_gb * FINAL_SPACE_FACTOR:.0f} GB free, fastest sequential writes"
+            if final else f"no candidate has {input_size_gb * FINAL_SPACE_FACTOR:.0f} GB free"
+        ),
+    }
@@ -0,0 +1,77 @@
+"""
+test_process_control
+
+Stopping a run must only ever clean up the work/ directory of a bcbio run, never another
+folder that happens to be named work.
+
+    python -m pytest tests/
+"""
+
+# native
+from pathlib import Path
+import subprocess
+import sys
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent)) # the modules live in the repo root
+
+# lib
+import process_control
+
+
+def _sleep_in(cwd):
+    return subprocess.Popen(["sleep", "30"], cwd=cwd)
+
+
+def _bcbio_run(root, run="run1"):
+    # * the layout bcbio -w template and a started run leave, see bcbio_helper.start_bcbio
+    work_dir = root / run / "work"
+    (work_dir / "log").mkdir(parents=True)
+    (work_dir / "log" / "bcbio-nextgen.log").write_text("started\n")
+    (root / run / "config").mkdir()
+    (root / run / "config" / f"{run}.yaml").write_text("details: []\n")
+    return work_dir
+
+
+def test_unrelated_work_tx_survives(tmp_path):
+    unrelated = tmp_path / "work" / "projects" / "rna" / "tx"
+    unrelated.mkdir(parents=True)
+    (unrelated / "keep.bam").write_text("data")
+    (tmp_path / "work" / "mygui").mkdir()
+
+    process = _sleep_in(tmp_path / "work" / "mygui")
+    report = process_control.shutdown_tree(process.pid, timeout=5)
+    process.wait()
+
+    assert report["work_dirs"] == []
+    assert report["tx_removed"] == []
+    assert (unrelated / "keep.bam").read_text() == "data"
+    assert not (tmp_path / "work" / "bcbio_helper_partial.json").exists()
+
+
+def test_given_work_dir_without_markers_is_left_alone(tmp_path):
+    # * stopped during create_csv, bcbio hasn't made the run's folders yet
+    unrelated = tmp_path / "run1" / "work" / "tx"
+    unrelated.mkdir(parents=True)
+
+    process = _sleep_in(tmp_path)
+    report = process_control.shutdown_tree(process.pid, timeout=5, work_dir=tmp_path / "run1" / "work")
+    process.wait()
+
+    assert report["tx_removed"] == []
+    assert unrelated.is_dir()
+
+
+def test_run_work_dir_is_reclaimed(tmp_path):
+    work_dir = _bcbio_run(tmp_path)
+    (work_dir / "align" / "S1" / "tx").mkdir(parents=True)
+    (tmp_path / "work" / "tx").mkdir(parents=True) # another work/ next to the run
+
+    process = _sleep_in(tmp_path)
+    report = process_control.shutdown_tree(
+        process.pid, timeout=5, work_dir=process_control.run_work_dir(tmp_path, "run1.csv")
+    )
+    process.wait()
+
+    assert report["tx_removed"] == [str(work_dir / "align" / "S1" / "tx")]
+    assert (work_dir / "log" / "bcbio-nextgen.log").exists()
+    assert (tmp_path / "work" / "tx").is_dir()
@@ -0,0 +1,128 @@
+"""
+tool_probe
+
+Resolves the executables bcbio needs on $PATH and collects their versions.
+
+Every probe runs at the same time, each with its own timeout. Versions are cached in
+<cache>/tool_versions.json (see local_cache.py) by resolved binary path and modification
+time, so a repeat check only runs the tools that were installed or updated since.
+"""
+
+# native
+from concurrent.futures import ThreadPoolExecutor
+import os
+import re
+import shutil
+import subprocess
+
+# lib
+import local_cache
+
+
+TOOLS = { # executable -> (arguments that print its version, critical for bcbio)
+    "bcbio_nextgen.py": (["--version"], True),
+    "samtools": (["--version"], True),
+    "hisat2": (["--version"], True),
+    "salmon": (["--version"], True),
+    "STAR": (["--version"], False),
+    "bwa": ([], False), # bwa only prints its version in the usage text
+    "fastqc": (["--version"], False),
+    "multiqc": (["--version"], False),
+    "gffread": (["--version"], False),
+    "featureCounts": (["-v"], False),
+    "qualimap": (["--version"], False),
+}
+VERSION = re.compile(r"\bv?(\d+\.\d+(?:\.\d+)?(?:[-.\w]*))")
+
+
+def _version(output):
+    for line in output.splitlines():
+        match = VERSION.search(line)
+        if match:
+            return match.group(1)
+    return None
+
+
+def probe_tool(name, arguments, timeout=5):
+    """
+    Resolves one executable on $PATH and runs it to get its version
+
+        Arguments:
+
+            name      (str):   the executable
+            arguments (list):  arguments that make it print its version
+            timeout   (float): seconds to wait for it
+
+        Returns:
+
+            result (dict): name, path (None if not found), mtime, version and error
+    """
+    path = shutil.which(name)
+    result = {"name": name, "path": path, "mtime": None, "version": None, "error": None}
+    if path is None:
+        result["error"] = "not found"
+        return result
+
+    path = os.path.realpath(path)
+    result["path"] = path
+    result["mtime"] = os.stat(path).st_mtime
+
+    try:
+        run = subprocess.run(
+            [path] + arguments,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            stdin=subprocess.DEVNULL,
+            timeout=timeout,
+            universal_newlines=True,
+        )
+        result["version"] = _version(run.stdout)
+        if result["version"] is None:
+            result["error"] = f"no version in output (exit code {run.returncode})"
+    except subprocess.TimeoutExpired:
+        result["error"] = f"timed out after {timeout}s"
+    except OSError as e:
+        result["error"] = str(e)
+    return result
+
+
+def probe_tools(tools=None, timeout=5, workers=16, use_cache=True):
+    """
+    Resolves and versions every tool at the same time
+
+        Arguments:
+
+            tools     (dict):  executable -> (version arguments, critical), default TOOLS
+            timeout   (float): seconds to wait for each tool
+            workers   (int):   number of tools to run at once
+            use_cache (bool):  reuse versions of binaries that have not changed
+
+        Returns:
+
+            results (list): one probe_tool result per tool, plus "critical" and "cached", in tools order
+    """
+    tools = tools or TOOLS
+    cache_path = local_cache.cache_dir() / "tool_versions.json"
+    cache = local_cache.read_json(cache_path, {}) if use_cache else {}
+
+    def probe(name):
+        arguments, critical = tools[name]
+        path = shutil.which(name)
+        if path is not None: # cache hits don't start a process at all
+            path = os.path.realpath(path)
+            cached = cache.get(path)
+            if cached and cached["mtime"] == os.stat(path).st_mtime and cached["version"]:
+                return dict(cached, name=name, critical=critical, cached=True)
+        return dict(probe_tool(name, arguments, timeout), critical=critical, cached=False)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool: # the probes wait on subprocesses, threads are enough
+        results = list(pool.map(probe, tools))
+
+    fresh = {r["path"]: r for r in results if r["path"] and r["version"] and not r["cached"]}
+    if use_cache and fresh:
+        cache.update(
+            {path: {"path": path, "mtime": r["mtime"], "version": r["version"], "error": None} for path, r in fresh.items()}
+        )
+        local_cache.write_json(cache_path, cache)
+
+    return results
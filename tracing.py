@@ -0,0 +1,198 @@
+"""
+tracing
+
+Spans for the stages of a bcbio_helper run, written as a Chrome trace event file that
+chrome://tracing, Perfetto (ui.perfetto.dev) and speedscope open.
+
+Tracing is off until start() is called, and span() is then nearly free. Each span records its
+start, duration, attributes (samples, bytes scanned, ...) and, in its args, its own id and the
+id of the span it ran in, so the parent/child links survive outside the viewer's nesting.
+Subprocesses run through run() get a span of their own with their pid, exit code and the CPU
+time they and their children used.
+"""
+
+# native
+from contextlib import contextmanager
+import itertools
+import json
+import os
+import resource
+import subprocess
+import threading
+import time
+
+
+class Span:
+    """
+    One timed stage, see span()
+    """
+
+    def __init__(self, name, span_id, parent_id, attributes):
+        self.name = name
+        self.id = span_id
+        self.parent_id = parent_id
+        self.attributes = attributes
+        self.start = time.perf_counter()
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+
+class Tracer:
+    """
+    Collects spans in memory and writes them when the run ends
+
+        Arguments:
+
+            path (Path): the trace file to write
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.events = []
+        self.ids = itertools.count(1)
+        self.local = threading.local() # each thread's stack of open spans
+        self.lock = threading.Lock()
+        self.origin = time.perf_counter()
+        self.pid = os.getpid()
+
+    def stack(self):
+        if not hasattr(self.local, "stack"):
+            self.local.stack = []
+        return self.local.stack
+
+    def open(self, name, attributes):
+        stack = self.stack()
+        opened = Span(name, next(self.ids), stack[-1].id if stack else None, attributes)
+        stack.append(opened)
+        return opened
+
+    def close(self, closed):
+        end = time.perf_counter()
+        self.stack().remove(closed)
+        event = {
+            "name": closed.name,
+            "cat": "bcbio_helper",
+            "ph": "X", # a complete event, start and duration
+            "ts": (closed.start - self.origin) * 1e6,
+            "dur": (end - closed.start) * 1e6,
+            "pid": self.pid,
+            "tid": threading.get_ident(),
+            "args": dict(closed.attributes, span_id=closed.id, parent_id=closed.parent_id),
+        }
+        with self.lock:
+            self.events.append(event)
+
+    def write(self):
+        with self.lock:
+            events = list(self.events)
+        metadata = [{"name": "process_name", "ph": "M", "pid": self.pid, "args": {"name": "bcbio_helper"}}]
+        with open(self.path, "w") as f:
+            json.dump({"traceEvents": metadata + events, "displayTimeUnit": "ms"}, f, default=str)
+
+
+_tracer = None
+
+
+def start(path):
+    """
+    Turns tracing on for this process
+
+        Arguments:
+
+            path (Path): where finish() writes the trace
+
+        Returns:
+
+            None
+    """
+    global _tracer
+    _tracer = Tracer(path)
+
+
+def finish():
+    """
+    Writes the trace and turns tracing off
+
+        Arguments:
+
+            None
+
+        Returns:
+
+            path (Path): the trace file, None if tracing was off
+    """
+    global _tracer
+    if _tracer is None:
+        return None
+    tracer, _tracer = _tracer, None
+    tracer.write()
+    return tracer.path
+
+
+@contextmanager
+def span(name, **attributes):
+    """
+    Times the code in a with block as a span, inside the span that is open on this thread
+
+        Arguments:
+
+            name       (str): the stage, e.g. create_csv
+            attributes (any): shown with the span, more can be added with annotate()
+
+        Returns:
+
+            span (Span): None when tracing is off
+    """
+    tracer = _tracer
+    if tracer is None:
+        yield None
+        return
+    opened = tracer.open(name, attributes)
+    try:
+        yield opened
+    except BaseException as e: # KeyboardInterrupt too, the trace shows where the run was stopped
+        opened.set(error=f"{type(e).__name__}: {e}")
+        raise
+    finally:
+        tracer.close(opened)
+
+
+def annotate(**attributes):
+    """
+    Adds attributes to the innermost open span of this thread, does nothing when tracing is off
+    """
+    tracer = _tracer
+    if tracer is not None and tracer.stack():
+        tracer.stack()[-1].set(**attributes)
+
+
+def _children_cpu():
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def run(args, **kwargs):
+    """
+    subprocess.run, in a span named after the program
+
+        Arguments:
+
+            args   (list): the command
+            kwargs (any):  passed on to subprocess.Popen
+
+        Returns:
+
+            completed (CompletedProcess): args and returncode, output isn't captured
+    """
+    with span(os.path.basename(str(args[0])), command=" ".join(str(arg) for arg in args), cwd=os.getcwd()):
+        cpu = _children_cpu()
+        with subprocess.Popen(args, **kwargs) as process:
+            annotate(pid=process.pid)
+            try:
+                returncode = process.wait()
+            except BaseException:
+                process.kill()
+                raise
+        annotate(returncode=returncode, cpu_seconds=round(_children_cpu() - cpu, 3))
+    return subprocess.CompletedProcess(args, returncode)